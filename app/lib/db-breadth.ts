@@ -1,19 +1,20 @@
 // lib/db-breadth.ts
 import Database from 'better-sqlite3';
 import path from 'path';
+import { openPublished, PublishedDb } from '@/lib/db-published';
 
-let breadthDb: Database.Database | null = null;
-
-export default function getBreadthDb() {
-  if (breadthDb) return breadthDb;
+let breadthDb: PublishedDb | null = null;
 
+export default function getBreadthDb(): Database.Database {
   const dbPath = process.env.SQLITE_BREADTH_PATH
     ? path.resolve(process.cwd(), process.env.SQLITE_BREADTH_PATH)
     : path.resolve(process.cwd(), 'data', 'breadth.db'); // adjust path if needed
 
-  breadthDb = new Database(dbPath, { fileMustExist: true });
-  breadthDb.pragma('journal_mode = WAL');
-  breadthDb.pragma('foreign_keys = ON');
+  // Reopened when build_breadth publishes a new version
+  breadthDb = openPublished(breadthDb, dbPath, (db) => {
+    db.pragma('journal_mode = WAL');
+    db.pragma('foreign_keys = ON');
+  });
 
-  return breadthDb;
+  return breadthDb.db;
 }
@@ -1,19 +1,20 @@
 // lib/db-metrics.ts
 import Database from 'better-sqlite3';
 import path from 'path';
+import { openPublished, PublishedDb } from '@/lib/db-published';
 
-let metricsDb: Database.Database | null = null;
-
-export function getMetricsDb() {
-  if (metricsDb) return metricsDb;
+let metricsDb: PublishedDb | null = null;
 
+export function getMetricsDb(): Database.Database {
   const dbPath = process.env.SQLITE_METRICS_PATH
     ? path.resolve(process.cwd(), process.env.SQLITE_METRICS_PATH)
     : path.resolve(process.cwd(), 'data', 'metrics.db');
 
-  metricsDb = new Database(dbPath, { fileMustExist: true });
-  metricsDb.pragma('journal_mode = WAL');
-  metricsDb.pragma('foreign_keys = ON');
+  // Reopened when build_metrics publishes a new version
+  metricsDb = openPublished(metricsDb, dbPath, (db) => {
+    db.pragma('journal_mode = WAL');
+    db.pragma('foreign_keys = ON');
+  });
 
-  return metricsDb;
+  return metricsDb.db;
 }
@@ -0,0 +1,66 @@
+// lib/db-published.ts
+// Databases the ETL rebuilds (metrics.db, breadth.db) are published as new
+// versioned files next to the configured path, with `<path>.current` naming
+// the live one (see etl/db_publish.py). Handles follow that pointer, so a
+// rebuild shows up on the next request without a restart; the pointer is
+// only re-read when it has been replaced.
+import Database from 'better-sqlite3';
+import fs from 'fs';
+import path from 'path';
+
+export type PublishedDb = {
+  file: string;
+  db: Database.Database;
+  // previous handle: a request that fetched it before the switch may still use it
+  retired: Database.Database | null;
+};
+
+// resolved pointer per dbPath, keyed by the pointer file's identity: publish
+// replaces it by rename, so a new version always brings a new inode
+const resolved = new Map<string, { stamp: string; file: string }>();
+
+/** File holding the live database behind dbPath (dbPath itself if never published). */
+export function publishedPath(dbPath: string): string {
+  const pointer = `${dbPath}.current`;
+  let stamp = '';
+  try {
+    const st = fs.statSync(pointer);
+    stamp = `${st.ino}:${st.mtimeMs}`;
+  } catch {
+    // no pointer yet
+  }
+  const cached = resolved.get(dbPath);
+  if (cached && cached.stamp === stamp) return cached.file;
+
+  let name = '';
+  if (stamp) {
+    try {
+      name = fs.readFileSync(pointer, 'utf8').trim();
+    } catch {
+      // removed between stat and read: resolve again next call
+      stamp = '';
+    }
+  }
+  const file = name ? path.join(path.dirname(dbPath), name) : dbPath;
+  resolved.set(dbPath, { stamp, file });
+  return file;
+}
+
+/**
+ * The handle for the live version of dbPath: `handle` while the pointer is
+ * unchanged, otherwise a new one (set up by `setup`). The handle it replaces
+ * is closed one switch later.
+ */
+export function openPublished(
+  handle: PublishedDb | null,
+  dbPath: string,
+  setup: (db: Database.Database) => void
+): PublishedDb {
+  const file = publishedPath(dbPath);
+  if (handle && handle.file === file) return handle;
+
+  const db = new Database(file, { fileMustExist: true });
+  setup(db);
+  handle?.retired?.close();
+  return { file, db, retired: handle?.db ?? null };
+}
@@ -0,0 +1,406 @@
+#!/usr/bin/env python3
+# backfill_gaps.py
+# Find (symbol, session) holes in stocks.db for the tracked universe of
+# stocks_lists.db and fill them with as few Polygon requests as possible.
+#
+# Every symbol is expected to have a bar on each trading session between
+# its first and last price row. A missing bar is covered either by the
+# grouped-daily request of its session (all symbols, one day) or by a
+# ticker-range request of its symbol (one symbol, all its holes); the
+# cheapest mix is a minimum vertex cover of the bipartite symbol/session
+# gap graph, found with König's theorem from a maximum matching.
+
+import argparse
+import csv
+import os
+import sqlite3
+from collections import defaultdict
+from datetime import datetime
+from typing import Dict, List, Optional, Sequence, Set, Tuple
+from dotenv import load_dotenv
+
+from fetch_journal import STATUS_EMPTY, STATUS_FAILED, STATUS_OK, create_journal_table, record_session
+from ingest_policy import IngestPolicy, add_policy_arguments, policy_from_args
+from polygon_fetch import (
+    DEFAULT_BASE_URL,
+    DEFAULT_CONCURRENCY,
+    DEFAULT_REQUESTS_PER_MINUTE,
+    FetchResult,
+    PolygonFetcher,
+)
+from price_reader import date_bounds, session_dates
+from trading_calendar import get_calendar
+from utils import STOCKS_LISTS_DB
+
+STOCKS_DB = "../data/stocks.db"
+
+INSERT_PRICES_SQL = """
+    INSERT OR IGNORE INTO prices
+        (symbol, date, open, high, low, close, volume)
+    VALUES (?, ?, ?, ?, ?, ?, ?)
+"""
+
+Gap = Tuple[str, str]  # (symbol, session)
+
+# Bars of {symbol} on sessions in [{lo}, {hi}]: its rows in the range minus
+# those on holiday dates (CROSS JOIN keeps the few holiday dates outer, so
+# both counts are primary-key lookups)
+PRESENT_SQL = """
+    ((SELECT COUNT(*) FROM prices p
+      WHERE p.symbol = {symbol} AND p.date BETWEEN {lo} AND {hi})
+     - (SELECT COUNT(*) FROM temp.non_session_dates n
+        CROSS JOIN prices p ON p.symbol = {symbol} AND p.date = n.date
+        WHERE n.date BETWEEN {lo} AND {hi}))
+"""
+EXPECTED_SQL = """
+    (SELECT COUNT(*) FROM temp.calendar_sessions c WHERE c.session BETWEEN {lo} AND {hi})
+"""
+SKIP_UNFILLABLE_SQL = """
+    AND NOT EXISTS (
+        SELECT 1 FROM unfillable_gaps u WHERE u.symbol = h.symbol AND u.session = c.session
+    )
+"""
+
+
+# ---------------------------------------------------------------------
+# 1) Scan
+# ---------------------------------------------------------------------
+def create_unfillable_table(conn: sqlite3.Connection) -> None:
+    """Holes the API had no bar for either (halts, late listings)."""
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS unfillable_gaps (
+            symbol     TEXT NOT NULL,
+            session    TEXT NOT NULL,
+            checked_at TEXT NOT NULL,
+            PRIMARY KEY (symbol, session)
+        ) WITHOUT ROWID
+        """
+    )
+    conn.commit()
+
+
+def load_sessions(conn: sqlite3.Connection) -> None:
+    """
+    temp.calendar_sessions: every trading session over the prices span.
+    temp.non_session_dates: price dates that are not sessions (holiday rows).
+    """
+    calendar = get_calendar()
+    first, last = date_bounds(conn)
+    for table in ("calendar_sessions", "non_session_dates"):
+        conn.execute(f"DROP TABLE IF EXISTS temp.{table}")
+    conn.execute("CREATE TEMP TABLE calendar_sessions (session TEXT PRIMARY KEY) WITHOUT ROWID")
+    conn.execute("CREATE TEMP TABLE non_session_dates (date TEXT PRIMARY KEY) WITHOUT ROWID")
+    if first is not None:
+        sessions = calendar.sessions(first, last)
+        conn.executemany("INSERT INTO temp.calendar_sessions VALUES (?)", ((s,) for s in sessions))
+        dates = session_dates(conn)
+        conn.executemany(
+            "INSERT INTO temp.non_session_dates VALUES (?)",
+            ((d,) for d in calendar.non_sessions(dates)),
+        )
+    conn.commit()
+
+
+def scan_gaps(
+    conn: sqlite3.Connection,
+    lists_db: str = STOCKS_LISTS_DB,
+    start: Optional[str] = None,
+    end: Optional[str] = None,
+    recheck: bool = False,
+) -> List[Gap]:
+    """
+    Missing (symbol, session) bars of the tracked universe, within each
+    symbol's own first..last price date (and [start, end] if given).
+
+    Symbols are first compared by count (bars on sessions vs sessions in
+    their span, all primary-key range lookups), so only symbols that
+    actually have holes are probed session by session. Holes recorded in
+    unfillable_gaps are left out unless `recheck`.
+    """
+    load_sessions(conn)
+    span = dict(symbol="s.symbol", lo="s.first_date", hi="s.last_date")
+    conn.execute("ATTACH DATABASE ? AS lists", (lists_db,))
+    try:
+        rows = conn.execute(
+            f"""
+            WITH spans AS MATERIALIZED (
+                SELECT t.ticker AS symbol,
+                       (SELECT MIN(date) FROM prices WHERE symbol = t.ticker) AS first_date,
+                       (SELECT MAX(date) FROM prices WHERE symbol = t.ticker) AS last_date
+                FROM (SELECT DISTINCT ticker FROM lists.stocks WHERE ticker IS NOT NULL) t
+            ),
+            holed AS MATERIALIZED (
+                SELECT s.symbol, s.first_date, s.last_date
+                FROM spans s
+                WHERE s.first_date IS NOT NULL
+                  AND {PRESENT_SQL.format(**span)} < {EXPECTED_SQL.format(**span)}
+            )
+            SELECT h.symbol, c.session
+            FROM holed h
+            JOIN temp.calendar_sessions c
+              ON c.session BETWEEN MAX(h.first_date, :start) AND MIN(h.last_date, :end)
+            WHERE NOT EXISTS (
+                SELECT 1 FROM prices p WHERE p.symbol = h.symbol AND p.date = c.session
+            )
+            {"" if recheck else SKIP_UNFILLABLE_SQL}
+            ORDER BY h.symbol, c.session
+            """,
+            {"start": start or "0000-00-00", "end": end or "9999-99-99"},
+        ).fetchall()
+    finally:
+        conn.commit()  # DETACH fails inside a transaction
+        conn.execute("DETACH DATABASE lists")
+    return rows
+
+
+# ---------------------------------------------------------------------
+# 2) Plan
+# ---------------------------------------------------------------------
+def _max_matching(adjacency: Dict[str, List[str]]) -> Dict[str, str]:
+    """Maximum bipartite matching (augmenting paths), session -> symbol."""
+    match_session: Dict[str, str] = {}
+    match_symbol: Dict[str, str] = {}
+    for root in adjacency:
+        # Iterative DFS for an augmenting path from `root`
+        parent: Dict[str, str] = {}  # session -> symbol it was reached from
+        stack = [(root, iter(adjacency[root]))]
+        seen: Set[str] = set()
+        found = None
+        while stack and found is None:
+            symbol, sessions = stack[-1]
+            for session in sessions:
+                if session in seen:
+                    continue
+                seen.add(session)
+                parent[session] = symbol
+                if session not in match_session:
+                    found = session
+                else:
+                    nxt = match_session[session]
+                    stack.append((nxt, iter(adjacency[nxt])))
+                break
+            else:
+                stack.pop()
+        # Flip the path
+        session = found
+        while session is not None:
+            symbol = parent[session]
+            previous = match_symbol.get(symbol)
+            match_session[session] = symbol
+            match_symbol[symbol] = session
+            session = previous if symbol != root else None
+    return match_session
+
+
+def plan_requests(gaps: Sequence[Gap]) -> Tuple[List[str], List[Tuple[str, str, str]]]:
+    """
+    Minimum set of requests covering every gap: (grouped-daily sessions,
+    ticker ranges as (symbol, first missing, last missing)).
+    """
+    adjacency: Dict[str, List[str]] = defaultdict(list)
+    for symbol, session in gaps:
+        adjacency[symbol].append(session)
+
+    match_session = _max_matching(adjacency)
+    matched_symbols = set(match_session.values())
+
+    # König: alternate from unmatched symbols (any edge to a session, the
+    # matching edge back to a symbol); the cover is the unreached symbols
+    # plus the reached sessions
+    reached_symbols = [s for s in adjacency if s not in matched_symbols]
+    seen_symbols = set(reached_symbols)
+    reached_sessions: Set[str] = set()
+    while reached_symbols:
+        symbol = reached_symbols.pop()
+        for session in adjacency[symbol]:
+            if session in reached_sessions:
+                continue
+            reached_sessions.add(session)
+            partner = match_session.get(session)
+            if partner is not None and partner not in seen_symbols:
+                seen_symbols.add(partner)
+                reached_symbols.append(partner)
+
+    sessions = sorted(reached_sessions)
+    ranges = [
+        (symbol, min(adjacency[symbol]), max(adjacency[symbol]))
+        for symbol in sorted(adjacency)
+        if symbol not in seen_symbols
+    ]
+    return sessions, ranges
+
+
+# ---------------------------------------------------------------------
+# 3) Fill
+# ---------------------------------------------------------------------
+def backfill(
+    conn: sqlite3.Connection,
+    fetcher: PolygonFetcher,
+    sessions: List[str],
+    ranges: List[Tuple[str, str, str]],
+    policy: Optional[IngestPolicy] = None,
+) -> Dict[str, int]:
+    """
+    Run the planned requests; the rows `policy` admits (all without one)
+    are committed per response.
+    """
+    totals = {"rows": 0, "failed": 0}
+    policy = policy or IngestPolicy()
+
+    def write(result: FetchResult) -> None:
+        label = f"{result.symbol} {result.date}.." if result.symbol else result.date
+        # The journal counts the rows the ingest policy keeps, i.e. stored
+        rows: List[tuple] = []
+        if result.ok and result.rows:
+            rows, _ = policy.filter_rows(result.rows)
+        if result.symbol is None:
+            status = STATUS_OK if result.rows else STATUS_EMPTY
+            if not result.ok:
+                status = STATUS_FAILED
+            record_session(conn, result.date, status, len(rows), result.attempts, result.error)
+        if not result.ok:
+            print(f"[WARN] {label}: {result.error} after {result.attempts} attempt(s)")
+            totals["failed"] += 1
+        elif rows:
+            conn.executemany(INSERT_PRICES_SQL, rows)
+            totals["rows"] += len(rows)
+        conn.commit()
+
+    if sessions:
+        print(f"[INFO] Fetching {len(sessions)} grouped-daily session(s)...")
+        fetcher.fetch_all(sessions, write)
+    if ranges:
+        print(f"[INFO] Fetching {len(ranges)} ticker range(s)...")
+        fetcher.fetch_ticker_ranges(ranges, write)
+    return totals
+
+
+def still_missing(conn: sqlite3.Connection, gaps: Sequence[Gap]) -> List[Gap]:
+    cur = conn.cursor()
+    return [
+        gap
+        for gap in gaps
+        if cur.execute(
+            "SELECT 1 FROM prices WHERE symbol = ? AND date = ?", gap
+        ).fetchone() is None
+    ]
+
+
+def write_report(path: str, gaps: Sequence[Gap], missing: Set[Gap]) -> None:
+    with open(path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["symbol", "session", "status"])
+        for gap in gaps:
+            writer.writerow([*gap, "unfillable" if gap in missing else "filled"])
+    print(f"[INFO] Report written to {path}")
+
+
+# ---------------------------------------------------------------------
+# 4) Main entry point
+# ---------------------------------------------------------------------
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Find and backfill missing (symbol, session) bars in stocks.db."
+    )
+    parser.add_argument("--start", help="Only holes on or after this date (YYYY-MM-DD)")
+    parser.add_argument("--end", help="Only holes on or before this date (YYYY-MM-DD)")
+    parser.add_argument(
+        "--dry-run", action="store_true", help="Only scan and print the request plan"
+    )
+    parser.add_argument(
+        "--recheck",
+        action="store_true",
+        help="Also retry holes an earlier run found unfillable",
+    )
+    parser.add_argument("--report", help="Write a CSV of every hole and its outcome")
+    parser.add_argument(
+        "--requests-per-minute",
+        type=float,
+        default=float(os.environ.get("POLYGON_REQUESTS_PER_MINUTE", DEFAULT_REQUESTS_PER_MINUTE)),
+    )
+    parser.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY)
+    parser.add_argument(
+        "--base-url", default=os.environ.get("POLYGON_BASE_URL", DEFAULT_BASE_URL)
+    )
+    add_policy_arguments(parser)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    if not os.path.exists(STOCKS_DB):
+        raise SystemExit(f"Database file not found: {STOCKS_DB}")
+
+    conn = sqlite3.connect(STOCKS_DB)
+    try:
+        create_unfillable_table(conn)
+        create_journal_table(conn)
+
+        gaps = scan_gaps(conn, STOCKS_LISTS_DB, args.start, args.end, recheck=args.recheck)
+        symbols = {symbol for symbol, _ in gaps}
+        print(f"[INFO] {len(gaps)} missing bar(s) across {len(symbols)} symbol(s).")
+        if not gaps:
+            return
+
+        sessions, ranges = plan_requests(gaps)
+        print(
+            f"[INFO] Plan: {len(sessions) + len(ranges)} request(s) - "
+            f"{len(sessions)} grouped-daily session(s), {len(ranges)} ticker range(s)."
+        )
+        if args.dry_run:
+            for session in sessions:
+                print(f"  grouped  {session}")
+            for symbol, first, last in ranges:
+                print(f"  ticker   {symbol} {first}..{last}")
+            return
+
+        load_dotenv()
+        api_key = os.environ.get("POLYGON_API_KEY")
+        if not api_key:
+            raise SystemExit("POLYGON_API_KEY not set. Please create a .env file with POLYGON_API_KEY=your_key_here")
+
+        fetcher = PolygonFetcher(
+            api_key,
+            base_url=args.base_url,
+            requests_per_minute=args.requests_per_minute,
+            concurrency=args.concurrency,
+        )
+        totals = backfill(conn, fetcher, sessions, ranges, policy_from_args(args, conn))
+
+        missing = still_missing(conn, gaps)
+        # Holes the API answered without a bar; a failed request says nothing
+        if not totals["failed"]:
+            now = datetime.now().isoformat(timespec="seconds")
+            conn.executemany(
+                "INSERT OR REPLACE INTO unfillable_gaps (symbol, session, checked_at) VALUES (?, ?, ?)",
+                ((symbol, session, now) for symbol, session in missing),
+            )
+        filled = set(gaps) - set(missing)
+        conn.executemany(
+            "DELETE FROM unfillable_gaps WHERE symbol = ? AND session = ?", filled
+        )
+        conn.commit()
+
+        print(
+            f"[INFO] Filled {len(filled)} of {len(gaps)} missing bar(s) "
+            f"({totals['rows']} rows kept, {totals['failed']} failed request(s))."
+        )
+        by_symbol: Dict[str, int] = defaultdict(int)
+        for symbol, _ in filled:
+            by_symbol[symbol] += 1
+        for symbol in sorted(by_symbol):
+            print(f"  {symbol}: {by_symbol[symbol]} bar(s) filled")
+        if missing:
+            print(f"[WARN] {len(missing)} bar(s) still missing (no data from the API).")
+
+        if args.report:
+            write_report(args.report, gaps, set(missing))
+
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
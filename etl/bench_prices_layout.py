@@ -0,0 +1,133 @@
+# bench_prices_layout.py
+# Benchmark of the prices storage layouts (see migrate_prices.py): file size,
+# the metrics of the last sessions (build_metrics) and the full breadth scan
+# (build_breadth.process_prices), on copies of stocks.db.
+#
+#   python bench_prices_layout.py                       # ../data/stocks.db
+#   python bench_prices_layout.py --db /tmp/stocks.db --sessions 60
+#   python bench_prices_layout.py --workdir /mnt/scratch --keep
+#
+# Each copy is VACUUMed before it is measured. Results are compared with the
+# legacy layout's; the scaled layout may differ where prices have more
+# than 4 decimals.
+import argparse
+import os
+import shutil
+import sqlite3
+import tempfile
+import time
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+import build_breadth
+from build_breadth import create_breadth_db, insert_groups, process_prices
+from metrics_engine import iter_metrics_by_date
+from migrate_prices import PRICE_SCALE, copy_database, to_compact, to_legacy
+from price_reader import date_before, date_bounds, prices_layout
+from utils import STOCKS_LISTS_DB, build_ticker_memberships, get_all_lists, get_all_sectors
+
+STOCKS_DB = "../data/stocks.db"
+
+# (name, compact, price scale)
+LAYOUTS = (("legacy", False, 1), ("compact", True, 1), ("scaled", True, PRICE_SCALE))
+
+
+def prepare(src: str, work_dir: str, name: str, compact: bool, scale: int) -> str:
+    """Copy src into work_dir/<name>.db in the given layout, VACUUMed."""
+    path = os.path.join(work_dir, f"{name}.db")
+    copy_database(src, path)
+    conn = sqlite3.connect(path)
+    try:
+        layout = prices_layout(conn)
+        if layout.compact and (not compact or layout.scale != scale):
+            to_legacy(conn)
+        if compact and not prices_layout(conn).compact:
+            to_compact(conn, scale)
+        conn.execute("VACUUM")
+    finally:
+        conn.close()
+    return path
+
+
+def time_metrics(path: str, sessions: int) -> Tuple[float, List[tuple]]:
+    """iter_metrics_by_date over the last `sessions` dates (what build_metrics runs)."""
+    conn = sqlite3.connect(path)
+    try:
+        t0 = time.perf_counter()
+        _, end = date_bounds(conn)
+        start = date_before(conn, end, sessions - 1) if sessions > 1 else end
+        rows = [row for _, day in iter_metrics_by_date(conn, start or end, end) for row in day]
+        return time.perf_counter() - t0, rows
+    finally:
+        conn.close()
+
+
+def time_breadth(path: str, groups: Tuple, workers: int) -> Tuple[float, np.ndarray]:
+    """build_breadth.process_prices over the whole history."""
+    build_breadth.STOCKS_PRICES_DB = path
+    t0 = time.perf_counter()
+    group_stats, _ = process_prices(*groups, workers=workers)
+    return time.perf_counter() - t0, group_stats.counts
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description="Compare the prices storage layouts of stocks.db.")
+    parser.add_argument("--db", default=STOCKS_DB, help=f"Source database (default: {STOCKS_DB})")
+    parser.add_argument("--lists-db", default=STOCKS_LISTS_DB)
+    parser.add_argument("--sessions", type=int, default=20, help="Metrics sessions (default: 20)")
+    parser.add_argument("--workers", type=int, default=1, help="process_prices workers (default: 1)")
+    parser.add_argument("--workdir", help="Directory for the copies (default: a temp dir next to --db)")
+    parser.add_argument("--keep", action="store_true", help="Keep the copies")
+    args = parser.parse_args(argv)
+    if not os.path.exists(args.db):
+        raise SystemExit(f"Database file not found: {args.db}")
+
+    work_dir = tempfile.mkdtemp(dir=args.workdir or os.path.dirname(os.path.abspath(args.db)))
+    try:
+        breadth_db = os.path.join(work_dir, "breadth.db")
+        create_breadth_db(breadth_db)
+        group_id_map = insert_groups(
+            get_all_sectors(args.lists_db), get_all_lists(args.lists_db), breadth_db
+        )
+        groups = (group_id_map, *build_ticker_memberships(args.lists_db))
+
+        results: Dict[str, Dict] = {}
+        for name, compact, scale in LAYOUTS:
+            print(f"[INFO] Preparing {name}...")
+            path = prepare(args.db, work_dir, name, compact, scale)
+            metrics_s, metrics_rows = time_metrics(path, args.sessions)
+            breadth_s, counts = time_breadth(path, groups, args.workers)
+            results[name] = dict(
+                size=os.path.getsize(path),
+                metrics_s=metrics_s,
+                breadth_s=breadth_s,
+                same_metrics=metrics_rows == results["legacy"]["rows"] if results else True,
+                same_breadth=np.array_equal(counts, results["legacy"]["counts"]) if results else True,
+                rows=metrics_rows,
+                counts=counts,
+            )
+
+        base = results["legacy"]
+        print(f"\n{'layout':<9} {'size MB':>9} {'metrics s':>10} {'breadth s':>10}  same as legacy")
+        for name, r in results.items():
+            same = "metrics " + ("yes" if r["same_metrics"] else "NO")
+            same += ", breadth " + ("yes" if r["same_breadth"] else "NO")
+            print(
+                f"{name:<9} {r['size'] / 1e6:9.1f} {r['metrics_s']:10.2f} {r['breadth_s']:10.2f}  {same}"
+            )
+        for name, r in results.items():
+            if name != "legacy":
+                print(
+                    f"[INFO] {name}: {r['size'] / base['size']:.0%} of the size, metrics "
+                    f"{base['metrics_s'] / r['metrics_s']:.2f}x, breadth {base['breadth_s'] / r['breadth_s']:.2f}x"
+                )
+    finally:
+        if args.keep:
+            print(f"[INFO] Copies kept in {work_dir}")
+        else:
+            shutil.rmtree(work_dir)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,243 @@
+# breadth_loop.py
+# The breadth loop, vectorized across symbols: per-row 0/1 stats (advance /
+# decline, 52-week highs / lows, above MA, volume spikes) for a chunk of
+# symbols at once, from and back into their SymbolState.
+#
+# Every flag comes from the same float64 operations, in the same order, as
+# the scalar per-row loop it replaces, so counts and saved states are
+# bit-identical. Only the running MA sums are sequential in time; they are
+# advanced one row at a time for the whole chunk.
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+from breadth_state import MA_WINDOWS, VOL_WINDOW, WINDOW_52W, SymbolState
+from breadth_stats import GroupStats
+from metrics_engine import rolling_extreme
+
+# Closes a state keeps: the previous 251 closes of the 52-week window
+HISTORY = WINDOW_52W - 1
+
+# Price rows queued before the breadth loop runs over them
+PENDING_ROWS = 1_000_000
+
+# Cells (rows x symbols) of the kernel's arrays per advance_states call
+KERNEL_CELLS = 500_000
+
+
+def _window_sums(volumes: np.ndarray, depth: int) -> np.ndarray:
+    """
+    Sum of the VOL_WINDOW volumes before each of the `depth` new rows,
+    added left to right. RollingMean's running sum of whole numbers is
+    exact, so any order gives its value; windows holding a fractional
+    volume are summed with sum() like RollingMean does.
+    """
+    total = np.zeros((depth,) + volumes.shape[1:])
+    for i in range(VOL_WINDOW):
+        total = total + volumes[i : i + depth]
+
+    fractional = (volumes != np.floor(volumes)) & ~np.isnan(volumes)
+    if fractional.any():
+        seen = np.zeros((volumes.shape[0] + 1,) + volumes.shape[1:], dtype=np.int64)
+        np.cumsum(fractional, axis=0, out=seen[1:])
+        in_window = seen[VOL_WINDOW : VOL_WINDOW + depth] - seen[:depth]
+        for k, j in zip(*np.nonzero(in_window)):
+            total[k, j] = sum(volumes[k : k + VOL_WINDOW, j].tolist())
+    return total
+
+
+def _concat(parts: List[Dict[str, np.ndarray]]) -> Dict[str, np.ndarray]:
+    if len(parts) == 1:
+        return parts[0]
+    return {col: np.concatenate([p[col] for p in parts]) for col in parts[0]}
+
+
+def advance_states(
+    states: Sequence[SymbolState], cols: Sequence[Dict[str, np.ndarray]]
+) -> List[np.ndarray]:
+    """
+    Run the breadth loop over the next price rows of several symbols
+    (BREADTH_COLUMNS arrays, at least one row each, dates after the
+    state's last_date) and return, per symbol, one row of 0/1 stats per
+    price row in breadth_stats.STAT_KEYS order. The states end up at their
+    last row.
+
+    Each symbol is a column: its saved closes / volumes right-aligned in
+    front of its new rows, so the windows before new row k are plain row
+    slices, and a window is full exactly where its oldest cell is set.
+    """
+    n = len(states)
+    counts = np.array([len(c["date"]) for c in cols], dtype=np.int64)
+    depth = int(counts.max())
+
+    closes = np.full((HISTORY + depth, n), np.nan)
+    volumes = np.full((VOL_WINDOW + depth, n), np.nan)
+    highs = np.full((depth, n), np.nan)
+    lows = np.full((depth, n), np.nan)
+    for j, (state, c) in enumerate(zip(states, cols)):
+        m = counts[j]
+        closes[HISTORY - len(state.closes) : HISTORY, j] = state.closes
+        closes[HISTORY : HISTORY + m, j] = c["close"]
+        volumes[VOL_WINDOW - len(state.volumes) : VOL_WINDOW, j] = state.volumes
+        volumes[VOL_WINDOW : VOL_WINDOW + m, j] = c["volume"]
+        highs[:m, j] = c["high"]
+        lows[:m, j] = c["low"]
+
+    close = closes[HISTORY:]
+    vol = volumes[VOL_WINDOW:]
+    active = np.arange(depth)[:, None] < counts
+
+    # --- advance / decline ---
+    prev = closes[HISTORY - 1 : HISTORY - 1 + depth]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        pct_change = (close - prev) / prev
+    is_adv = close > prev
+    is_dec = close < prev
+
+    # --- 52-week high/low using previous 251 closes ---
+    full_52w = ~np.isnan(closes[:depth])
+    is_new_high_52w = full_52w & (close > rolling_extreme(closes[:-1], HISTORY, HISTORY - 1, np.fmax))
+    is_new_low_52w = full_52w & (close < rolling_extreme(closes[:-1], HISTORY, HISTORY - 1, np.fmin))
+
+    # --- moving averages on close: running sums, one row at a time ---
+    ma_sums = np.array([state.ma_sums for state in states])
+    above_ma = []
+    for i, w in enumerate(MA_WINDOWS):
+        # close leaving the window (0 while it is not full yet)
+        leaving = np.nan_to_num(closes[HISTORY - w : HISTORY - w + depth])
+        s = ma_sums[:, i]
+        sums = np.empty((depth, n))
+        for k in range(depth):
+            s = np.where(active[k], (s + close[k]) - leaving[k], s)
+            sums[k] = s
+        ma_sums[:, i] = s
+        full = ~np.isnan(closes[HISTORY - w + 1 : HISTORY - w + 1 + depth])
+        above_ma.append(full & (close > sums / w))
+
+    # --- volume breakout vs previous 20 days ---
+    full_vol = ~np.isnan(volumes[:depth])
+    avg_vol_20 = _window_sums(volumes, depth) / VOL_WINDOW
+
+    # --- close position in daily range ---
+    ranged = highs > lows
+    mid = (highs + lows) / 2.0
+    in_top_50 = ranged & (close >= mid)
+    in_bottom_50 = ranged & (close <= mid)
+
+    # --- spike up / spike down conditions ---
+    spike_base = ~np.isnan(prev) & full_vol & ranged & (vol >= 1.25 * avg_vol_20)
+    is_spike_up = spike_base & (pct_change >= 0.015) & in_top_50
+    is_spike_down = spike_base & (pct_change <= -0.015) & in_bottom_50
+
+    flags = np.stack(
+        [
+            active,
+            is_adv,
+            is_dec,
+            is_new_high_52w,
+            is_new_low_52w,
+            *above_ma,
+            is_spike_up,
+            is_spike_down,
+        ],
+        axis=-1,
+    ).astype(np.int32)
+
+    out = []
+    for j, (state, c) in enumerate(zip(states, cols)):
+        m = counts[j]
+        kept = closes[m : HISTORY + m, j]
+        state.closes = kept[~np.isnan(kept)]
+        kept = volumes[m : VOL_WINDOW + m, j]
+        state.volumes = kept[~np.isnan(kept)]
+        state.ma_sums = ma_sums[j].copy()
+        state.prev_close = float(close[m - 1, j])
+        state.last_date = str(c["date"][-1])
+        out.append(flags[:m, j])
+    return out
+
+
+class BreadthPass:
+    """
+    Feeds symbols' price rows through the breadth loop and their flags
+    into group_stats.
+
+        breadth = BreadthPass(group_stats, states, since)
+        for symbol, cols in scan:
+            breadth.add(symbol, cols)
+        breadth.finish()
+
+    Rows are queued until PENDING_ROWS are waiting, then advanced in
+    chunks of symbols. A symbol may come back with later rows (one scan
+    per block of dates): they are queued behind its earlier ones. Rows up
+    to a symbol's state.last_date are skipped, so one scan can serve
+    symbols that are already further along. Symbols outside group_stats
+    are ignored and missing states start empty; `states` is updated in
+    place. Flags are kept only for dates after `since`.
+    """
+
+    def __init__(
+        self,
+        group_stats: GroupStats,
+        states: Dict[str, SymbolState],
+        since: Optional[str] = None,
+        pending_rows: int = PENDING_ROWS,
+    ):
+        self.group_stats = group_stats
+        self.states = states
+        self.since = since
+        self.pending_rows = pending_rows
+        self._pending: Dict[str, List[Dict[str, np.ndarray]]] = {}
+        self._rows = 0
+
+    def add(self, symbol: str, cols: Dict[str, np.ndarray]) -> None:
+        if symbol not in self.group_stats.symbol_index:
+            return
+        queued = self._pending.get(symbol)
+        if queued:
+            last_date = queued[-1]["date"][-1]
+        else:
+            state = self.states.get(symbol)
+            if state is None:
+                state = self.states[symbol] = SymbolState()
+            last_date = state.last_date
+        if last_date is not None:
+            new = cols["date"] > last_date
+            if not new.all():
+                cols = {col: values[new] for col, values in cols.items()}
+        if not len(cols["date"]):
+            return
+
+        self._pending.setdefault(symbol, []).append(cols)
+        self._rows += len(cols["date"])
+        if self._rows >= self.pending_rows:
+            self.flush()
+
+    def flush(self) -> None:
+        """Advance the queued symbols and add their flags to group_stats."""
+        queued = [(symbol, _concat(parts)) for symbol, parts in self._pending.items()]
+        self._pending = {}
+        self._rows = 0
+
+        # Similar row counts side by side, so little of the kernel's arrays is padding
+        queued.sort(key=lambda item: len(item[1]["date"]))
+        start = 0
+        while start < len(queued):
+            end = start + 1
+            while end < len(queued) and (end - start + 1) * len(queued[end][1]["date"]) <= KERNEL_CELLS:
+                end += 1
+            chunk = queued[start:end]
+            start = end
+
+            states = [self.states[symbol] for symbol, _ in chunk]
+            flags = advance_states(states, [cols for _, cols in chunk])
+            for (symbol, cols), symbol_flags in zip(chunk, flags):
+                dates = cols["date"]
+                if self.since is not None:
+                    keep = dates > self.since
+                    dates, symbol_flags = dates[keep], symbol_flags[keep]
+                self.group_stats.add_symbol(symbol, dates, symbol_flags)
+
+    def finish(self) -> None:
+        self.flush()
+        self.group_stats.flush()
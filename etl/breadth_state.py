@@ -0,0 +1,156 @@
+# breadth_state.py
+# Per-symbol rolling state of the breadth loop, persisted in breadth.db so
+# update_breadth only has to process price rows it has not seen yet, and
+# the date span of each symbol's rows counted in each of its groups, so
+# onboard_tickers can take out exactly what a symbol contributed.
+import sqlite3
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+# 52 weeks ~ 252 trading days
+WINDOW_52W = 252
+
+MA_WINDOWS = [5, 10, 20, 50, 200]
+
+# volume window: previous 20 days (exclude current)
+VOL_WINDOW = 20
+
+# Price columns the breadth loop reads
+BREADTH_COLUMNS = ("date", "high", "low", "close", "volume")
+
+# (group_id, after_date, last_date): rows after after_date (all if None)
+# up to last_date were counted in the group
+GroupSpan = Tuple[int, Optional[str], str]
+
+
+def create_state_table(cur: sqlite3.Cursor) -> None:
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS symbol_state (
+            symbol     TEXT PRIMARY KEY,
+            last_date  TEXT NOT NULL,   -- last price row folded into the state
+            prev_close REAL,
+            closes     BLOB NOT NULL,   -- last WINDOW_52W - 1 closes (float64)
+            ma_sums    BLOB NOT NULL,   -- running sum per MA window (float64)
+            volumes    BLOB NOT NULL    -- last VOL_WINDOW volumes (float64)
+        )
+        """
+    )
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS symbol_groups (
+            symbol     TEXT    NOT NULL,
+            group_id   INTEGER NOT NULL,
+            after_date TEXT,             -- rows after this date (NULL: from the first) ...
+            last_date  TEXT    NOT NULL, -- ... up to this one are counted in the group
+            PRIMARY KEY (symbol, group_id)
+        ) WITHOUT ROWID
+        """
+    )
+
+
+def _pack(values: np.ndarray) -> bytes:
+    return np.asarray(values, dtype=np.float64).tobytes()
+
+
+def _unpack(blob: bytes) -> np.ndarray:
+    return np.frombuffer(blob, dtype=np.float64)
+
+
+class SymbolState:
+    """
+    Everything the breadth loop carries from one price row of a symbol to
+    the next: previous close, the last WINDOW_52W - 1 closes (52-week
+    extremes and the values leaving each MA window), the running sum per
+    MA window and the 20-day volume window.
+
+    The running MA sums are stored as-is rather than re-summed from the
+    closes, so a resumed run produces bit-identical averages to a run over
+    the full history. Arrays are replaced, never modified in place, by
+    breadth_loop.advance_states.
+    """
+
+    __slots__ = ("last_date", "prev_close", "closes", "ma_sums", "volumes")
+
+    def __init__(self):
+        self.last_date: Optional[str] = None
+        self.prev_close: Optional[float] = None
+        self.closes = np.empty(0)                  # oldest first, at most WINDOW_52W - 1
+        self.ma_sums = np.zeros(len(MA_WINDOWS))   # MA_WINDOWS order
+        self.volumes = np.empty(0)                 # oldest first, at most VOL_WINDOW
+
+    @classmethod
+    def from_row(cls, row: Tuple) -> "SymbolState":
+        """Rebuild a state from a symbol_state row (without the symbol column)."""
+        last_date, prev_close, closes_blob, sums_blob, volumes_blob = row
+        state = cls()
+        state.last_date = last_date
+        state.prev_close = prev_close
+        state.closes = _unpack(closes_blob)
+        state.ma_sums = _unpack(sums_blob)
+        state.volumes = _unpack(volumes_blob)
+        return state
+
+    def to_row(self, symbol: str) -> Tuple:
+        return (
+            symbol,
+            self.last_date,
+            self.prev_close,
+            _pack(self.closes),
+            _pack(self.ma_sums),
+            _pack(self.volumes),
+        )
+
+
+def load_states(conn: sqlite3.Connection) -> Dict[str, SymbolState]:
+    cur = conn.execute(
+        "SELECT symbol, last_date, prev_close, closes, ma_sums, volumes FROM symbol_state"
+    )
+    return {row[0]: SymbolState.from_row(row[1:]) for row in cur}
+
+
+def save_states(conn: sqlite3.Connection, rows: Iterable[Tuple]) -> None:
+    """Upsert symbol_state rows as built by SymbolState.to_row."""
+    conn.executemany(
+        """
+        INSERT OR REPLACE INTO symbol_state (
+            symbol, last_date, prev_close, closes, ma_sums, volumes
+        ) VALUES (?, ?, ?, ?, ?, ?)
+        """,
+        rows,
+    )
+    conn.commit()
+
+
+def save_group_spans(conn: sqlite3.Connection, rows: Iterable[Tuple]) -> None:
+    """
+    Upsert symbol_groups rows (symbol, group_id, after_date, last_date). A
+    span already recorded keeps its start and is extended to last_date.
+    """
+    conn.executemany(
+        """
+        INSERT INTO symbol_groups (symbol, group_id, after_date, last_date)
+        VALUES (?, ?, ?, ?)
+        ON CONFLICT (symbol, group_id) DO UPDATE
+        SET last_date = MAX(last_date, excluded.last_date)
+        """,
+        rows,
+    )
+    conn.commit()
+
+
+def load_group_spans(conn: sqlite3.Connection, symbols: Iterable[str]) -> Dict[str, List[GroupSpan]]:
+    """{symbol: its recorded spans} for the symbols that have any."""
+    spans: Dict[str, List[GroupSpan]] = {}
+    for symbol in symbols:
+        rows = conn.execute(
+            "SELECT group_id, after_date, last_date FROM symbol_groups WHERE symbol = ?", (symbol,)
+        ).fetchall()
+        if rows:
+            spans[symbol] = rows
+    return spans
+
+
+def delete_group_spans(conn: sqlite3.Connection, symbols: Iterable[str]) -> None:
+    conn.executemany("DELETE FROM symbol_groups WHERE symbol = ?", ((s,) for s in symbols))
@@ -0,0 +1,132 @@
+# breadth_stats.py
+# Dense per-(group, date) breadth counters shared by build_breadth and
+# update_breadth.
+import sqlite3
+from typing import Any, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from price_reader import session_dates
+
+try:
+    from scipy import sparse
+    SCIPY_AVAILABLE = True
+except ImportError:
+    SCIPY_AVAILABLE = False
+
+# Order of the stat axis (and of the per-row flags of breadth_loop.advance_states)
+STAT_KEYS = [
+    "total",
+    "adv",
+    "dec",
+    "new_high_52w",
+    "new_low_52w",
+    "above_ma5",
+    "above_ma10",
+    "above_ma20",
+    "above_ma50",
+    "above_ma200",
+    "spike_up",
+    "spike_down",
+]
+
+# Symbols whose flags are folded into the counts per membership product
+SYMBOL_BLOCK = 64
+
+
+def price_dates(conn: sqlite3.Connection, after: Optional[str] = None) -> List[str]:
+    """Distinct price dates in order, optionally only those after `after`."""
+    return session_dates(conn, after=after)
+
+
+def member_rows(membership: Any) -> np.ndarray:
+    """Rows (groups) of a membership matrix block with at least one member."""
+    if SCIPY_AVAILABLE and sparse.issparse(membership):
+        return np.unique(sparse.csc_matrix(membership).indices)
+    return np.flatnonzero(np.asarray(membership).any(axis=1))
+
+
+class GroupStats:
+    """
+    Breadth counters as one int32 array indexed by (group, date, stat).
+
+    Groups, dates and symbols are fixed up front: `group_ids` are breadth
+    group ids, `dates` the shared, sorted date index and `membership` the
+    group x symbol matrix from utils.build_membership_matrix (columns
+    follow `symbols`). A (group, date) cell with total == 0 has no breadth
+    row.
+
+    Symbols are added with their per-row 0/1 stat flags and folded in
+    blocks: for every date, the group counts are membership @ (symbol x
+    stat flags), done for a block of symbols and all the dates they cover
+    in one matrix product. The cost therefore hardly depends on how many
+    groups a symbol belongs to. Call flush() before reading the counts.
+    """
+
+    def __init__(
+        self,
+        group_ids: Sequence[int],
+        dates: Sequence[str],
+        symbols: Sequence[str],
+        membership: Any,
+    ):
+        self.group_ids = list(group_ids)
+        self.group_index = {gid: i for i, gid in enumerate(self.group_ids)}
+        self.dates = np.asarray(dates, dtype=str)
+        self.symbol_index = {symbol: i for i, symbol in enumerate(symbols)}
+        self.membership = membership
+        self.counts = np.zeros(
+            (len(self.group_ids), len(self.dates), len(STAT_KEYS)), dtype=np.int32
+        )
+        self._pending: List[Tuple[int, np.ndarray, np.ndarray]] = []
+
+    def date_positions(self, dates: np.ndarray) -> np.ndarray:
+        """Positions of `dates` in the date index (all must be present)."""
+        pos = np.searchsorted(self.dates, dates)
+        if len(dates) and (pos.max() >= len(self.dates) or (self.dates[pos] != dates).any()):
+            raise ValueError("Dates outside the breadth date index")
+        return pos
+
+    def add_symbol(self, symbol: str, dates: np.ndarray, flags: np.ndarray) -> None:
+        """Queue one symbol's (rows x stat) flag matrix, one row per date."""
+        if len(dates):
+            self._pending.append((self.symbol_index[symbol], self.date_positions(dates), flags))
+        if len(self._pending) >= SYMBOL_BLOCK:
+            self.flush()
+
+    def flush(self) -> None:
+        """Fold the queued symbols into the counts with one membership product."""
+        if not self._pending:
+            return
+        columns, positions, flags = zip(*self._pending)
+        self._pending = []
+
+        block = self.membership[:, list(columns)]
+        rows = member_rows(block)
+        if not len(rows):
+            return
+        block = block[rows]
+
+        # (symbol, date, stat) indicators over the dates the block covers
+        lo = min(int(pos[0]) for pos in positions)
+        hi = max(int(pos[-1]) for pos in positions) + 1
+        indicators = np.zeros((len(columns), hi - lo, len(STAT_KEYS)), dtype=np.float32)
+        for i, (pos, symbol_flags) in enumerate(zip(positions, flags)):
+            indicators[i, pos - lo] = symbol_flags
+
+        # float32 products of small integer counts are exact
+        product = block @ indicators.reshape(len(columns), -1)
+        self.counts[rows, lo:hi] += np.asarray(product).reshape(
+            len(rows), hi - lo, len(STAT_KEYS)
+        ).astype(np.int32)
+
+    def active(self, gid: int) -> np.ndarray:
+        """Date positions with at least one stock for the group."""
+        return np.nonzero(self.counts[self.group_index[gid], :, 0])[0]
+
+    def date_extent(self) -> Tuple[int, int]:
+        """[lo, hi) date positions outside of which every count is 0."""
+        positions = np.flatnonzero(self.counts[:, :, 0].any(axis=0))
+        if not len(positions):
+            return 0, 0
+        return int(positions[0]), int(positions[-1]) + 1
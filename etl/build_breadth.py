@@ -1,9 +1,13 @@
 # build_breadth_db.py
+import argparse
 import sqlite3
-from collections import deque, defaultdict
-from typing import Dict, List, Tuple
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
 import os
 
+import numpy as np
+
 try:
     from tqdm import tqdm
     TQDM_AVAILABLE = True
@@ -11,20 +15,45 @@ except:
     TQDM_AVAILABLE = False
     
 
+from price_cache import PriceCache, add_price_cache_arguments, price_cache_from_args
+from price_reader import ensure_date_index, iter_symbol_prices
+from breadth_loop import BreadthPass
+from breadth_state import (
+    BREADTH_COLUMNS,
+    SymbolState,
+    create_state_table,
+    save_group_spans,
+    save_states,
+)
+from bulk_writer import BulkWriter
+from db_publish import current_path, shadow_build
+from breadth_stats import GroupStats, member_rows, price_dates
 from utils import (
     STOCKS_LISTS_DB,
     get_all_sectors,
     get_all_lists,
     build_ticker_memberships,
+    build_membership_matrix,
+    ticker_group_ids,
 )
 
 STOCKS_PRICES_DB = "../data/stocks.db"
 BREADTH_DB = "../data/breadth.db"
 
-# 52 weeks ~ 252 trading days
-WINDOW_52W = 252
+INSERT_BREADTH_SQL = """
+    INSERT OR REPLACE INTO breadth (
+        group_id, date,
+        total,
+        adv, dec,
+        new_high_52w, new_low_52w,
+        above_ma5, above_ma10, above_ma20, above_ma50, above_ma200,
+        spike_up, spike_down,
+        ad_value, ema19, ema39, mcclellan
+    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
 
-MA_WINDOWS = [5, 10, 20, 50, 200]
+# Parallel mode: shards handed out per worker (smaller shards balance better)
+SHARDS_PER_WORKER = 4
 
 
 def create_breadth_db(db_path: str = BREADTH_DB) -> None:
@@ -76,11 +105,35 @@ def create_breadth_db(db_path: str = BREADTH_DB) -> None:
             """
         )
 
+        create_state_table(cur)
+
         conn.commit()
     finally:
         conn.close()
 
 
+def save_symbol_states(state_rows: List[tuple], db_path: str = BREADTH_DB) -> None:
+    conn = sqlite3.connect(db_path)
+    try:
+        save_states(conn, state_rows)
+    finally:
+        conn.close()
+
+
+def save_symbol_groups(
+    state_rows: List[tuple], ticker_groups: Dict[str, List[int]], db_path: str = BREADTH_DB
+) -> None:
+    """Every symbol's full history, up to its state, is counted in all its groups."""
+    conn = sqlite3.connect(db_path)
+    try:
+        save_group_spans(
+            conn,
+            ((row[0], gid, None, row[1]) for row in state_rows for gid in ticker_groups.get(row[0], [])),
+        )
+    finally:
+        conn.close()
+
+
 def insert_groups(
     sectors: List[str], lists_: List[str], db_path: str = BREADTH_DB
 ) -> Dict[Tuple[str, str], int]:
@@ -121,308 +174,244 @@ def insert_groups(
         conn.close()
 
 
+def process_symbols(
+    conn: sqlite3.Connection,
+    symbols: List[str],
+    states: Dict[str, SymbolState],
+    group_stats: GroupStats,
+    show_progress: bool = True,
+    end_date: Optional[str] = None,
+    cache: Optional[PriceCache] = None,
+) -> None:
+    """
+    Run the breadth loop over the full price history of every symbol in
+    `symbols` (up to end_date, if given) and add its counts to
+    `group_stats`. The rolling state each symbol ends with is left in
+    `states`. Prices come from `cache` when given, from conn otherwise.
+    """
+    # One ordered scan of prices, one symbol's history at a time
+    if cache is not None:
+        stream = cache.iter_symbol_prices(BREADTH_COLUMNS, end_date=end_date, symbols=symbols)
+    else:
+        stream = iter_symbol_prices(conn, BREADTH_COLUMNS, end_date=end_date, symbols=symbols)
+    iterator = (
+        tqdm(stream, total=len(symbols), desc="Processing symbols")
+        if TQDM_AVAILABLE and show_progress
+        else stream
+    )
 
-def default_stats() -> Dict[str, int]:
-    return {
-        "total": 0,
-        "adv": 0,
-        "dec": 0,
-        "new_high_52w": 0,
-        "new_low_52w": 0,
-        "above_ma5": 0,
-        "above_ma10": 0,
-        "above_ma20": 0,
-        "above_ma50": 0,
-        "above_ma200": 0,
-        "spike_up": 0,      # new
-        "spike_down": 0,    # new
-    }
+    # Symbols are advanced in chunks; their flags go into all their groups
+    breadth = BreadthPass(group_stats, states)
+    for symbol, cols in iterator:
+        states[symbol] = SymbolState()
+        breadth.add(symbol, cols)
+    breadth.finish()
+
+
+# ---------------------------------------------------------------------
+# Parallel mode: symbols sharded over a process pool
+# ---------------------------------------------------------------------
+def _process_shard(
+    db_path: str,
+    group_ids: List[int],
+    dates: List[str],
+    symbols: List[str],
+    membership,
+    cache_dir: Optional[str] = None,
+) -> Tuple[int, np.ndarray, List[tuple]]:
+    """
+    Worker: process one shard of symbols on its own read-only connection
+    (or its own mapping of the price cache in cache_dir).
+    `group_ids` are the groups the shard's symbols belong to and
+    `membership` the matching block of the membership matrix.
+    Returns (lo, counts, symbol_state rows): the shard's (group, date,
+    stat) counts over the date positions lo.. it has rows on.
+    """
+    group_stats = GroupStats(group_ids, dates, symbols, membership)
+    states: Dict[str, SymbolState] = {}
+    cache = PriceCache(cache_dir) if cache_dir is not None else None
+    conn = sqlite3.connect(f"{Path(db_path).resolve().as_uri()}?mode=ro", uri=True)
+    try:
+        process_symbols(conn, symbols, states, group_stats, show_progress=False, cache=cache)
+    finally:
+        conn.close()
+    lo, hi = group_stats.date_extent()
+    return lo, group_stats.counts[:, lo:hi], [state.to_row(symbol) for symbol, state in states.items()]
 
 
 def process_prices(
     group_id_map: Dict[Tuple[str, str], int],
     ticker_to_sector: Dict[str, str],
     ticker_to_lists: Dict[str, List[str]],
-) -> Dict[int, Dict[str, Dict[str, int]]]:
+    workers: int = 1,
+    cache: Optional[PriceCache] = None,
+) -> Tuple[GroupStats, List[tuple]]:
+    """
+    Build aggregated stats per group_id per date from stocks.prices (or
+    the price cache), plus the symbol_state row each symbol ends with.
+
+    With workers > 1 the symbols are split into contiguous shards that a
+    process pool works through. A shard only counts the groups its symbols
+    belong to and comes back as the block of dates it has rows on; the
+    parent adds each block at its offset, so the counts are exactly those
+    of the serial run.
+    """
+    group_ids, symbols, membership = build_membership_matrix(
+        group_id_map, ticker_to_sector, ticker_to_lists
+    )
 
     conn = sqlite3.connect(STOCKS_PRICES_DB)
     try:
-        cur = conn.cursor()
+        ensure_date_index(conn)
+        dates = price_dates(conn)
+        group_stats = GroupStats(group_ids, dates, symbols, membership)
+
+        if workers <= 1:
+            states: Dict[str, SymbolState] = {}
+            process_symbols(conn, symbols, states, group_stats, cache=cache)
+            return group_stats, [state.to_row(symbol) for symbol, state in states.items()]
+    finally:
+        conn.close()
 
-        cur.execute("SELECT DISTINCT symbol FROM prices ORDER BY symbol")
-        symbols = [row[0] for row in cur.fetchall()]
+    # contiguous column ranges of the membership matrix
+    n_shards = max(1, min(len(symbols), workers * SHARDS_PER_WORKER))
+    bounds = np.linspace(0, len(symbols), n_shards + 1).astype(int)
+    shards = [(lo, hi) for lo, hi in zip(bounds[:-1], bounds[1:]) if hi > lo]
+
+    state_rows: List[tuple] = []
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {}
+        for lo, hi in shards:
+            block = membership[:, lo:hi]
+            rows = member_rows(block)
+            future = pool.submit(
+                _process_shard,
+                STOCKS_PRICES_DB,
+                [group_ids[r] for r in rows],
+                dates,
+                symbols[lo:hi],
+                block[rows],
+                cache.root if cache is not None else None,
+            )
+            futures[future] = rows
+        done = as_completed(futures)
+        if TQDM_AVAILABLE:
+            done = tqdm(done, total=len(futures), desc=f"Processing shards ({workers} workers)")
+        for future in done:
+            first, shard_counts, shard_states = future.result()
+            group_stats.counts[futures[future], first : first + shard_counts.shape[1]] += shard_counts
+            state_rows.extend(shard_states)
 
-        group_stats: Dict[int, Dict[str, Dict[str, int]]] = defaultdict(
-            lambda: defaultdict(default_stats)
-        )
+    return group_stats, state_rows
 
-        iterator = tqdm(symbols, desc="Processing symbols") if TQDM_AVAILABLE else symbols
 
-        for symbol in iterator:
-            sector = ticker_to_sector.get(symbol)
-            lists_for_symbol = ticker_to_lists.get(symbol, [])
+def mcclellan_rows(gid: int, dates: List[str], counts: List[list]) -> List[tuple]:
+    """
+    Breadth rows of one group over its full history: the per-date counts
+    (STAT_KEYS order) plus the A/D value, its 19/39-day EMAs (seeded with
+    the first value) and the McClellan oscillator.
+    """
+    alpha19 = 2.0 / (19.0 + 1.0)
+    alpha39 = 2.0 / (39.0 + 1.0)
+    ema19 = None
+    ema39 = None
 
-            if sector is None and not lists_for_symbol:
-                continue
+    rows = []
+    for d, st in zip(dates, counts):
+        # st follows STAT_KEYS: total, adv, dec, ...
+        adv = st[1]
+        dec = st[2]
+        ad_value = adv - dec
 
-            group_ids = []
-            if sector is not None and ("sector", sector) in group_id_map:
-                group_ids.append(group_id_map[("sector", sector)])
-            for list_name in lists_for_symbol:
-                key = ("list", list_name)
-                if key in group_id_map:
-                    group_ids.append(group_id_map[key])
+        if ema19 is None:
+            ema19 = float(ad_value)
+        else:
+            ema19 = ema19 + alpha19 * (ad_value - ema19)
 
-            if not group_ids:
-                continue
+        if ema39 is None:
+            ema39 = float(ad_value)
+        else:
+            ema39 = ema39 + alpha39 * (ad_value - ema39)
 
-            cur.execute(
-                """
-                SELECT date, open, high, low, close, volume
-                FROM prices
-                WHERE symbol = ?
-                ORDER BY date
-                """,
-                (symbol,),
-            )
-            rows = cur.fetchall()
-            if not rows:
-                continue
-
-            prev_close = None
-            window_52w = deque(maxlen=WINDOW_52W - 1)
-
-            ma_windows: Dict[int, Tuple[deque, float]] = {}
-            for w in MA_WINDOWS:
-                ma_windows[w] = (deque(maxlen=w), 0.0)
-
-            # volume window: previous 20 days (exclude current)
-            vol_window = deque(maxlen=20)
-
-            for date, o, h, l, c, v in rows:
-                close = float(c)
-                high = float(h)
-                low = float(l)
-                vol = float(v)
-
-                # --- advance / decline ---
-                is_adv = False
-                is_dec = False
-                pct_change = None
-                if prev_close is not None:
-                    pct_change = (close - prev_close) / prev_close
-                    is_adv = close > prev_close
-                    is_dec = close < prev_close
-
-                # --- 52-week high/low using previous 251 closes ---
-                is_new_high_52w = False
-                is_new_low_52w = False
-                if len(window_52w) >= WINDOW_52W - 1:
-                    max_prev = max(window_52w)
-                    min_prev = min(window_52w)
-                    is_new_high_52w = close > max_prev
-                    is_new_low_52w = close < min_prev
-
-                window_52w.append(close)
-
-                # --- moving averages on close ---
-                above_ma_flags = {w: False for w in MA_WINDOWS}
-
-                for w in MA_WINDOWS:
-                    dq, s = ma_windows[w]
-                    oldest = dq[0] if len(dq) == dq.maxlen else None
-
-                    dq.append(close)
-                    s += close
-                    if oldest is not None:
-                        s -= oldest
-                    ma_windows[w] = (dq, s)
-
-                    if len(dq) == w:
-                        ma = s / w
-                        if close > ma:
-                            above_ma_flags[w] = True
-
-                # --- volume breakout vs previous 20 days ---
-                avg_vol_20 = None
-                if len(vol_window) == vol_window.maxlen:
-                    avg_vol_20 = sum(vol_window) / len(vol_window)
-
-                # add today to volume window only AFTER using previous 20 days
-                vol_window.append(vol)
-
-                # --- close position in daily range ---
-                in_top_50 = False
-                in_bottom_50 = False
-                if high > low:
-                    mid = (high + low) / 2.0
-                    in_top_50 = close >= mid
-                    in_bottom_50 = close <= mid
-
-                # --- spike up / spike down conditions ---
-                is_spike_up = False
-                is_spike_down = False
-
-                if (
-                    pct_change is not None
-                    and avg_vol_20 is not None
-                    and high > low
-                ):
-                    # +1.5% and 25% above 20d average volume
-                    if (
-                        pct_change >= 0.015
-                        and vol >= 1.25 * avg_vol_20
-                        and in_top_50
-                    ):
-                        is_spike_up = True
-
-                    # -1.5% and 25% above 20d average volume
-                    if (
-                        pct_change <= -0.015
-                        and vol >= 1.25 * avg_vol_20
-                        and in_bottom_50
-                    ):
-                        is_spike_down = True
-
-                # --- aggregate into all groups this symbol belongs to ---
-                for gid in group_ids:
-                    st = group_stats[gid][date]
-
-                    # count this stock in total for that group/date
-                    st["total"] += 1
-
-                    if is_adv:
-                        st["adv"] += 1
-                    if is_dec:
-                        st["dec"] += 1
-                    if is_new_high_52w:
-                        st["new_high_52w"] += 1
-                    if is_new_low_52w:
-                        st["new_low_52w"] += 1
-
-                    if above_ma_flags[5]:
-                        st["above_ma5"] += 1
-                    if above_ma_flags[10]:
-                        st["above_ma10"] += 1
-                    if above_ma_flags[20]:
-                        st["above_ma20"] += 1
-                    if above_ma_flags[50]:
-                        st["above_ma50"] += 1
-                    if above_ma_flags[200]:
-                        st["above_ma200"] += 1
-
-                    if is_spike_up:
-                        st["spike_up"] += 1
-                    if is_spike_down:
-                        st["spike_down"] += 1
-
-                prev_close = close
-
-        return group_stats
-    finally:
-        conn.close()
+        mcclellan = ema19 - ema39
+
+        rows.append((gid, d, *st, ad_value, ema19, ema39, mcclellan))
+    return rows
 
 
 def compute_mcclellan_and_insert(
-    group_stats: Dict[int, Dict[str, Dict[str, int]]],
+    group_stats: GroupStats,
     db_path: str = BREADTH_DB,
 ) -> None:
 
     conn = sqlite3.connect(db_path)
     try:
-        cur = conn.cursor()
-
-        alpha19 = 2.0 / (19.0 + 1.0)
-        alpha39 = 2.0 / (39.0 + 1.0)
-
-        items = list(group_stats.items())
-        iterator = tqdm(items, desc="Computing McClellan") if TQDM_AVAILABLE else items
-
-        for gid, date_dict in iterator:
-            dates = sorted(date_dict.keys())
-            ema19 = None
-            ema39 = None
-
-            for d in dates:
-                st = date_dict[d]
-                total = st["total"]
-                adv = st["adv"]
-                dec = st["dec"]
-                ad_value = adv - dec
-
-                if ema19 is None:
-                    ema19 = float(ad_value)
-                else:
-                    ema19 = ema19 + alpha19 * (ad_value - ema19)
-
-                if ema39 is None:
-                    ema39 = float(ad_value)
-                else:
-                    ema39 = ema39 + alpha39 * (ad_value - ema39)
-
-                mcclellan = ema19 - ema39
-
-                cur.execute(
-                    """
-                    INSERT OR REPLACE INTO breadth (
-                        group_id, date,
-                        total,
-                        adv, dec,
-                        new_high_52w, new_low_52w,
-                        above_ma5, above_ma10, above_ma20, above_ma50, above_ma200,
-                        spike_up, spike_down,
-                        ad_value, ema19, ema39, mcclellan
-                    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                    """,
-                    (
-                        gid,
-                        d,
-                        total,
-                        adv,
-                        dec,
-                        st["new_high_52w"],
-                        st["new_low_52w"],
-                        st["above_ma5"],
-                        st["above_ma10"],
-                        st["above_ma20"],
-                        st["above_ma50"],
-                        st["above_ma200"],
-                        st["spike_up"],
-                        st["spike_down"],
-                        ad_value,
-                        ema19,
-                        ema39,
-                        mcclellan,
-                    ),
-                )
-
-        conn.commit()
+        group_ids = group_stats.group_ids
+        iterator = tqdm(group_ids, desc="Computing McClellan") if TQDM_AVAILABLE else group_ids
+
+        # Fresh breadth.db: load with bulk settings, then ANALYZE
+        with BulkWriter(conn, bulk=True) as writer:
+            for gid in iterator:
+                active = group_stats.active(gid)
+                dates = group_stats.dates[active].tolist()
+                counts = group_stats.counts[group_stats.group_index[gid], active].tolist()
+                writer.insert(INSERT_BREADTH_SQL, mcclellan_rows(gid, dates, counts))
     finally:
         conn.close()
 
 
-def main():
-    # 1. Prepare breadth DB
-    create_breadth_db()
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Build breadth.db from scratch.")
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Processes for the per-symbol pass (1 = serial, 0 = one per CPU core).",
+    )
+    add_price_cache_arguments(parser)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    workers = args.workers or os.cpu_count() or 1
 
-    # 2. Get sectors & lists from stocks_lists.db
-    sectors = get_all_sectors(STOCKS_LISTS_DB)
-    lists_ = get_all_lists(STOCKS_LISTS_DB)
+    # 1. Prepare breadth DB: a new version, published once it is complete
+    #    (readers stay on the previous one until then, see db_publish.py)
+    with shadow_build(BREADTH_DB) as db_path:
+        create_breadth_db(db_path)
 
-    # 3. Insert groups, get mapping
-    group_id_map = insert_groups(sectors, lists_)
+        # 2. Get sectors & lists from stocks_lists.db
+        sectors = get_all_sectors(STOCKS_LISTS_DB)
+        lists_ = get_all_lists(STOCKS_LISTS_DB)
 
-    # 4. Build ticker -> sector / lists membership
-    ticker_to_sector, ticker_to_lists = build_ticker_memberships(STOCKS_LISTS_DB)
+        # 3. Insert groups, get mapping
+        group_id_map = insert_groups(sectors, lists_, db_path)
 
-    # 5. Process prices & aggregate per group/date
-    group_stats = process_prices(group_id_map, ticker_to_sector, ticker_to_lists)
+        # 4. Build ticker -> sector / lists membership
+        ticker_to_sector, ticker_to_lists = build_ticker_memberships(STOCKS_LISTS_DB)
 
-    # 6. Compute McClellan oscillator and persist results
-    compute_mcclellan_and_insert(group_stats)
+        # 5. Process prices & aggregate per group/date
+        conn = sqlite3.connect(STOCKS_PRICES_DB)
+        try:
+            cache = price_cache_from_args(args, conn)
+        finally:
+            conn.close()
+        group_stats, state_rows = process_prices(
+            group_id_map, ticker_to_sector, ticker_to_lists, workers=workers, cache=cache
+        )
+
+        # 6. Compute McClellan oscillator and persist results
+        compute_mcclellan_and_insert(group_stats, db_path)
 
-    print("Breadth database built in", BREADTH_DB)
+        # 7. Save per-symbol rolling state so update_breadth can resume from it,
+        #    and the groups each symbol was counted in (onboard_tickers.py)
+        save_symbol_states(state_rows, db_path)
+        save_symbol_groups(
+            state_rows, ticker_group_ids(group_id_map, ticker_to_sector, ticker_to_lists), db_path
+        )
 
+    print("Breadth database built in", current_path(BREADTH_DB))
 
 if __name__ == "__main__":
     main()
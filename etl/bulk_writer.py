@@ -0,0 +1,155 @@
+# bulk_writer.py
+# Shared SQLite writer for the ETL scripts: batched executemany, bulk-load
+# pragmas for full rebuilds, secondary indexes built after the load, and
+# WAL connections with controlled checkpoints for the incremental writers
+# of the databases the app reads while they run.
+import sqlite3
+from typing import Dict, Iterable, List, Sequence
+
+# Rows buffered per statement before an executemany
+BATCH_ROWS = 50_000
+
+# Pragmas while a full rebuild loads its rows. The data is recreated from
+# scratch by rerunning the build, so durability is traded for speed until
+# the load is done and the previous settings are restored. The rollback
+# journal is kept in memory rather than turned OFF: a crash may still
+# leave the file damaged (the builds write to a shadow file that is then
+# discarded, see db_publish.py), but an exception can still roll back
+# the open transaction, which journal_mode=OFF cannot do.
+BULK_PRAGMAS = {
+    "journal_mode": "MEMORY",
+    "synchronous": "OFF",
+    "cache_size": -262144,  # negative = KiB, i.e. 256 MB
+    "temp_store": "MEMORY",
+}
+
+# Seconds a writer waits on a lock held by a reader or a checkpoint
+BUSY_TIMEOUT = 30.0
+
+
+def connect_wal(db_path: str, timeout: float = BUSY_TIMEOUT) -> sqlite3.Connection:
+    """
+    Connection for an incremental writer of a live database (metrics.db,
+    breadth.db). In WAL mode the app's readers are not blocked by the
+    writer and keep their snapshot until its transaction commits;
+    synchronous=NORMAL is safe in WAL and syncs at checkpoints only.
+    """
+    conn = sqlite3.connect(db_path, timeout=timeout)
+    conn.execute("PRAGMA journal_mode = WAL;")
+    conn.execute("PRAGMA synchronous = NORMAL;")
+    return conn
+
+
+class BulkWriter:
+    """
+    Batched writes through one connection.
+
+        with BulkWriter(conn, bulk=True, indexes=[...]) as writer:
+            writer.insert(sql, rows)
+            writer.commit()            # optional intermediate commits
+
+    Rows are buffered per statement and written with executemany every
+    `batch_size` rows. With bulk=True (full rebuilds only) BULK_PRAGMAS are
+    applied for the load and the previous values restored afterwards. On
+    a clean exit the remaining rows are committed, the `indexes` (CREATE
+    INDEX statements) are built on the loaded table and, after a bulk load,
+    ANALYZE refreshes the planner statistics.
+
+    On a WAL connection (connect_wal) the automatic checkpoints are off
+    while the writer is open: each commit() is followed by a PASSIVE
+    checkpoint, which never waits on readers, and a clean exit truncates
+    the WAL. Writers of a live database commit at consistent points (a
+    date, a group), so the WAL stays small and readers never see half of
+    one.
+    """
+
+    def __init__(
+        self,
+        conn: sqlite3.Connection,
+        bulk: bool = False,
+        indexes: Sequence[str] = (),
+        batch_size: int = BATCH_ROWS,
+    ):
+        self.conn = conn
+        self.bulk = bulk
+        self.indexes = list(indexes)
+        self.batch_size = batch_size
+        self.rows_written = 0
+        self._pending: Dict[str, List[tuple]] = {}
+        self._saved_pragmas: Dict[str, object] = {}
+        self._wal = False
+
+    # -----------------------------------------------------------------
+    # Context management
+    # -----------------------------------------------------------------
+    def __enter__(self) -> "BulkWriter":
+        if self.bulk:
+            self.conn.commit()  # journal_mode cannot change inside a transaction
+            for name, value in BULK_PRAGMAS.items():
+                self._saved_pragmas[name] = self._pragma(name)
+                self._pragma(name, value)
+        elif self._pragma("journal_mode") == "wal":
+            self._wal = True
+            self._saved_pragmas["wal_autocheckpoint"] = self._pragma("wal_autocheckpoint")
+            self._pragma("wal_autocheckpoint", 0)
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        try:
+            if exc_type is None:
+                self.commit()
+                for sql in self.indexes:
+                    self.conn.execute(sql)
+                self.conn.commit()
+                if self._wal:
+                    self.checkpoint("TRUNCATE")
+            else:
+                self._pending.clear()
+                self.conn.rollback()
+        finally:
+            for name, value in self._saved_pragmas.items():
+                self._pragma(name, value)
+            self._saved_pragmas.clear()
+
+        if exc_type is None and self.bulk:
+            self.conn.execute("ANALYZE;")
+            self.conn.commit()
+
+    def _pragma(self, name: str, value=None):
+        if value is None:
+            return self.conn.execute(f"PRAGMA {name};").fetchone()[0]
+        return self.conn.execute(f"PRAGMA {name} = {value};").fetchone()
+
+    # -----------------------------------------------------------------
+    # Writes
+    # -----------------------------------------------------------------
+    def insert(self, sql: str, rows: Iterable[tuple]) -> None:
+        """Queue rows for `sql`; written once batch_size rows are waiting."""
+        pending = self._pending.setdefault(sql, [])
+        pending.extend(rows)
+        if len(pending) >= self.batch_size:
+            self._write(sql)
+
+    def _write(self, sql: str) -> None:
+        rows = self._pending.pop(sql, None)
+        if rows:
+            self.conn.executemany(sql, rows)
+            self.rows_written += len(rows)
+
+    def flush(self) -> None:
+        for sql in list(self._pending):
+            self._write(sql)
+
+    def commit(self) -> None:
+        self.flush()
+        self.conn.commit()
+        if self._wal:
+            self.checkpoint("PASSIVE")
+
+    def checkpoint(self, mode: str = "PASSIVE") -> None:
+        """
+        Copy the committed WAL pages into the database. PASSIVE stops at
+        pages a reader's snapshot still needs; TRUNCATE waits for those
+        readers (up to the busy timeout) and then empties the WAL file.
+        """
+        self.conn.execute(f"PRAGMA wal_checkpoint({mode});").fetchone()
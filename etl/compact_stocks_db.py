@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+# compact_stocks_db.py
+# One-off compaction of stocks.db under an ingest policy (see
+# ingest_policy.py): delete the price history of every ticker the policy
+# would not store, then VACUUM to give the space back.
+#
+#   python compact_stocks_db.py --policy universe --dry-run
+#   python compact_stocks_db.py --policy rules --min-price 2
+#
+# Tracked tickers (stocks_lists.db) are always kept. Under rules, an
+# untracked ticker is kept if it passes the rules on average over its last
+# LOOKBACK_SESSIONS bars. A backup snapshot is taken before anything is
+# deleted. Metrics percentile ranks are computed over the stored tickers,
+# so rebuild metrics.db afterwards (build_metrics.py --backfill).
+
+import argparse
+import os
+import sqlite3
+import time
+from typing import List
+
+from db_backup import backup_database
+from ingest_policy import (
+    POLICY_ALL,
+    POLICY_RULES,
+    IngestPolicy,
+    add_policy_arguments,
+    policy_from_args,
+    stored_symbols,
+)
+
+STOCKS_DB = "../data/stocks.db"
+
+# Recent bars an untracked ticker is judged on under rules
+LOOKBACK_SESSIONS = 20
+
+# Symbols per DELETE statement
+DELETE_BATCH = 500
+
+
+def symbols_to_prune(
+    conn: sqlite3.Connection, policy: IngestPolicy, lookback: int = LOOKBACK_SESSIONS
+) -> List[str]:
+    """Stored symbols the policy would not store, in order."""
+    prune = []
+    for symbol in stored_symbols(conn):
+        if symbol in policy.universe:
+            continue
+        if policy.mode == POLICY_RULES:
+            close, dollar_volume = conn.execute(
+                """
+                SELECT AVG(close), AVG(close * volume) FROM (
+                    SELECT close, volume FROM prices
+                    WHERE symbol = ? ORDER BY date DESC LIMIT ?
+                )
+                """,
+                (symbol, lookback),
+            ).fetchone()
+            if close is not None and policy.passes_rules(symbol, close, dollar_volume or 0.0):
+                continue
+        prune.append(symbol)
+    return prune
+
+
+def prune_symbols(conn: sqlite3.Connection, symbols: List[str]) -> int:
+    """Delete the symbols' prices rows in one transaction; returns the rows deleted."""
+    # total_changes rather than rowcount: deletes through the compact
+    # layout's prices view happen in its trigger, which rowcount leaves out
+    changes_before = conn.total_changes
+    for i in range(0, len(symbols), DELETE_BATCH):
+        batch = symbols[i : i + DELETE_BATCH]
+        placeholders = ", ".join("?" for _ in batch)
+        conn.execute(f"DELETE FROM prices WHERE symbol IN ({placeholders})", batch)
+    conn.commit()
+    return conn.total_changes - changes_before
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Delete the prices of tickers outside an ingest policy, then VACUUM stocks.db."
+    )
+    add_policy_arguments(parser)
+    parser.add_argument(
+        "--lookback",
+        type=int,
+        default=LOOKBACK_SESSIONS,
+        help=f"rules: judge untracked tickers on their last N bars (default: {LOOKBACK_SESSIONS})",
+    )
+    parser.add_argument("--dry-run", action="store_true", help="Only report what would be deleted")
+    parser.add_argument("--no-vacuum", action="store_true", help="Delete rows but skip the VACUUM")
+    parser.add_argument("--db", default=STOCKS_DB, help=f"Database (default: {STOCKS_DB})")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.policy == POLICY_ALL:
+        raise SystemExit("Policy 'all' keeps every row; choose --policy universe or rules.")
+    if not os.path.exists(args.db):
+        raise SystemExit(f"Database file not found: {args.db}")
+
+    conn = sqlite3.connect(args.db)
+    try:
+        policy = policy_from_args(args, conn)
+        prune = symbols_to_prune(conn, policy, args.lookback)
+        print(f"[INFO] {len(prune)} stored ticker(s) to prune.")
+        if not prune:
+            return
+        if args.dry_run:
+            preview = ", ".join(prune[:20]) + (" ..." if len(prune) > 20 else "")
+            print(f"  {preview}")
+            return
+
+        backup_database(args.db, os.path.join(os.path.dirname(args.db), "backups"))
+        size_before = os.path.getsize(args.db)
+        t0 = time.time()
+        deleted = prune_symbols(conn, prune)
+        print(f"[INFO] Deleted {deleted} row(s) in {time.time() - t0:.1f}s.")
+
+        if not args.no_vacuum:
+            t0 = time.time()
+            conn.execute("VACUUM")
+            conn.execute("PRAGMA optimize")
+            size_after = os.path.getsize(args.db)
+            print(
+                f"[INFO] VACUUM done in {time.time() - t0:.1f}s: "
+                f"{size_before / 1e6:,.1f} MB -> {size_after / 1e6:,.1f} MB."
+            )
+        print("[INFO] Rebuild metrics.db (build_metrics.py --backfill): ranks cover the stored tickers.")
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,401 @@
+#!/usr/bin/env python3
+# db_backup.py
+# Compressed backups of stocks.db that stay cheap as the database grows:
+#
+#   python db_backup.py backup [--full]     # what update_stocks_db runs first
+#   python db_backup.py list
+#   python db_backup.py restore [--at ID] [--output PATH]
+#   python db_backup.py prune [--keep-chains N]
+#
+# A chain is one full snapshot (SQLite online backup API, gzipped) followed by
+# incremental snapshots. An incremental snapshot holds only the prices rows
+# added since the previous snapshot (prices rowid above its watermark) plus
+# a copy of the small bookkeeping tables (fetch_journal, ...), so the
+# pre-update backup costs about one day of rows. A new chain starts every
+# FULL_EVERY snapshots, or earlier when the rowids were renumbered (VACUUM),
+# and only the newest KEEP_CHAINS chains are kept.
+#
+# Rows deleted or changed in place (prices is written with INSERT OR
+# IGNORE) are only picked up by the next full snapshot. Databases in the
+# compact layout (migrate_prices.py: prices is a view over a WITHOUT ROWID
+# table) have no rowids to follow and always get full snapshots.
+
+import argparse
+import gzip
+import json
+import os
+import shutil
+import sqlite3
+import tempfile
+from datetime import datetime
+from typing import Dict, List, Optional
+
+DB_PATH = "../data/stocks.db"
+BACKUP_DIR = "../data/backups"
+MANIFEST_NAME = "manifest.json"
+
+# Snapshots per chain (1 full + FULL_EVERY - 1 incremental)
+FULL_EVERY = 7
+# Chains kept by the retention policy
+KEEP_CHAINS = 2
+
+# Table backed up incrementally by rowid; every other table is copied whole
+INCREMENTAL_TABLE = "prices"
+
+# Fastest gzip level: ~3.5x faster than the default 6 on prices pages for
+# ~12% larger files
+GZIP_LEVEL = 1
+COPY_CHUNK = 1024 * 1024
+
+
+# ---------------------------------------------------------------------
+# Manifest
+# ---------------------------------------------------------------------
+def load_manifest(backup_dir: str = BACKUP_DIR) -> List[Dict]:
+    """Snapshots, oldest first: {id, kind, file, created, max_rowid, last_key}."""
+    path = os.path.join(backup_dir, MANIFEST_NAME)
+    if not os.path.exists(path):
+        return []
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_manifest(entries: List[Dict], backup_dir: str = BACKUP_DIR) -> None:
+    """Write the manifest atomically (a crash keeps the previous one)."""
+    path = os.path.join(backup_dir, MANIFEST_NAME)
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(entries, f, indent=2)
+    os.replace(tmp, path)
+
+
+def chains(entries: List[Dict]) -> List[List[Dict]]:
+    """Group the manifest into chains, each starting with a full snapshot."""
+    out: List[List[Dict]] = []
+    for entry in entries:
+        if entry["kind"] == "full" or not out:
+            out.append([])
+        out[-1].append(entry)
+    return out
+
+
+# ---------------------------------------------------------------------
+# Helpers
+# ---------------------------------------------------------------------
+def _compress(src_path: str, dst_path: str) -> None:
+    tmp = dst_path + ".tmp"
+    with open(src_path, "rb") as src, gzip.open(tmp, "wb", compresslevel=GZIP_LEVEL) as dst:
+        shutil.copyfileobj(src, dst, COPY_CHUNK)
+    os.replace(tmp, dst_path)
+
+
+def _decompress(src_path: str, dst_path: str) -> None:
+    with gzip.open(src_path, "rb") as src, open(dst_path, "wb") as dst:
+        shutil.copyfileobj(src, dst, COPY_CHUNK)
+
+
+def _has_rowids(conn: sqlite3.Connection, schema: str = "main") -> bool:
+    """Whether prices is a rowid table (not a view or a WITHOUT ROWID table)."""
+    row = conn.execute(
+        f"SELECT type, sql FROM {schema}.sqlite_master WHERE name = ?", (INCREMENTAL_TABLE,)
+    ).fetchone()
+    return row is not None and row[0] == "table" and "WITHOUT ROWID" not in row[1].upper()
+
+
+def _watermark(conn: sqlite3.Connection, schema: str = "main") -> Dict:
+    """Highest prices rowid and the key of that row."""
+    if not _has_rowids(conn, schema):
+        return {"max_rowid": 0, "last_key": None}
+    row = conn.execute(
+        f"SELECT rowid, symbol, date FROM {schema}.{INCREMENTAL_TABLE} ORDER BY rowid DESC LIMIT 1"
+    ).fetchone()
+    if row is None:
+        return {"max_rowid": 0, "last_key": None}
+    return {"max_rowid": row[0], "last_key": [row[1], row[2]]}
+
+
+def _rowids_stable(conn: sqlite3.Connection, entry: Dict) -> bool:
+    """False if the row at the previous watermark moved (e.g. VACUUM renumbered rowids)."""
+    if not _has_rowids(conn):
+        return False
+    if not entry["max_rowid"]:
+        return True
+    row = conn.execute(
+        f"SELECT symbol, date FROM {INCREMENTAL_TABLE} WHERE rowid = ?", (entry["max_rowid"],)
+    ).fetchone()
+    return row is not None and list(row) == entry["last_key"]
+
+
+def _user_tables(conn: sqlite3.Connection, schema: str = "main") -> Dict[str, str]:
+    """{table name: CREATE TABLE sql}, without SQLite's internal tables."""
+    return {
+        name: sql
+        for name, sql in conn.execute(
+            f"SELECT name, sql FROM {schema}.sqlite_master "
+            "WHERE type = 'table' AND name NOT LIKE 'sqlite_%'"
+        )
+    }
+
+
+def _columns_with_rowid(conn: sqlite3.Connection, table: str, schema: str = "main") -> str:
+    """Column list with the rowid first, so copies keep the rowids (and the watermarks)."""
+    columns = [row[1] for row in conn.execute(f"PRAGMA {schema}.table_info({table})")]
+    return ", ".join(["rowid"] + columns)
+
+
+# ---------------------------------------------------------------------
+# Backup
+# ---------------------------------------------------------------------
+def _full_snapshot(db_path: str, out_path: str, work_dir: str) -> Dict:
+    """Online backup of the whole DB into out_path (gzipped)."""
+    tmp = os.path.join(work_dir, "snapshot.db")
+    src = sqlite3.connect(db_path)
+    try:
+        # Read before copying: rows added meanwhile are copied again by the
+        # next increment rather than skipped
+        mark = _watermark(src)
+        dst = sqlite3.connect(tmp)
+        try:
+            src.backup(dst)
+        finally:
+            dst.close()
+    finally:
+        src.close()
+    _compress(tmp, out_path)
+    return mark
+
+
+def _incremental_snapshot(db_path: str, out_path: str, work_dir: str, after_rowid: int) -> Dict:
+    """prices rows with rowid > after_rowid and the other tables in full."""
+    tmp = os.path.join(work_dir, "snapshot.db")
+    conn = sqlite3.connect(tmp)
+    try:
+        conn.execute("ATTACH DATABASE ? AS src", (db_path,))
+        # One read transaction: the watermark and the copied rows agree
+        conn.execute("BEGIN")
+        mark = _watermark(conn, "src")
+        for name, sql in _user_tables(conn, "src").items():
+            conn.execute(sql)
+            if name == INCREMENTAL_TABLE:
+                columns = _columns_with_rowid(conn, name, "src")
+                conn.execute(
+                    f"INSERT INTO main.{name} ({columns}) SELECT {columns} FROM src.{name} "
+                    "WHERE rowid > ? AND rowid <= ? ORDER BY rowid",
+                    (after_rowid, mark["max_rowid"]),
+                )
+            else:
+                conn.execute(f"INSERT INTO main.{name} SELECT * FROM src.{name}")
+        conn.commit()
+        conn.execute("DETACH DATABASE src")
+    finally:
+        conn.close()
+    _compress(tmp, out_path)
+    return mark
+
+
+def backup_database(
+    db_path: str = DB_PATH,
+    backup_dir: str = BACKUP_DIR,
+    full: bool = False,
+    full_every: int = FULL_EVERY,
+    keep_chains: int = KEEP_CHAINS,
+) -> str:
+    """
+    Snapshot db_path into backup_dir and apply the retention policy.
+    Incremental unless `full`, the current chain has full_every snapshots
+    or the prices rowids changed since the last one. Returns the file
+    written.
+    """
+    os.makedirs(backup_dir, exist_ok=True)
+    entries = load_manifest(backup_dir)
+    current = chains(entries)[-1] if entries else []
+
+    if not full and current and len(current) < full_every:
+        conn = sqlite3.connect(db_path)
+        try:
+            has_rowids = _has_rowids(conn)
+            stable = has_rowids and _rowids_stable(conn, current[-1])
+        finally:
+            conn.close()
+        if not has_rowids:
+            print("[INFO] prices has no rowids (compact layout), taking a full snapshot.")
+        elif not stable:
+            print("[INFO] prices rowids changed since the last backup, starting a new chain.")
+        full = not stable
+    else:
+        full = True
+
+    stem = os.path.splitext(os.path.basename(db_path))[0]
+    snapshot_id = datetime.now().strftime("%Y%m%d_%H%M%S")
+    if any(entry["id"] == snapshot_id for entry in entries):
+        snapshot_id += datetime.now().strftime("_%f")
+    kind = "full" if full else "incr"
+    file_name = f"{stem}_{snapshot_id}_{kind}.db.gz"
+    out_path = os.path.join(backup_dir, file_name)
+
+    with tempfile.TemporaryDirectory(dir=backup_dir) as work_dir:
+        if full:
+            mark = _full_snapshot(db_path, out_path, work_dir)
+        else:
+            mark = _incremental_snapshot(db_path, out_path, work_dir, current[-1]["max_rowid"])
+
+    entries.append(
+        {
+            "id": snapshot_id,
+            "kind": kind,
+            "file": file_name,
+            "created": datetime.now().isoformat(timespec="seconds"),
+            **mark,
+        }
+    )
+    save_manifest(entries, backup_dir)
+    size_mb = os.path.getsize(out_path) / 1e6
+    print(f"Backup created: {out_path} ({kind}, {size_mb:.1f} MB)")
+
+    prune(backup_dir, keep_chains)
+    return out_path
+
+
+def prune(backup_dir: str = BACKUP_DIR, keep_chains: int = KEEP_CHAINS) -> List[str]:
+    """Delete the snapshots of all but the newest keep_chains chains."""
+    entries = load_manifest(backup_dir)
+    all_chains = chains(entries)
+    if len(all_chains) <= keep_chains:
+        return []
+    dropped = [entry for chain in all_chains[: len(all_chains) - keep_chains] for entry in chain]
+    # Manifest first: a crash in between leaves stray files, not dangling entries
+    save_manifest(entries[len(dropped):], backup_dir)
+    removed = []
+    for entry in dropped:
+        path = os.path.join(backup_dir, entry["file"])
+        if os.path.exists(path):
+            os.remove(path)
+            removed.append(path)
+    print(f"[INFO] Pruned {len(dropped)} old snapshot(s).")
+    return removed
+
+
+# ---------------------------------------------------------------------
+# Restore
+# ---------------------------------------------------------------------
+def _apply_incremental(conn: sqlite3.Connection, snapshot_path: str) -> None:
+    """Add an incremental snapshot's prices rows; replace the other tables."""
+    conn.execute("ATTACH DATABASE ? AS inc", (snapshot_path,))
+    try:
+        existing = _user_tables(conn)
+        for name, sql in _user_tables(conn, "inc").items():
+            if name not in existing:
+                conn.execute(sql)
+            if name == INCREMENTAL_TABLE:
+                columns = _columns_with_rowid(conn, name, "inc")
+                conn.execute(
+                    f"INSERT OR REPLACE INTO main.{name} ({columns}) "
+                    f"SELECT {columns} FROM inc.{name} ORDER BY rowid"
+                )
+            else:
+                conn.execute(f"DELETE FROM main.{name}")
+                conn.execute(f"INSERT INTO main.{name} SELECT * FROM inc.{name}")
+        conn.commit()
+    finally:
+        conn.execute("DETACH DATABASE inc")
+
+
+def restore_database(
+    snapshot_id: Optional[str] = None,
+    output: str = DB_PATH,
+    backup_dir: str = BACKUP_DIR,
+) -> str:
+    """
+    Rebuild the database as of snapshot_id (default: the latest) into
+    `output`: the chain's full snapshot plus its increments up to it. An
+    existing output file is kept as <output>.before_restore.
+    """
+    entries = load_manifest(backup_dir)
+    if not entries:
+        raise SystemExit(f"No backups in {backup_dir}")
+    target = None
+    for chain in chains(entries):
+        for i, entry in enumerate(chain):
+            if snapshot_id is None or entry["id"] == snapshot_id:
+                target = chain[: i + 1]
+    if target is None:
+        raise SystemExit(f"No snapshot {snapshot_id} (see `python db_backup.py list`)")
+
+    out_dir = os.path.dirname(os.path.abspath(output))
+    with tempfile.TemporaryDirectory(dir=out_dir) as work_dir:
+        restored = os.path.join(work_dir, "restored.db")
+        _decompress(os.path.join(backup_dir, target[0]["file"]), restored)
+        conn = sqlite3.connect(restored)
+        try:
+            for entry in target[1:]:
+                part = os.path.join(work_dir, "part.db")
+                _decompress(os.path.join(backup_dir, entry["file"]), part)
+                _apply_incremental(conn, part)
+                os.remove(part)
+            check = conn.execute("PRAGMA quick_check").fetchone()[0]
+        finally:
+            conn.close()
+        if check != "ok":
+            raise SystemExit(f"Restored database failed quick_check: {check}")
+
+        if os.path.exists(output):
+            os.replace(output, output + ".before_restore")
+            print(f"[INFO] Previous database kept as {output}.before_restore")
+        os.replace(restored, output)
+
+    print(f"Restored {output} as of {target[-1]['id']} ({len(target)} snapshot(s) applied)")
+    return output
+
+
+# ---------------------------------------------------------------------
+# CLI
+# ---------------------------------------------------------------------
+def list_backups(backup_dir: str = BACKUP_DIR) -> None:
+    entries = load_manifest(backup_dir)
+    if not entries:
+        print(f"No backups in {backup_dir}")
+        return
+    for entry in entries:
+        path = os.path.join(backup_dir, entry["file"])
+        size = f"{os.path.getsize(path) / 1e6:8.1f} MB" if os.path.exists(path) else "  missing"
+        print(f"{entry['id']}  {entry['kind']:<4}  {size}  up to rowid {entry['max_rowid']}")
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Compressed full/incremental backups of stocks.db.")
+    parser.add_argument("--db", default=DB_PATH, help=f"Database (default: {DB_PATH})")
+    parser.add_argument("--backup-dir", default=BACKUP_DIR, help=f"Backup directory (default: {BACKUP_DIR})")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    backup = sub.add_parser("backup", help="Take a snapshot and prune old chains")
+    backup.add_argument("--full", action="store_true", help="Start a new chain with a full snapshot")
+    backup.add_argument("--full-every", type=int, default=FULL_EVERY)
+    backup.add_argument("--keep-chains", type=int, default=KEEP_CHAINS)
+
+    sub.add_parser("list", help="List the snapshots")
+
+    restore = sub.add_parser("restore", help="Rebuild the database from the snapshots")
+    restore.add_argument("--at", help="Snapshot id to restore (default: the latest)")
+    restore.add_argument("--output", help="Write here instead of over --db")
+
+    prune_cmd = sub.add_parser("prune", help="Apply the retention policy")
+    prune_cmd.add_argument("--keep-chains", type=int, default=KEEP_CHAINS)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.command == "backup":
+        if not os.path.exists(args.db):
+            raise SystemExit(f"Database file not found: {args.db}")
+        backup_database(args.db, args.backup_dir, args.full, args.full_every, args.keep_chains)
+    elif args.command == "list":
+        list_backups(args.backup_dir)
+    elif args.command == "restore":
+        restore_database(args.at, args.output or args.db, args.backup_dir)
+    elif args.command == "prune":
+        prune(args.backup_dir, args.keep_chains)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,189 @@
+# db_publish.py
+# Shadow builds of the databases the app reads (metrics.db, breadth.db). A
+# full rebuild goes into a new versioned file next to the live path and is
+# published by atomically replacing a pointer file, so readers never see a
+# deleted, empty or half-built database:
+#
+#   ../data/breadth.db.current            name of the live version (one line)
+#   ../data/breadth.20261017-101040.db    versions; the newest KEEP_VERSIONS are kept
+#   ../data/breadth.db                    symlink to the live version
+#
+#   with shadow_build(BREADTH_DB) as path:   # new version, published on success
+#       ...build into path...
+#
+# Readers open current_path() and reopen when the pointer changes (the app:
+# app/lib/db-published.ts); a handle on an older version keeps working on the
+# data it has. Incremental updates write to current_path() in place. The
+# plain path stays usable for everything else (the sqlite3 CLI, ad-hoc
+# scripts): it is a symlink, swapped atomically on publish, and SQLite
+# follows it to the version's own -wal/-shm files. Without a pointer the
+# plain path is the live database itself, so existing data directories keep
+# working until their first rebuild replaces it with the link. Where
+# symlinks cannot be created (Windows without the privilege) the plain
+# file is left as it was and only the pointer is current.
+import os
+import re
+import sqlite3
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Iterator, List
+
+# Versions kept by gc_versions (the live one included), so a reader still on
+# the previous version is not pulled from under it
+KEEP_VERSIONS = 2
+
+# SQLite files that belong to a database file
+SIDE_FILES = ("-wal", "-shm", "-journal")
+
+POINTER_SUFFIX = ".current"
+
+
+def pointer_path(db_path: str) -> str:
+    return db_path + POINTER_SUFFIX
+
+
+def current_path(db_path: str) -> str:
+    """File holding the live database behind `db_path`."""
+    try:
+        with open(pointer_path(db_path)) as f:
+            name = f.read().strip()
+    except FileNotFoundError:
+        return db_path
+    return os.path.join(os.path.dirname(db_path), name) if name else db_path
+
+
+def _version_pattern(db_path: str) -> "re.Pattern":
+    stem, ext = os.path.splitext(os.path.basename(db_path))
+    return re.compile(re.escape(stem) + r"\.(\d{8}-\d{6})(?:-(\d+))?" + re.escape(ext) + "$")
+
+
+def list_versions(db_path: str) -> List[str]:
+    """Versioned files of `db_path`, oldest first."""
+    directory = os.path.dirname(db_path) or "."
+    pattern = _version_pattern(db_path)
+    found = []
+    for name in os.listdir(directory):
+        m = pattern.match(name)
+        if m:
+            # Versions of the same second get a -N suffix
+            found.append(((m.group(1), int(m.group(2) or 0)), name))
+    return [os.path.join(os.path.dirname(db_path), name) for _, name in sorted(found)]
+
+
+def new_version_path(db_path: str) -> str:
+    """Unused versioned file name for a new build of `db_path`."""
+    stem, ext = os.path.splitext(db_path)
+    stamp = f"{datetime.now():%Y%m%d-%H%M%S}"
+    pattern = _version_pattern(db_path)
+    # Past the highest suffix of this second, not the first free one: a name
+    # freed by gc_versions would sort before the versions it must follow
+    taken = [
+        int(m.group(2) or 0)
+        for m in map(pattern.match, os.listdir(os.path.dirname(db_path) or "."))
+        if m and m.group(1) == stamp
+    ]
+    if not taken:
+        return f"{stem}.{stamp}{ext}"
+    return f"{stem}.{stamp}-{max(taken) + 1}{ext}"
+
+
+def remove_database(path: str) -> None:
+    for name in (path, *(path + suffix for suffix in SIDE_FILES)):
+        if os.path.exists(name):
+            os.remove(name)
+
+
+def publish(db_path: str, version: str) -> None:
+    """Make `version` the live database behind `db_path`, then collect old versions."""
+    # Published in WAL mode, like the incremental writers and the app use it
+    conn = sqlite3.connect(version)
+    try:
+        conn.execute("PRAGMA journal_mode = WAL;")
+    finally:
+        conn.close()
+
+    # The builds load with synchronous=OFF (bulk_writer.py): flush the file
+    # before any reader is pointed at it
+    fd = os.open(version, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+    pointer = pointer_path(db_path)
+    tmp = pointer + ".tmp"
+    with open(tmp, "w") as f:
+        f.write(os.path.basename(version) + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, pointer)
+    link_live(db_path, version)
+    print(f"[INFO] Published {version} as {db_path}.")
+    gc_versions(db_path)
+
+
+def link_live(db_path: str, version: str) -> bool:
+    """
+    Make `db_path` a symlink to `version`, replacing the link (or a plain
+    database file, with its side files) in one rename. False if symlinks
+    are not available here.
+    """
+    tmp = db_path + ".link.tmp"
+    try:
+        if os.path.lexists(tmp):
+            os.remove(tmp)
+        os.symlink(os.path.basename(version), tmp)
+    except (OSError, NotImplementedError) as e:
+        print(f"[WARN] Could not link {db_path} to {version}: {e}")
+        return False
+    plain = os.path.exists(db_path) and not os.path.islink(db_path)
+    os.replace(tmp, db_path)
+    if plain:
+        # The side files belonged to the replaced file, not the link target
+        for suffix in SIDE_FILES:
+            if os.path.exists(db_path + suffix):
+                os.remove(db_path + suffix)
+    return True
+
+
+def gc_versions(db_path: str, keep: int = KEEP_VERSIONS) -> List[str]:
+    """
+    Delete all but the newest `keep` versions, never the live one. An
+    unversioned plain file (left where no symlink could be made) counts as
+    the oldest version; the symlink itself is not a version. Returns the
+    deleted paths; files still open elsewhere are skipped where the OS
+    refuses (Windows).
+    """
+    live = os.path.abspath(current_path(db_path))
+    versions = list_versions(db_path)
+    if os.path.exists(db_path) and not os.path.islink(db_path):
+        versions.insert(0, db_path)
+    old = [v for v in versions[: max(0, len(versions) - keep)] if os.path.abspath(v) != live]
+
+    removed = []
+    for path in old:
+        try:
+            remove_database(path)
+        except OSError as e:
+            print(f"[WARN] Could not remove old version {path}: {e}")
+            continue
+        removed.append(path)
+    if removed:
+        print(f"[INFO] Removed {len(removed)} old version(s) of {db_path}.")
+    return removed
+
+
+@contextmanager
+def shadow_build(db_path: str) -> Iterator[str]:
+    """
+    Path of a new, empty version of `db_path` to build into; published when
+    the block exits cleanly, deleted if it raises. Close the connections to
+    it inside the block.
+    """
+    version = new_version_path(db_path)
+    try:
+        yield version
+    except BaseException:
+        remove_database(version)
+        raise
+    publish(db_path, version)
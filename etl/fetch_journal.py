@@ -0,0 +1,92 @@
+# fetch_journal.py
+# Per-session record of Polygon grouped-daily fetches in stocks.db, so a
+# failed or interrupted catch-up is retried on the next run instead of
+# leaving a permanent hole behind MAX(prices.date).
+import sqlite3
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+
+STATUS_OK = "ok"          # rows inserted
+STATUS_EMPTY = "empty"    # request succeeded but returned no results
+STATUS_FAILED = "failed"  # retries exhausted or non-retryable error
+
+# Statuses a later run fetches again
+RETRY_STATUSES = (STATUS_EMPTY, STATUS_FAILED)
+
+# Sessions are no longer retried after this many requests in total (e.g. an
+# unscheduled closure the calendar does not know about keeps coming back
+# empty); they are reported instead
+MAX_SESSION_ATTEMPTS = 20
+
+
+def create_journal_table(conn: sqlite3.Connection) -> None:
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS fetch_journal (
+            session    TEXT PRIMARY KEY,   -- YYYY-MM-DD trading session
+            status     TEXT NOT NULL,      -- ok / empty / failed
+            row_count  INTEGER NOT NULL DEFAULT 0,
+            attempts   INTEGER NOT NULL DEFAULT 0,  -- requests over all runs
+            last_error TEXT,
+            updated_at TEXT NOT NULL
+        )
+        """
+    )
+    conn.commit()
+
+
+def record_session(
+    conn: sqlite3.Connection,
+    session: str,
+    status: str,
+    row_count: int,
+    attempts: int,
+    error: Optional[str] = None,
+) -> None:
+    """
+    Upsert one session's outcome; attempts add up across runs. Not
+    committed here, so the caller can commit it together with the rows.
+    """
+    conn.execute(
+        """
+        INSERT INTO fetch_journal (session, status, row_count, attempts, last_error, updated_at)
+        VALUES (?, ?, ?, ?, ?, ?)
+        ON CONFLICT(session) DO UPDATE SET
+            status     = excluded.status,
+            row_count  = excluded.row_count,
+            attempts   = fetch_journal.attempts + excluded.attempts,
+            last_error = excluded.last_error,
+            updated_at = excluded.updated_at
+        """,
+        (session, status, row_count, attempts, error, datetime.now().isoformat(timespec="seconds")),
+    )
+
+
+def load_journal(conn: sqlite3.Connection) -> Dict[str, Tuple[str, int, int]]:
+    """{session: (status, row_count, attempts)}"""
+    cur = conn.execute("SELECT session, status, row_count, attempts FROM fetch_journal")
+    return {row[0]: row[1:] for row in cur}
+
+
+def sessions_to_fetch(
+    journal: Dict[str, Tuple[str, int, int]],
+    sessions: Iterable[str],
+    have_prices: Iterable[str] = (),
+    max_attempts: int = MAX_SESSION_ATTEMPTS,
+) -> Tuple[List[str], List[str]]:
+    """
+    Split `sessions` into (to fetch, given up). To fetch: sessions never
+    journaled (unless prices already has rows for them) and those whose
+    last fetch failed or came back empty, as long as they are below
+    max_attempts requests.
+    """
+    have = set(have_prices)
+    todo, given_up = [], []
+    for session in sessions:
+        entry = journal.get(session)
+        if entry is None:
+            if session not in have:
+                todo.append(session)
+        elif entry[0] in RETRY_STATUSES:
+            (todo if entry[2] < max_attempts else given_up).append(session)
+    return todo, given_up
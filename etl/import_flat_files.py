@@ -0,0 +1,298 @@
+#!/usr/bin/env python3
+# import_flat_files.py
+# Bulk history import from Polygon flat files (day aggregates, one gzipped
+# CSV per session, e.g. us_stocks_sip/day_aggs_v1/2024/03/2024-03-07.csv.gz)
+# already downloaded to local disk:
+#
+#   python import_flat_files.py ~/flatfiles/day_aggs_v1 --start 2015-01-01
+#
+# Files are parsed in worker processes, a chunk of CSV lines at a time, and
+# handed back in date order to the single writer, which batches INSERT OR
+# IGNORE into large transactions and journals every imported session
+# (fetch_journal), so update_stocks_db does not fetch them again.
+
+import argparse
+import csv
+import gzip
+import os
+import re
+import sqlite3
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+from itertools import islice
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from bulk_writer import BulkWriter
+from fetch_journal import STATUS_OK, create_journal_table, record_session
+from ingest_policy import IngestPolicy, add_policy_arguments, policy_from_args
+from price_reader import ensure_date_index, session_dates
+
+try:
+    from tqdm import tqdm
+    TQDM_AVAILABLE = True
+except ImportError:
+    TQDM_AVAILABLE = False
+
+STOCKS_DB = "../data/stocks.db"
+
+INSERT_PRICES_SQL = """
+    INSERT OR IGNORE INTO prices
+        (symbol, date, open, high, low, close, volume)
+    VALUES (?, ?, ?, ?, ?, ?, ?)
+"""
+
+# CSV lines converted per chunk
+CHUNK_ROWS = 20_000
+# Rows per executemany
+BATCH_ROWS = 200_000
+# Sessions per transaction
+COMMIT_FILES = 50
+
+# Columns of the day aggregates files
+FLAT_FILE_COLUMNS = ("ticker", "volume", "open", "close", "high", "low", "window_start")
+
+FILE_DATE_RE = re.compile(r"(\d{4}-\d{2}-\d{2})")
+
+
+# ---------------------------------------------------------------------
+# 1) Files
+# ---------------------------------------------------------------------
+def file_date(path: Path) -> Optional[str]:
+    """Session date from the file name (YYYY-MM-DD.csv.gz), if it has one."""
+    match = FILE_DATE_RE.search(path.name)
+    return match.group(1) if match else None
+
+
+def find_flat_files(
+    paths: List[str], start: Optional[str] = None, end: Optional[str] = None
+) -> List[Path]:
+    """*.csv.gz files under `paths` (files or directories) within [start, end], by date."""
+    files: List[Path] = []
+    for p in map(Path, paths):
+        if p.is_dir():
+            files.extend(p.rglob("*.csv.gz"))
+        elif p.exists():
+            files.append(p)
+        else:
+            raise SystemExit(f"Not found: {p}")
+
+    selected = []
+    for f in files:
+        d = file_date(f)
+        if d is not None and ((start and d < start) or (end and d > end)):
+            continue
+        selected.append(f)
+    return sorted(set(selected), key=lambda f: (file_date(f) or "", f.name))
+
+
+# ---------------------------------------------------------------------
+# 2) Parse (worker processes)
+# ---------------------------------------------------------------------
+def _session_date(window_start: str, cache: Dict[str, str]) -> str:
+    """
+    YYYY-MM-DD of a bar from its window_start (ns since the epoch, midnight
+    New York time, which is the same calendar day in UTC).
+    """
+    day = cache.get(window_start)
+    if day is None:
+        seconds = int(window_start) / 1e9
+        day = cache[window_start] = datetime.fromtimestamp(seconds, timezone.utc).strftime("%Y-%m-%d")
+    return day
+
+
+def iter_flat_file_chunks(
+    path: Path, chunk_rows: int = CHUNK_ROWS
+) -> Iterator[Tuple[List[tuple], int]]:
+    """Yield (prices rows, lines skipped) per chunk of CSV lines of one file."""
+    with gzip.open(path, "rt", newline="") as f:
+        reader = csv.reader(f)
+        header = next(reader, None)
+        if header is None:
+            return
+        try:
+            idx = [header.index(name) for name in FLAT_FILE_COLUMNS]
+        except ValueError:
+            raise ValueError(f"{path}: expected columns {', '.join(FLAT_FILE_COLUMNS)}, got {header}")
+        i_ticker, i_volume, i_open, i_close, i_high, i_low, i_window = idx
+        dates: Dict[str, str] = {}
+
+        while True:
+            lines = list(islice(reader, chunk_rows))
+            if not lines:
+                return
+            rows: List[tuple] = []
+            skipped = 0
+            for line in lines:
+                try:
+                    rows.append(
+                        (
+                            line[i_ticker],
+                            _session_date(line[i_window], dates),
+                            float(line[i_open]),
+                            float(line[i_high]),
+                            float(line[i_low]),
+                            float(line[i_close]),
+                            int(float(line[i_volume])),
+                        )
+                    )
+                except (IndexError, ValueError):
+                    skipped += 1
+            yield rows, skipped
+
+
+def parse_flat_file(path: str, chunk_rows: int = CHUNK_ROWS) -> Tuple[str, List[tuple], int]:
+    """Worker: (path, rows, lines skipped) of one file."""
+    rows: List[tuple] = []
+    skipped = 0
+    for chunk, chunk_skipped in iter_flat_file_chunks(Path(path), chunk_rows):
+        rows.extend(chunk)
+        skipped += chunk_skipped
+    return path, rows, skipped
+
+
+def parse_in_order(
+    files: List[Path], workers: int, chunk_rows: int = CHUNK_ROWS
+) -> Iterator[Tuple[str, List[tuple], int]]:
+    """
+    parse_flat_file over `files`, results in file order. At most 2 files per
+    worker are parsed ahead of the writer, which bounds memory.
+    """
+    if workers <= 1:
+        for f in files:
+            yield parse_flat_file(str(f), chunk_rows)
+        return
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        pending: deque = deque()
+        queue = iter(files)
+        for f in islice(queue, workers * 2):
+            pending.append(pool.submit(parse_flat_file, str(f), chunk_rows))
+        while pending:
+            result = pending.popleft().result()
+            for f in islice(queue, 1):
+                pending.append(pool.submit(parse_flat_file, str(f), chunk_rows))
+            yield result
+
+
+# ---------------------------------------------------------------------
+# 3) Write (single writer)
+# ---------------------------------------------------------------------
+def existing_dates(conn: sqlite3.Connection, start: Optional[str], end: Optional[str]) -> set:
+    ensure_date_index(conn)
+    return set(session_dates(conn, start, end))
+
+
+def import_files(
+    conn: sqlite3.Connection,
+    files: List[Path],
+    workers: int,
+    policy: Optional[IngestPolicy] = None,
+    chunk_rows: int = CHUNK_ROWS,
+    commit_files: int = COMMIT_FILES,
+) -> Tuple[int, int, int]:
+    """
+    Import the files, keeping the rows `policy` admits (all without one);
+    returns (rows read, rows left out by the policy, lines skipped).
+    """
+    create_journal_table(conn)
+    policy = policy or IngestPolicy()
+    total_rows = 0
+    total_dropped = 0
+    total_skipped = 0
+    results = parse_in_order(files, workers, chunk_rows)
+    if TQDM_AVAILABLE:
+        results = tqdm(results, total=len(files), desc=f"Importing ({workers} workers)")
+
+    # Sessions imported since the last commit; journaled in the same
+    # transaction as their rows, so update_stocks_db skips them
+    sessions: List[Tuple[str, int]] = []
+
+    def commit() -> None:
+        writer.flush()
+        for session, count in sessions:
+            record_session(conn, session, STATUS_OK, count, 0)
+        sessions.clear()
+        writer.commit()
+
+    with BulkWriter(conn, batch_size=BATCH_ROWS) as writer:
+        for n, (path, rows, skipped) in enumerate(results, start=1):
+            kept, dropped = policy.filter_rows(rows)
+            writer.insert(INSERT_PRICES_SQL, kept)
+            total_rows += len(rows)
+            total_dropped += dropped
+            total_skipped += skipped
+            if skipped:
+                print(f"[WARN] {Path(path).name}: skipped {skipped} malformed line(s)")
+            session = file_date(Path(path))
+            if session is not None and rows:
+                sessions.append((session, len(kept)))
+            if n % commit_files == 0:
+                commit()
+        commit()
+    return total_rows, total_dropped, total_skipped
+
+
+# ---------------------------------------------------------------------
+# 4) Main entry point
+# ---------------------------------------------------------------------
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Import Polygon day-aggregate flat files (*.csv.gz) into stocks.db prices."
+    )
+    parser.add_argument("paths", nargs="+", help="Flat files or directories to search recursively")
+    parser.add_argument("--start", help="First session to import (YYYY-MM-DD)")
+    parser.add_argument("--end", help="Last session to import (YYYY-MM-DD)")
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=0,
+        help="Parser processes (default: CPU count)",
+    )
+    parser.add_argument(
+        "--reimport",
+        action="store_true",
+        help="Also import sessions that already have prices (existing rows are kept)",
+    )
+    parser.add_argument("--db", default=STOCKS_DB, help=f"Database (default: {STOCKS_DB})")
+    add_policy_arguments(parser)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if not os.path.exists(args.db):
+        raise SystemExit(f"Database file not found: {args.db}")
+    workers = args.workers or os.cpu_count() or 1
+
+    files = find_flat_files(args.paths, args.start, args.end)
+    conn = sqlite3.connect(args.db)
+    try:
+        if not args.reimport:
+            have = existing_dates(conn, args.start, args.end)
+            files = [f for f in files if file_date(f) not in have]
+        if not files:
+            print("[INFO] No flat files to import.")
+            return
+        print(
+            f"[INFO] Importing {len(files)} file(s) "
+            f"({file_date(files[0]) or files[0].name} .. {file_date(files[-1]) or files[-1].name})"
+        )
+
+        policy = policy_from_args(args, conn)
+        t0 = time.time()
+        rows, dropped, skipped = import_files(conn, files, workers, policy)
+        elapsed = time.time() - t0
+        print(
+            f"[INFO] Done. {rows} row(s) read from {len(files)} file(s) in {elapsed:.1f}s "
+            f"({rows / max(elapsed, 1e-9):,.0f} rows/s), {dropped} left out by the ingest "
+            f"policy, {skipped} malformed line(s) skipped."
+        )
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,168 @@
+# ingest_policy.py
+# Which rows of a grouped-daily response (or flat file) are stored in prices.
+#
+#   all      every row (default)
+#   universe only the tickers of stocks_lists.db
+#   rules    the tracked tickers, plus other tickers whose bar passes
+#            minimum price / dollar volume and does not match the exclude
+#            pattern (warrants, units, preferreds, rights, ...)
+#
+# Under rules, tickers that already have rows in prices are kept too, so a
+# ticker is never cut into pieces by a quiet day. compact_stocks_db.py prunes
+# existing tickers under the same policy, judging each one by its recent
+# bars. Defaults come from the environment (.env) so every writer uses
+# the same policy:
+#
+#   INGEST_POLICY=rules INGEST_MIN_PRICE=1 INGEST_MIN_DOLLAR_VOLUME=1000000
+import argparse
+import os
+import re
+import sqlite3
+from dataclasses import dataclass, field
+from typing import Iterator, List, Set, Tuple
+
+from price_reader import COMPACT_TABLE, SYMBOLS_TABLE, prices_layout
+from utils import STOCKS_LISTS_DB
+
+POLICY_ALL = "all"
+POLICY_UNIVERSE = "universe"
+POLICY_RULES = "rules"
+POLICIES = (POLICY_ALL, POLICY_UNIVERSE, POLICY_RULES)
+
+MIN_PRICE = 1.0
+MIN_DOLLAR_VOLUME = 1_000_000.0
+# Polygon marks share classes other than common stock with lower-case
+# suffixes (BACpL preferred, ABCw warrants, ABCr rights, ABCu units) or
+# dotted ones (.WS, .U, .RT, .WI)
+EXCLUDE_PATTERN = r"[a-z]|\.(WS|U|RT|W|WI)$"
+
+
+@dataclass
+class IngestPolicy:
+    mode: str = POLICY_ALL
+    min_price: float = MIN_PRICE
+    min_dollar_volume: float = MIN_DOLLAR_VOLUME
+    exclude_pattern: str = EXCLUDE_PATTERN
+    universe: Set[str] = field(default_factory=set)  # tracked tickers
+    known: Set[str] = field(default_factory=set)     # tickers with rows in prices
+
+    def __post_init__(self):
+        if self.mode not in POLICIES:
+            raise ValueError(f"Unknown ingest policy {self.mode!r} (one of {', '.join(POLICIES)})")
+        self._exclude = re.compile(self.exclude_pattern) if self.exclude_pattern else None
+
+    def passes_rules(self, ticker: str, close: float, dollar_volume: float) -> bool:
+        """Whether an untracked ticker qualifies under the rules."""
+        if self._exclude is not None and self._exclude.search(ticker):
+            return False
+        return close >= self.min_price and dollar_volume >= self.min_dollar_volume
+
+    def filter_rows(self, rows: List[tuple]) -> Tuple[List[tuple], int]:
+        """
+        (kept rows, number dropped) of prices rows (symbol, date, open,
+        high, low, close, volume). Under rules, tickers admitted here are
+        kept from then on.
+        """
+        if self.mode == POLICY_ALL:
+            return rows, 0
+        kept = []
+        for row in rows:
+            ticker = row[0]
+            if ticker in self.universe:
+                kept.append(row)
+            elif self.mode == POLICY_RULES and (
+                ticker in self.known or self.passes_rules(ticker, row[5], row[5] * row[6])
+            ):
+                self.known.add(ticker)
+                kept.append(row)
+        return kept, len(rows) - len(kept)
+
+
+def stored_symbols(conn: sqlite3.Connection) -> Iterator[str]:
+    """Distinct symbols of prices, one primary-key seek per symbol."""
+    if prices_layout(conn).compact:
+        # The symbols dictionary can hold tickers whose rows were deleted
+        yield from (
+            row[0]
+            for row in conn.execute(
+                f"SELECT s.symbol FROM {SYMBOLS_TABLE} s WHERE EXISTS "
+                f"(SELECT 1 FROM {COMPACT_TABLE} p WHERE p.symbol_id = s.id) ORDER BY s.symbol"
+            )
+        )
+        return
+    symbol = conn.execute("SELECT MIN(symbol) FROM prices").fetchone()[0]
+    while symbol is not None:
+        yield symbol
+        symbol = conn.execute(
+            "SELECT MIN(symbol) FROM prices WHERE symbol > ?", (symbol,)
+        ).fetchone()[0]
+
+
+def tracked_tickers(lists_db: str = STOCKS_LISTS_DB) -> Set[str]:
+    conn = sqlite3.connect(lists_db)
+    try:
+        return {row[0] for row in conn.execute("SELECT ticker FROM stocks WHERE ticker IS NOT NULL")}
+    finally:
+        conn.close()
+
+
+def load_policy(
+    mode: str,
+    conn: sqlite3.Connection,
+    min_price: float = MIN_PRICE,
+    min_dollar_volume: float = MIN_DOLLAR_VOLUME,
+    exclude_pattern: str = EXCLUDE_PATTERN,
+    lists_db: str = STOCKS_LISTS_DB,
+) -> IngestPolicy:
+    """Policy with the tracked universe (and, for rules, the stored tickers) loaded."""
+    if mode == POLICY_ALL:
+        return IngestPolicy(mode)
+    return IngestPolicy(
+        mode,
+        min_price,
+        min_dollar_volume,
+        exclude_pattern,
+        universe=tracked_tickers(lists_db),
+        known=set(stored_symbols(conn)) if mode == POLICY_RULES else set(),
+    )
+
+
+# ---------------------------------------------------------------------
+# Command line
+# ---------------------------------------------------------------------
+def add_policy_arguments(parser: argparse.ArgumentParser) -> None:
+    """--policy / --min-price / --min-dollar-volume / --exclude-pattern, defaulting to $INGEST_*."""
+    parser.add_argument(
+        "--policy",
+        choices=POLICIES,
+        default=os.environ.get("INGEST_POLICY", POLICY_ALL),
+        help="Rows to store: all, universe (stocks_lists.db tickers) or rules "
+        "(tracked tickers + tickers passing the rules) (default: $INGEST_POLICY or all)",
+    )
+    parser.add_argument(
+        "--min-price",
+        type=float,
+        default=float(os.environ.get("INGEST_MIN_PRICE", MIN_PRICE)),
+        help=f"rules: minimum close (default: $INGEST_MIN_PRICE or {MIN_PRICE:g})",
+    )
+    parser.add_argument(
+        "--min-dollar-volume",
+        type=float,
+        default=float(os.environ.get("INGEST_MIN_DOLLAR_VOLUME", MIN_DOLLAR_VOLUME)),
+        help=f"rules: minimum close * volume (default: $INGEST_MIN_DOLLAR_VOLUME or {MIN_DOLLAR_VOLUME:,.0f})",
+    )
+    parser.add_argument(
+        "--exclude-pattern",
+        default=os.environ.get("INGEST_EXCLUDE_PATTERN", EXCLUDE_PATTERN),
+        help="rules: regex of tickers never admitted, '' for none "
+        f"(default: $INGEST_EXCLUDE_PATTERN or {EXCLUDE_PATTERN})",
+    )
+
+
+def policy_from_args(args: argparse.Namespace, conn: sqlite3.Connection) -> IngestPolicy:
+    policy = load_policy(
+        args.policy, conn, args.min_price, args.min_dollar_volume, args.exclude_pattern
+    )
+    if policy.mode != POLICY_ALL:
+        print(f"[INFO] Ingest policy: {policy.mode} ({len(policy.universe)} tracked tickers)")
+    return policy
@@ -0,0 +1,481 @@
+# metrics_engine.py
+# Vectorized metrics engine: whole-universe close matrix -> metrics rows.
+#
+# Closes are held in a (rows x symbols) float matrix where each column is one
+# symbol's own consecutive price rows (NaN where the symbol has no row). Row
+# offsets therefore count the symbol's sessions exactly like the original
+# per-symbol code did (closes[latest_idx - 21] etc.), even across holes.
+
+import sqlite3
+from functools import partial
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from price_cache import PriceCache
+from price_reader import closes_before, date_before, iter_symbol_prices, session_dates, symbols_between
+
+# Timeframes in trading days (sessions) for Absolute Strength & Sortino-AS
+TIMEFRAMES = {
+    "1w": 5,
+    "1m": 21,
+    "3m": 63,
+    "6m": 126,
+    "12m": 252,
+}
+
+RETURN_WINDOWS = {
+    "daily_return": 1,
+    "return_5d": 5,
+    "return_21d": 21,
+    "return_63d": 63,
+    "return_126d": 126,
+    "return_252d": 252,
+}
+
+MA_WINDOWS = [10, 20, 50, 200]
+
+# 52 weeks ~ 252 trading sessions (including the current one)
+WINDOW_52W = 252
+
+# Rows per symbol needed to compute one date: the 12m return / drawdown looks
+# 252 sessions back from the current row.
+HISTORY_DEPTH = 253
+
+# History carried from one block of sessions to the next
+CARRY_DEPTH = HISTORY_DEPTH - 1
+
+# Sessions computed together (bounds the size of the block arrays)
+BLOCK_SESSIONS = 21
+
+# Column order of the metrics table (and of the tuples built by metrics_rows)
+METRIC_COLUMNS = [
+    "symbol",
+    "date",
+    "daily_return",
+    "return_5d",
+    "return_21d",
+    "return_63d",
+    "return_126d",
+    "return_252d",
+    "ma10_slope",
+    "ma20_slope",
+    "ma50_slope",
+    "ma200_slope",
+    "dist_52w_high",
+    "dist_52w_low",
+    "mdd_1w",
+    "mdd_1m",
+    "mdd_3m",
+    "mdd_6m",
+    "mdd_12m",
+    "as_1w_prank",
+    "as_1m_prank",
+    "as_3m_prank",
+    "as_6m_prank",
+    "as_12m_prank",
+    "sortino_as_1w_prank",
+    "sortino_as_1m_prank",
+    "sortino_as_3m_prank",
+    "sortino_as_6m_prank",
+    "sortino_as_12m_prank",
+]
+
+INTEGER_COLUMNS = {"ma10_slope", "ma20_slope", "ma50_slope", "ma200_slope"}
+
+
+# ---------------------------------------------------------------------
+# Array kernels
+# ---------------------------------------------------------------------
+def _lagged(closes: np.ndarray, k: int, start_row: int) -> np.ndarray:
+    """Return closes[t - k] for t in [start_row, T), NaN where t - k < 0."""
+    total = closes.shape[0]
+    out = np.full((total - start_row,) + closes.shape[1:], np.nan)
+    first = max(start_row, k)
+    if first < total:
+        out[first - start_row :] = closes[first - k : total - k]
+    return out
+
+
+def _ratio_minus_one(num: np.ndarray, den: np.ndarray) -> np.ndarray:
+    """(num / den) - 1, NaN where den is 0 or missing."""
+    with np.errstate(divide="ignore", invalid="ignore"):
+        out = num / den - 1
+    out[den == 0] = np.nan
+    return out
+
+
+def rolling_extreme(
+    values: np.ndarray, window: int, start_row: int, ufunc=np.fmax
+) -> np.ndarray:
+    """
+    Rolling max (ufunc=np.fmax) or min (ufunc=np.fmin) over the `window` rows
+    ending at each t in [start_row, T), ignoring NaN (so the window shrinks
+    near the start of a symbol's history).
+
+    Uses the van Herk / Gil-Werman block trick: O(1) work per element.
+    """
+    total = values.shape[0]
+    lo = max(0, start_row - window + 1)
+    seg = values[lo:]
+    n = seg.shape[0]
+    if n == 0:
+        return np.full((0,) + values.shape[1:], np.nan)
+
+    blocks = -(-n // window)
+    padded = np.full((blocks * window,) + seg.shape[1:], np.nan)
+    padded[:n] = seg
+    shaped = padded.reshape((blocks, window) + seg.shape[1:])
+
+    prefix = ufunc.accumulate(shaped, axis=1).reshape(padded.shape)[:n]
+    suffix = ufunc.accumulate(shaped[:, ::-1], axis=1)[:, ::-1].reshape(padded.shape)[:n]
+
+    # Window [t - window + 1, t] spans at most two blocks: the tail of the
+    # left one (suffix) and the head of the right one (prefix). Windows cut
+    # by the start of the segment lie inside block 0 and are just prefix[t].
+    ts = np.arange(start_row, total) - lo
+    left = ts - window + 1
+    out = prefix[ts]
+    full = left >= 0
+    out[full] = ufunc(suffix[left[full]], out[full])
+    return out
+
+
+def _replayed_slope(column: np.ndarray, t: int, window: int) -> int:
+    """Slope at row t from the two window sums, summed left to right like the scalar code."""
+    today = sum(column[t - window + 1 : t + 1].tolist()) / window
+    prev = sum(column[t - window : t].tolist()) / window
+    if today > prev:
+        return 1
+    if today < prev:
+        return -1
+    return 0
+
+
+def _slope_sign(
+    closes: np.ndarray, cumsum: np.ndarray, counts: np.ndarray, window: int, start_row: int
+) -> np.ndarray:
+    """
+    Direction of the `window` moving average between t - 1 and t
+    (-1 = down, 0 = flat, 1 = up, NaN when there is no previous row).
+
+    With both windows full, MA(t) - MA(t-1) = (close[t] - close[t-window]) / window,
+    so the sign is read off the two closes directly. Where the difference is
+    within rounding distance of the window sums (flat prices), the two sums
+    are replayed so ties resolve exactly as before. Near the start of a
+    symbol's history the windows are expanding and both averages come from
+    running sums, as the SQL-style window in the original code did.
+    """
+    today = closes[start_row:]
+    oldest = _lagged(closes, window, start_row)
+    diff = today - oldest
+    slope = np.sign(diff)
+
+    abs_cumsum = np.cumsum(np.abs(np.nan_to_num(closes)), axis=0)
+    abs_sum = abs_cumsum[start_row:] - _lagged(abs_cumsum, window, start_row)
+    with np.errstate(invalid="ignore"):
+        near = np.abs(diff) <= 4 * window * np.finfo(float).eps * abs_sum
+    for r, s in zip(*np.nonzero(near)):
+        slope[r, s] = _replayed_slope(closes[:, s], start_row + r, window)
+
+    expanding = np.isnan(oldest)
+    if expanding.any():
+        n_today = counts[start_row:]
+        n_prev = _lagged(counts, 1, start_row)
+        s_prev = _lagged(cumsum, 1, start_row)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            ma_today = cumsum[start_row:] / n_today
+            ma_prev = s_prev / n_prev
+        grown = np.sign(ma_today - ma_prev)
+        grown[~(n_prev > 0)] = np.nan
+        slope = np.where(expanding, grown, slope)
+
+    slope[np.isnan(today)] = np.nan
+    return slope
+
+
+def _merge_drawdown(
+    earlier: Tuple[np.ndarray, np.ndarray, np.ndarray],
+    later: Tuple[np.ndarray, np.ndarray, np.ndarray],
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Combine (high, low, max drawdown) of two adjacent row spans.
+
+    The drawdown of the union is the worse of both parts and of the fall
+    from the earlier span's high to the later span's low, computed with the
+    same (p / peak) - 1.0 arithmetic as the scalar running-peak loop.
+    """
+    hi_a, lo_a, dd_a = earlier
+    hi_b, lo_b, dd_b = later
+    with np.errstate(divide="ignore", invalid="ignore"):
+        dd = (lo_b / hi_a) - 1.0
+    cross = np.where((hi_a > 0) & (dd < 0), -dd, 0.0)
+    return (
+        np.maximum(hi_a, hi_b),
+        np.minimum(lo_a, lo_b),
+        np.maximum(np.maximum(dd_a, dd_b), cross),
+    )
+
+
+def _max_drawdowns(closes: np.ndarray, start_row: int) -> Dict[str, np.ndarray]:
+    """
+    Max drawdown (positive fraction) over rows [t - days, t] for every
+    timeframe and every t in [start_row, T), NaN where the window start is
+    missing.
+
+    Span statistics are doubled level by level (1, 2, 4, ... rows) and each
+    window is assembled from the spans of its binary decomposition, so the
+    cost is O(log window) per row instead of a walk over the whole window.
+    """
+    level = (closes, closes, np.where(np.isnan(closes), np.nan, 0.0))
+    size = 1
+    acc: Dict[str, Tuple[np.ndarray, np.ndarray, np.ndarray]] = {}
+    acc_len = {tf_label: 0 for tf_label in TIMEFRAMES}
+    widest = max(TIMEFRAMES.values()) + 1
+
+    while True:
+        for tf_label, tf_days in TIMEFRAMES.items():
+            if (tf_days + 1) & size:
+                # Span of `size` rows ending right before what is already covered
+                span = tuple(_lagged(part, acc_len[tf_label], start_row) for part in level)
+                acc[tf_label] = _merge_drawdown(span, acc[tf_label]) if tf_label in acc else span
+                acc_len[tf_label] += size
+
+        if size * 2 > widest:
+            break
+        lagged = tuple(_lagged(part, size, 0) for part in level)
+        level = _merge_drawdown(lagged, level)
+        size *= 2
+
+    out = {}
+    for tf_label, tf_days in TIMEFRAMES.items():
+        mdd = acc[tf_label][2]
+        mdd[np.isnan(_lagged(closes, tf_days, start_row))] = np.nan
+        out[tf_label] = mdd
+    return out
+
+
+def compute_metrics(closes: np.ndarray, start_row: int = 0) -> Dict[str, np.ndarray]:
+    """
+    Compute raw metrics for every row t in [start_row, T) of a
+    (rows x symbols) close matrix.
+
+    Returns {column: array of shape (T - start_row, symbols)} with NaN for
+    missing values. Besides the stored columns it contains the Absolute
+    Strength ("as_<tf>") and Sortino-AS ("sortino_<tf>") raw values that
+    the percentile ranks are taken from.
+    """
+    out: Dict[str, np.ndarray] = {}
+    today = closes[start_row:]
+
+    # --- Returns (all based on trading sessions / row offsets) ---
+    for col, k in RETURN_WINDOWS.items():
+        out[col] = _ratio_minus_one(today, _lagged(closes, k, start_row))
+
+    # --- Moving average slopes ---
+    valid = ~np.isnan(closes)
+    cumsum = np.cumsum(np.where(valid, closes, 0.0), axis=0)
+    counts = np.cumsum(valid, axis=0).astype(float)
+    for w in MA_WINDOWS:
+        out[f"ma{w}_slope"] = _slope_sign(closes, cumsum, counts, w, start_row)
+
+    # --- 52-week high/low over the last 252 sessions (including today) ---
+    high_52w = rolling_extreme(closes, WINDOW_52W, start_row, np.fmax)
+    low_52w = rolling_extreme(closes, WINDOW_52W, start_row, np.fmin)
+    out["dist_52w_high"] = _ratio_minus_one(today, high_52w)
+    out["dist_52w_low"] = _ratio_minus_one(today, low_52w)
+
+    # --- Absolute Strength & Sortino-AS raw values, + MDD per timeframe ---
+    mdds = _max_drawdowns(closes, start_row)
+    for tf_label, tf_days in TIMEFRAMES.items():
+        mdd = mdds[tf_label]
+        ret = _ratio_minus_one(today, _lagged(closes, tf_days, start_row))
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            sortino = np.where(mdd > 0, ret / mdd, np.nan)
+            sortino = np.where(mdd == 0, ret / 0.001, sortino)
+
+        out[f"mdd_{tf_label}"] = mdd
+        out[f"as_{tf_label}"] = ret
+        out[f"sortino_{tf_label}"] = sortino
+
+    return out
+
+
+def percentile_ranks(values: np.ndarray) -> np.ndarray:
+    """
+    Cross-sectional percentile ranks of a 1-D array where higher is better:
+    0 = worst, 100 = best, NaN stays NaN. Ties keep their input order
+    (callers pass symbols sorted by name).
+    """
+    ranks = np.full(values.shape, np.nan)
+    idx = np.flatnonzero(~np.isnan(values))
+    n = len(idx)
+    if n == 0:
+        return ranks
+    if n == 1:
+        ranks[idx] = 100.0
+        return ranks
+
+    order = idx[np.argsort(values[idx], kind="stable")]
+    ranks[order] = 100.0 * np.arange(n) / (n - 1)
+    return ranks
+
+
+def add_percentile_ranks(metrics: Dict[str, np.ndarray]) -> None:
+    """Fill as_<tf>_prank / sortino_as_<tf>_prank for a 1-D (one date) metrics dict."""
+    for tf_label in TIMEFRAMES.keys():
+        metrics[f"as_{tf_label}_prank"] = percentile_ranks(metrics[f"as_{tf_label}"])
+        metrics[f"sortino_as_{tf_label}_prank"] = percentile_ranks(metrics[f"sortino_{tf_label}"])
+
+
+def metrics_rows(
+    symbols: Sequence[str], dates: Sequence[str], metrics: Dict[str, np.ndarray]
+) -> List[tuple]:
+    """
+    Turn 1-D metrics arrays (one entry per symbol/date pair) into insert
+    tuples in METRIC_COLUMNS order, with None for NaN.
+    """
+    columns: List[list] = [list(symbols), list(dates)]
+    for col in METRIC_COLUMNS[2:]:
+        arr = metrics[col]
+        missing = np.isnan(arr)
+        if col in INTEGER_COLUMNS:
+            arr = np.where(missing, 0, arr).astype(np.int64)
+        obj = arr.astype(object)
+        obj[missing] = None
+        columns.append(obj.tolist())
+    return list(zip(*columns))
+
+
+# ---------------------------------------------------------------------
+# Blocks of sessions
+# ---------------------------------------------------------------------
+def compute_block(
+    symbols: Sequence[str],
+    carry: np.ndarray,
+    sessions: Sequence[str],
+    new_dates: Sequence[Sequence[str]],
+    new_closes: Sequence[Sequence[float]],
+) -> Dict[str, List[tuple]]:
+    """
+    Compute metrics rows for one block of sessions.
+
+    carry holds the last CARRY_DEPTH closes of every symbol before the block
+    (right-aligned, NaN-padded) and is advanced in place. new_dates /
+    new_closes hold each symbol's rows inside the block, whose dates are all
+    in `sessions`. Returns {date: rows}, percentile ranks taken per date.
+    """
+    counts = np.array([len(d) for d in new_dates], dtype=np.int64)
+    active = np.flatnonzero(counts)
+    if len(active) == 0:
+        return {}
+
+    code_of = {d: i for i, d in enumerate(sessions)}
+    depth = int(counts.max())
+    total = CARRY_DEPTH + depth
+
+    # Each active symbol's carry + new rows, right-aligned
+    closes = np.full((total, len(active)), np.nan)
+    codes = np.full((depth, len(active)), -1, dtype=np.int64)
+    for j, col in enumerate(active):
+        n = counts[col]
+        closes[depth - n : total - n, j] = carry[:, col]
+        closes[total - n :, j] = new_closes[col]
+        codes[depth - n :, j] = [code_of[d] for d in new_dates[col]]
+    carry[:, active] = closes[-CARRY_DEPTH:]
+
+    metrics = compute_metrics(closes, CARRY_DEPTH)
+
+    # Regroup the new rows by date (then symbol) for the cross-sectional ranks
+    rows_idx, cols_idx = np.nonzero(codes >= 0)
+    row_codes = codes[rows_idx, cols_idx]
+    order = np.lexsort((cols_idx, row_codes))
+    rows_idx, cols_idx, row_codes = rows_idx[order], cols_idx[order], row_codes[order]
+    bounds = np.flatnonzero(row_codes[1:] != row_codes[:-1]) + 1
+
+    out: Dict[str, List[tuple]] = {}
+    for sel in np.split(np.arange(len(order)), bounds):
+        r, c = rows_idx[sel], cols_idx[sel]
+        day = {col: arr[r, c] for col, arr in metrics.items()}
+        add_percentile_ranks(day)
+        date = sessions[row_codes[sel[0]]]
+        out[date] = metrics_rows([symbols[k] for k in active[c]], [date] * len(c), day)
+    return out
+
+
+def iter_metrics_by_date(
+    conn: sqlite3.Connection,
+    start_date: str,
+    end_date: str,
+    block_sessions: int = BLOCK_SESSIONS,
+    cache: Optional[PriceCache] = None,
+    columns: Sequence[str] = ("date", "close"),
+    visit: Optional[Callable[[str, Dict[str, np.ndarray]], None]] = None,
+) -> Iterator[Tuple[str, List[tuple]]]:
+    """
+    Yield (date, rows) for every session in [start_date, end_date], in order.
+
+    Sessions are processed in blocks: each block is one ordered scan of its
+    own price rows and carries the last CARRY_DEPTH closes per symbol into
+    the next one, so every price row is read once and memory stays bounded
+    by the block. The carry of the first block comes from one scan of
+    the CARRY_DEPTH sessions before start_date. An incremental update of
+    the newest dates therefore reads 253 sessions per symbol at most,
+    whatever the length of the history. With a price `cache`
+    (price_cache.py), the price rows are read from it instead of conn.
+
+    visit(symbol, cols), if given, is called for every symbol of every
+    block scan with its `columns` (which must include "date" and "close"),
+    so another per-symbol pass over the rows in [start_date, end_date] can
+    share the scan. The lookback scan only reads dates and closes.
+    """
+    if cache is not None:
+        scan, read_older = cache.iter_symbol_prices, cache.closes_before
+    else:
+        scan, read_older = partial(iter_symbol_prices, conn), partial(closes_before, conn)
+
+    sessions = session_dates(conn, start_date, end_date)
+    if not sessions:
+        return
+
+    symbols = symbols_between(conn, start_date, end_date)
+    col_of = {symbol: col for col, symbol in enumerate(symbols)}
+    carry = np.full((CARRY_DEPTH, len(symbols)), np.nan)
+
+    # Carry into the first block: the CARRY_DEPTH sessions before it
+    lookback_end = date_before(conn, sessions[0])
+    if lookback_end is not None:
+        lookback_start = date_before(conn, sessions[0], CARRY_DEPTH)
+        carried = np.zeros(len(symbols), dtype=np.int64)
+        for symbol, cols in scan(("date", "close"), start_date=lookback_start, end_date=lookback_end):
+            col = col_of.get(symbol)
+            if col is None:
+                continue  # no rows inside [start_date, end_date]
+            old = cols["close"][-CARRY_DEPTH:]
+            carry[CARRY_DEPTH - len(old) :, col] = old
+            carried[col] = len(old)
+
+        if lookback_start is not None:
+            # Holes or a short history in the lookback window: a symbol's
+            # own previous rows may start before lookback_start
+            for col in np.flatnonzero(carried < CARRY_DEPTH):
+                top = CARRY_DEPTH - int(carried[col])
+                older = read_older(symbols[col], lookback_start, top)
+                carry[top - len(older) : top, col] = older
+
+    for i in range(0, len(sessions), block_sessions):
+        block = sessions[i : i + block_sessions]
+        new_dates: List[List[str]] = [[] for _ in symbols]
+        new_closes: List[np.ndarray] = [np.empty(0) for _ in symbols]
+
+        for symbol, cols in scan(columns, start_date=block[0], end_date=block[-1]):
+            if visit is not None:
+                visit(symbol, cols)
+            col = col_of[symbol]
+            new_dates[col] = cols["date"].tolist()
+            new_closes[col] = cols["close"]
+
+        by_date = compute_block(symbols, carry, block, new_dates, new_closes)
+        for date in block:
+            yield date, by_date.get(date, [])
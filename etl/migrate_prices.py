@@ -0,0 +1,329 @@
+#!/usr/bin/env python3
+# migrate_prices.py
+# Storage layout migration of stocks.db prices.
+#
+#   python migrate_prices.py compact              # in place, after a backup snapshot
+#   python migrate_prices.py compact --scaled     # prices as fixed-point integers too
+#   python migrate_prices.py compact --output ../data/stocks_compact.db
+#   python migrate_prices.py legacy               # back to the TEXT-keyed table
+#
+# The legacy layout repeats the ticker and a 'YYYY-MM-DD' string in every
+# row, twice counting the (date, symbol) index. The compact layout stores:
+#
+#   symbols(id, symbol)              ticker dictionary, ids in ticker order
+#   prices_compact(symbol_id, date, open, high, low, close, volume, open_interest)
+#                                    WITHOUT ROWID, clustered on (symbol_id, date),
+#                                    date as the integer YYYYMMDD
+#   prices_meta(key, value)          price_scale: 1, or 10000 with --scaled
+#
+# With --scaled, prices are stored as round(price * 10000) integers (SQLite
+# has no 4-byte float; a varint of a few bytes is its closest equivalent to
+# float32). That is exact for prices with up to 4 decimals; the migration
+# reports how many values it rounds and by how much.
+#
+# prices itself becomes a view with the legacy columns, and INSTEAD OF
+# triggers route INSERT / UPDATE / DELETE to prices_compact, so the app's
+# /api/ohlc query and every writer keep working unchanged. The ETL readers
+# (price_reader.py) query prices_compact directly.
+
+import argparse
+import os
+import sqlite3
+import time
+from typing import Optional
+
+from db_backup import backup_database
+from price_reader import COMPACT_TABLE, META_TABLE, SYMBOLS_TABLE, prices_layout
+
+STOCKS_DB = "../data/stocks.db"
+
+# Fixed-point factor of --scaled: 4 decimals
+PRICE_SCALE = 10_000
+PRICE_FIELDS = ("open", "high", "low", "close")
+
+LEGACY_SCHEMA_SQL = """
+    CREATE TABLE prices (
+        symbol TEXT NOT NULL,
+        date TEXT NOT NULL,
+        open REAL,
+        high REAL,
+        low REAL,
+        close REAL,
+        volume INTEGER,
+        open_interest INTEGER DEFAULT 0,
+        PRIMARY KEY (symbol, date)
+    );
+"""
+
+# 'YYYY-MM-DD' <-> YYYYMMDD
+DATE_TO_INT_SQL = "CAST(REPLACE({}, '-', '') AS INTEGER)"
+INT_TO_DATE_SQL = "printf('%04d-%02d-%02d', {0} / 10000, {0} / 100 % 100, {0} % 100)"
+
+
+# ---------------------------------------------------------------------
+# SQL of the compact layout
+# ---------------------------------------------------------------------
+def _encode(expr: str, scale: int) -> str:
+    """SQL storing a price in prices_compact."""
+    return f"CAST(ROUND({expr} * {scale}) AS INTEGER)" if scale != 1 else expr
+
+
+def _decode(expr: str, scale: int) -> str:
+    """SQL reading a price back from prices_compact."""
+    return f"{expr} / {scale}.0" if scale != 1 else expr
+
+
+def compact_schema_sql(scale: int) -> str:
+    price_type = "INTEGER" if scale != 1 else "REAL"
+    prices = ",\n".join(f"        {col} {price_type}" for col in PRICE_FIELDS)
+    return f"""
+    CREATE TABLE {SYMBOLS_TABLE} (
+        id INTEGER PRIMARY KEY,
+        symbol TEXT NOT NULL UNIQUE
+    );
+    CREATE TABLE {COMPACT_TABLE} (
+        symbol_id INTEGER NOT NULL,
+        date INTEGER NOT NULL,
+{prices},
+        volume INTEGER,
+        open_interest INTEGER DEFAULT 0,
+        PRIMARY KEY (symbol_id, date)
+    ) WITHOUT ROWID;
+    CREATE TABLE {META_TABLE} (
+        key TEXT PRIMARY KEY,
+        value
+    ) WITHOUT ROWID;
+    """
+
+
+def legacy_select_sql(scale: int) -> str:
+    """The legacy prices columns from prices_compact, in (symbol, date) order."""
+    prices = ", ".join(f"{_decode('p.' + col, scale)} AS {col}" for col in PRICE_FIELDS)
+    return f"""
+        SELECT s.symbol AS symbol, {INT_TO_DATE_SQL.format('p.date')} AS date,
+               {prices}, p.volume AS volume, p.open_interest AS open_interest
+        FROM {SYMBOLS_TABLE} s CROSS JOIN {COMPACT_TABLE} p ON p.symbol_id = s.id
+    """
+
+
+def view_sql(scale: int) -> str:
+    """prices view plus the INSTEAD OF triggers writing through it."""
+    symbol_id = f"(SELECT id FROM {SYMBOLS_TABLE} WHERE symbol = {{}}.symbol)"
+    # Plain INSERT ... WHERE NOT EXISTS rather than INSERT OR IGNORE: the
+    # conflict policy of the statement writing to the view (e.g. INSERT OR
+    # REPLACE) overrides the ones inside the trigger
+    add_symbol = (
+        f"INSERT INTO {SYMBOLS_TABLE} (symbol) SELECT NEW.symbol "
+        f"WHERE NOT EXISTS (SELECT 1 FROM {SYMBOLS_TABLE} WHERE symbol = NEW.symbol);"
+    )
+    match_old = (
+        f"symbol_id = {symbol_id.format('OLD')} AND date = {DATE_TO_INT_SQL.format('OLD.date')}"
+    )
+    new_prices = ", ".join(_encode(f"NEW.{col}", scale) for col in PRICE_FIELDS)
+    set_prices = ", ".join(f"{col} = {_encode('NEW.' + col, scale)}" for col in PRICE_FIELDS)
+    return f"""
+    CREATE VIEW prices AS {legacy_select_sql(scale)};
+
+    CREATE TRIGGER prices_insert INSTEAD OF INSERT ON prices
+    BEGIN
+        {add_symbol}
+        INSERT INTO {COMPACT_TABLE}
+            (symbol_id, date, open, high, low, close, volume, open_interest)
+        VALUES (
+            {symbol_id.format('NEW')}, {DATE_TO_INT_SQL.format('NEW.date')},
+            {new_prices}, NEW.volume, COALESCE(NEW.open_interest, 0)
+        );
+    END;
+
+    CREATE TRIGGER prices_update INSTEAD OF UPDATE ON prices
+    BEGIN
+        {add_symbol}
+        UPDATE {COMPACT_TABLE}
+        SET symbol_id = {symbol_id.format('NEW')}, date = {DATE_TO_INT_SQL.format('NEW.date')},
+            {set_prices}, volume = NEW.volume, open_interest = NEW.open_interest
+        WHERE {match_old};
+    END;
+
+    CREATE TRIGGER prices_delete INSTEAD OF DELETE ON prices
+    BEGIN
+        DELETE FROM {COMPACT_TABLE} WHERE {match_old};
+    END;
+    """
+
+
+def _statements(script: str):
+    """Split a script into statements (trigger bodies contain semicolons)."""
+    statement = ""
+    for part in script.split(";"):
+        statement += part + ";"
+        if sqlite3.complete_statement(statement):
+            if statement.strip() != ";":
+                yield statement.strip()
+            statement = ""
+
+
+# ---------------------------------------------------------------------
+# Migrations
+# ---------------------------------------------------------------------
+def rounding_report(conn: sqlite3.Connection, scale: int) -> None:
+    """How many legacy prices the fixed-point encoding changes, and the largest change."""
+    changed = " + ".join(f"({col} <> ROUND({col} * {scale}) / {scale}.0)" for col in PRICE_FIELDS)
+    error = ", ".join(f"ABS({col} - ROUND({col} * {scale}) / {scale}.0)" for col in PRICE_FIELDS)
+    rounded, max_error = conn.execute(
+        f"SELECT TOTAL({changed}), MAX(MAX({error})) FROM prices"
+    ).fetchone()
+    print(
+        f"[INFO] Fixed-point prices (x{scale}): {int(rounded)} value(s) rounded, "
+        f"max error {max_error or 0.0:.2g}."
+    )
+
+
+def to_compact(conn: sqlite3.Connection, scale: int = 1) -> int:
+    """Migrate a legacy prices table to the compact layout; returns the rows moved."""
+    t0 = time.time()
+    if scale != 1:
+        rounding_report(conn, scale)
+    rows = conn.execute("SELECT COUNT(*) FROM prices").fetchone()[0]
+
+    conn.execute("BEGIN")
+    for statement in _statements(compact_schema_sql(scale)):
+        conn.execute(statement)
+    conn.execute(
+        f"INSERT INTO {SYMBOLS_TABLE} (symbol) SELECT DISTINCT symbol FROM prices ORDER BY symbol"
+    )
+    prices = ", ".join(_encode("p." + col, scale) for col in PRICE_FIELDS)
+    # Both sides in (symbol, date) order: the copy appends to the clustered key
+    conn.execute(
+        f"""
+        INSERT INTO {COMPACT_TABLE}
+            (symbol_id, date, open, high, low, close, volume, open_interest)
+        SELECT s.id, {DATE_TO_INT_SQL.format('p.date')}, {prices}, p.volume, p.open_interest
+        FROM {SYMBOLS_TABLE} s CROSS JOIN prices p ON p.symbol = s.symbol
+        ORDER BY s.id, p.date
+        """
+    )
+    moved = conn.execute(f"SELECT COUNT(*) FROM {COMPACT_TABLE}").fetchone()[0]
+    if moved != rows:
+        conn.rollback()
+        raise SystemExit(f"Copied {moved} of {rows} prices rows, nothing changed.")
+    conn.execute(
+        f"CREATE INDEX idx_prices_compact_date ON {COMPACT_TABLE}(date, symbol_id)"
+    )
+    conn.execute(f"INSERT INTO {META_TABLE} (key, value) VALUES ('price_scale', ?)", (scale,))
+    conn.execute("DROP TABLE prices")
+    for statement in _statements(view_sql(scale)):
+        conn.execute(statement)
+    conn.commit()
+    print(f"[INFO] Moved {rows} row(s) to {COMPACT_TABLE} in {time.time() - t0:.1f}s.")
+    return rows
+
+
+def to_legacy(conn: sqlite3.Connection) -> int:
+    """Migrate the compact layout back to the legacy prices table; returns the rows moved."""
+    t0 = time.time()
+    layout = prices_layout(conn)
+    rows = conn.execute(f"SELECT COUNT(*) FROM {COMPACT_TABLE}").fetchone()[0]
+
+    conn.execute("BEGIN")
+    conn.execute("DROP VIEW prices")  # drops its triggers too
+    conn.execute(LEGACY_SCHEMA_SQL)
+    conn.execute(
+        f"""
+        INSERT INTO prices (symbol, date, open, high, low, close, volume, open_interest)
+        {legacy_select_sql(layout.scale)}
+        ORDER BY s.symbol, p.date
+        """
+    )
+    moved = conn.execute("SELECT COUNT(*) FROM prices").fetchone()[0]
+    if moved != rows:
+        conn.rollback()
+        raise SystemExit(f"Copied {moved} of {rows} prices rows, nothing changed.")
+    conn.execute("CREATE INDEX idx_prices_date_symbol ON prices(date, symbol)")
+    for table in (COMPACT_TABLE, SYMBOLS_TABLE, META_TABLE):
+        conn.execute(f"DROP TABLE {table}")
+    conn.commit()
+    print(f"[INFO] Moved {rows} row(s) back to the prices table in {time.time() - t0:.1f}s.")
+    return rows
+
+
+def copy_database(src_path: str, dst_path: str) -> None:
+    """Online backup of src_path into a new file dst_path."""
+    if os.path.exists(dst_path):
+        raise SystemExit(f"Output file already exists: {dst_path}")
+    src = sqlite3.connect(src_path)
+    try:
+        dst = sqlite3.connect(dst_path)
+        try:
+            src.backup(dst)
+        finally:
+            dst.close()
+    finally:
+        src.close()
+
+
+# ---------------------------------------------------------------------
+# Main entry point
+# ---------------------------------------------------------------------
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Migrate stocks.db prices between storage layouts.")
+    parser.add_argument(
+        "layout",
+        choices=("compact", "legacy"),
+        help="compact: symbol ids, integer dates, WITHOUT ROWID; legacy: the TEXT-keyed table",
+    )
+    parser.add_argument(
+        "--scaled",
+        action="store_true",
+        help=f"compact: store prices as fixed-point integers (x{PRICE_SCALE})",
+    )
+    parser.add_argument(
+        "--output",
+        help="Migrate a copy written to this path instead of the database itself",
+    )
+    parser.add_argument("--no-vacuum", action="store_true", help="Skip the VACUUM after migrating")
+    parser.add_argument("--db", default=STOCKS_DB, help=f"Database (default: {STOCKS_DB})")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if not os.path.exists(args.db):
+        raise SystemExit(f"Database file not found: {args.db}")
+
+    conn = sqlite3.connect(args.db)
+    try:
+        layout = prices_layout(conn)
+    finally:
+        conn.close()
+    if layout.compact == (args.layout == "compact"):
+        print(f"[INFO] prices already uses the {args.layout} layout.")
+        return
+
+    path: Optional[str] = args.output
+    if path:
+        copy_database(args.db, path)
+    else:
+        path = args.db
+        backup_database(args.db, os.path.join(os.path.dirname(args.db), "backups"))
+
+    size_before = os.path.getsize(path)
+    conn = sqlite3.connect(path)
+    try:
+        if args.layout == "compact":
+            to_compact(conn, PRICE_SCALE if args.scaled else 1)
+        else:
+            to_legacy(conn)
+        if not args.no_vacuum:
+            t0 = time.time()
+            conn.execute("VACUUM")
+            conn.execute("PRAGMA optimize")
+            print(
+                f"[INFO] VACUUM done in {time.time() - t0:.1f}s: "
+                f"{size_before / 1e6:,.1f} MB -> {os.path.getsize(path) / 1e6:,.1f} MB."
+            )
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
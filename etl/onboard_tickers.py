@@ -0,0 +1,507 @@
+#!/usr/bin/env python3
+# onboard_tickers.py
+# Backfill the price history of tickers that were added to stocks_lists.db
+# without (enough) rows in prices, then bring breadth.db and metrics.db up
+# to date for just those tickers:
+#
+#   1. find tracked tickers with fewer than MIN_HISTORY_SESSIONS rows that
+#      have not been onboarded yet
+#   2. fetch their daily history over the span of prices concurrently
+#      (one ticker-range request each) and bulk-insert the rows the ingest
+#      policy keeps (ingest_policy.py, as for every other writer of prices)
+#   3. breadth: counts are sums over symbols, so the groups the tickers
+#      belong to get the tickers' contribution added, minus whatever their
+#      old rows already contributed in the groups and date spans breadth
+#      counted them in (symbol_groups), and their McClellan series rebuilt;
+#      no other symbol is reprocessed
+#   4. metrics: the dates already in metrics.db on which the tickers now
+#      have prices are recomputed (percentile ranks are cross-sectional,
+#      so every row of those dates changes)
+
+import argparse
+import os
+import sqlite3
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from dotenv import load_dotenv
+
+from breadth_state import (
+    SymbolState,
+    create_state_table,
+    delete_group_spans,
+    load_group_spans,
+    save_group_spans,
+    save_states,
+)
+from breadth_stats import GroupStats, price_dates
+from build_breadth import INSERT_BREADTH_SQL, mcclellan_rows, process_symbols
+from build_metrics import INSERT_METRICS_SQL
+from bulk_writer import BulkWriter, connect_wal
+from db_publish import current_path
+from ingest_policy import IngestPolicy, add_policy_arguments, policy_from_args
+from metrics_engine import HISTORY_DEPTH, iter_metrics_by_date
+from polygon_fetch import (
+    DEFAULT_BASE_URL,
+    DEFAULT_CONCURRENCY,
+    DEFAULT_REQUESTS_PER_MINUTE,
+    FetchResult,
+    PolygonFetcher,
+)
+from price_reader import date_bounds
+from utils import (
+    STOCKS_LISTS_DB,
+    build_membership_matrix,
+    build_ticker_memberships,
+    ticker_group_ids,
+)
+
+STOCKS_DB = "../data/stocks.db"
+BREADTH_DB = "../data/breadth.db"
+METRICS_DB = "../data/metrics.db"
+
+# Tickers with fewer price rows than this are onboarded (the longest
+# metrics lookback)
+MIN_HISTORY_SESSIONS = HISTORY_DEPTH
+
+INSERT_PRICES_SQL = """
+    INSERT OR IGNORE INTO prices
+        (symbol, date, open, high, low, close, volume)
+    VALUES (?, ?, ?, ?, ?, ?, ?)
+"""
+
+BREADTH_COUNT_COLUMNS = """
+    total, adv, dec, new_high_52w, new_low_52w,
+    above_ma5, above_ma10, above_ma20, above_ma50, above_ma200,
+    spike_up, spike_down
+"""
+
+
+# ---------------------------------------------------------------------
+# 1) Detect
+# ---------------------------------------------------------------------
+def create_onboarding_table(conn: sqlite3.Connection) -> None:
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS onboarded_tickers (
+            symbol       TEXT PRIMARY KEY,
+            onboarded_at TEXT NOT NULL,
+            rows_before  INTEGER NOT NULL,  -- price rows before the backfill
+            rows_fetched INTEGER NOT NULL   -- rows stored (kept by the ingest policy)
+        )
+        """
+    )
+    conn.commit()
+
+
+def find_new_tickers(
+    conn: sqlite3.Connection,
+    lists_db: str = STOCKS_LISTS_DB,
+    min_sessions: int = MIN_HISTORY_SESSIONS,
+    force: Optional[List[str]] = None,
+) -> Dict[str, int]:
+    """
+    {ticker: current row count} for the tracked tickers with fewer than
+    min_sessions price rows that were not onboarded before, plus `force`.
+    Counts are primary-key range counts per ticker (stopping at
+    min_sessions), not a scan of prices.
+    """
+    conn.execute("ATTACH DATABASE ? AS lists", (lists_db,))
+    try:
+        rows = conn.execute(
+            """
+            SELECT t.ticker,
+                   (SELECT COUNT(*) FROM (
+                        SELECT 1 FROM prices p WHERE p.symbol = t.ticker LIMIT ?
+                   )) AS n
+            FROM (SELECT DISTINCT ticker FROM lists.stocks WHERE ticker IS NOT NULL) t
+            WHERE t.ticker NOT IN (SELECT symbol FROM onboarded_tickers)
+            """,
+            (min_sessions,),
+        ).fetchall()
+    finally:
+        conn.commit()
+        conn.execute("DETACH DATABASE lists")
+    found = {ticker: n for ticker, n in rows if n < min_sessions}
+    for ticker in force or []:
+        found[ticker] = conn.execute(
+            "SELECT COUNT(*) FROM prices WHERE symbol = ?", (ticker,)
+        ).fetchone()[0]
+    return found
+
+
+# ---------------------------------------------------------------------
+# 2) Fetch + insert
+# ---------------------------------------------------------------------
+def fetch_history(
+    conn: sqlite3.Connection,
+    fetcher: PolygonFetcher,
+    tickers: List[str],
+    start: str,
+    end: str,
+    policy: Optional[IngestPolicy] = None,
+) -> Dict[str, int]:
+    """
+    Fetch [start, end] for every ticker and insert the rows `policy` admits
+    (all without one); {ticker: rows stored}.
+    """
+    fetched: Dict[str, int] = {}
+    policy = policy or IngestPolicy()
+    with BulkWriter(conn) as writer:
+
+        def write(result: FetchResult) -> None:
+            if not result.ok:
+                print(f"[WARN] {result.symbol}: {result.error} after {result.attempts} attempt(s)")
+                return
+            rows, dropped = policy.filter_rows(result.rows)
+            if dropped:
+                print(f"[INFO] {result.symbol}: {dropped} row(s) outside the ingest policy")
+            fetched[result.symbol] = len(rows)
+            writer.insert(INSERT_PRICES_SQL, rows)
+
+        fetcher.fetch_ticker_ranges([(t, start, end) for t in tickers], write)
+    return fetched
+
+
+# ---------------------------------------------------------------------
+# 3) Breadth
+# ---------------------------------------------------------------------
+def _group_id_map(breadth_conn: sqlite3.Connection) -> Dict[Tuple[str, str], int]:
+    return {
+        (gtype, name): gid
+        for gid, gtype, name in breadth_conn.execute("SELECT id, type, name FROM groups")
+    }
+
+
+def _ticker_groups(breadth_conn: sqlite3.Connection, lists_db: str) -> Dict[str, List[int]]:
+    """Current groups of every tracked ticker."""
+    return ticker_group_ids(_group_id_map(breadth_conn), *build_ticker_memberships(lists_db))
+
+
+def breadth_contribution(
+    prices_conn: sqlite3.Connection,
+    tickers: List[str],
+    group_stats: GroupStats,
+    end_date: str,
+) -> Dict[str, SymbolState]:
+    """Add the tickers' breadth flags up to end_date to group_stats."""
+    states: Dict[str, SymbolState] = {}
+    if tickers:
+        process_symbols(
+            prices_conn, tickers, states, group_stats, show_progress=False, end_date=end_date
+        )
+    return states
+
+
+def old_contribution(
+    prices_conn: sqlite3.Connection,
+    breadth_conn: sqlite3.Connection,
+    tickers: List[str],
+    end_date: str,
+    lists_db: str = STOCKS_LISTS_DB,
+) -> GroupStats:
+    """
+    What the tickers' rows already contribute to breadth, up to end_date:
+    each ticker's flags in the groups and over the date spans it was
+    counted in (symbol_groups), which can differ from its current
+    memberships. A ticker without recorded spans (breadth.db built before
+    they were) is taken over its full history in its current groups.
+    """
+    group_ids = sorted(set(_group_id_map(breadth_conn).values()))
+    dates = [d for d in price_dates(prices_conn) if d <= end_date]
+    total = GroupStats(group_ids, dates, [], None)
+    spans = load_group_spans(breadth_conn, tickers)
+    current = _ticker_groups(breadth_conn, lists_db)
+    for ticker in tickers:
+        ticker_spans = [
+            span
+            for span in spans.get(ticker) or [(gid, None, end_date) for gid in current.get(ticker, [])]
+            if span[0] in total.group_index
+        ]
+        if not ticker_spans:
+            continue
+        # The ticker's flags in each of its groups, then only its span kept
+        membership = np.zeros((len(group_ids), 1), dtype=np.float32)
+        for gid, _, _ in ticker_spans:
+            membership[total.group_index[gid], 0] = 1.0
+        stats = GroupStats(group_ids, dates, [ticker], membership)
+        breadth_contribution(prices_conn, [ticker], stats, end_date)
+        for gid, after, last in ticker_spans:
+            row = total.group_index[gid]
+            window = total.dates <= last
+            if after is not None:
+                window &= total.dates > after
+            total.counts[row, window] += stats.counts[row, window]
+    return total
+
+
+def update_breadth_groups(
+    prices_conn: sqlite3.Connection,
+    tickers: List[str],
+    old_stats: Optional[GroupStats],
+    breadth_db: str = BREADTH_DB,
+    lists_db: str = STOCKS_LISTS_DB,
+) -> List[int]:
+    """
+    Add the tickers' full-history contribution to the breadth counts of
+    their groups, net of old_stats (what their rows before the backfill
+    had contributed, see old_contribution), and rebuild the McClellan
+    series of every group that changes. Returns the affected group ids.
+    """
+    breadth_conn = connect_wal(breadth_db)
+    try:
+        breadth_last = breadth_conn.execute("SELECT MAX(date) FROM breadth").fetchone()[0]
+        if breadth_last is None:
+            print("[INFO] breadth.db is empty, nothing to update (run build_breadth.py).")
+            return []
+
+        new_stats = new_group_stats(prices_conn, breadth_conn, tickers, breadth_last, lists_db)
+        states = breadth_contribution(prices_conn, list(new_stats.symbol_index), new_stats, breadth_last)
+        delta = new_stats.counts
+        if old_stats is not None:
+            delta = delta - old_stats.counts
+
+        affected = [
+            gid for gid in new_stats.group_ids if delta[new_stats.group_index[gid]].any()
+        ]
+
+        # Existing counts of the affected groups, on the same date index
+        for gid in affected:
+            row = new_stats.group_index[gid]
+            existing = breadth_conn.execute(
+                f"SELECT date, {BREADTH_COUNT_COLUMNS} FROM breadth WHERE group_id = ? ORDER BY date",
+                (gid,),
+            ).fetchall()
+            counts = np.zeros_like(delta[row])
+            if existing:
+                positions = new_stats.date_positions(np.asarray([r[0] for r in existing], dtype=str))
+                counts[positions] = np.asarray([r[1:] for r in existing], dtype=np.int32)
+            delta[row] += counts
+
+        with BulkWriter(breadth_conn) as writer:
+            for gid in affected:
+                row = new_stats.group_index[gid]
+                active = np.nonzero(delta[row, :, 0])[0]
+                breadth_conn.execute("DELETE FROM breadth WHERE group_id = ?", (gid,))
+                writer.insert(
+                    INSERT_BREADTH_SQL,
+                    mcclellan_rows(
+                        gid, new_stats.dates[active].tolist(), delta[row, active].tolist()
+                    ),
+                )
+                writer.commit()  # a group's rows are replaced in one transaction
+        # The tickers' rolling state as of breadth_last, so update_breadth
+        # carries on from there, and their full history now counted in
+        # their current groups
+        save_states(breadth_conn, [state.to_row(symbol) for symbol, state in states.items()])
+        current = _ticker_groups(breadth_conn, lists_db)
+        delete_group_spans(breadth_conn, tickers)
+        save_group_spans(
+            breadth_conn,
+            (
+                (symbol, gid, None, state.last_date)
+                for symbol, state in states.items()
+                for gid in current.get(symbol, [])
+            ),
+        )
+        return affected
+    finally:
+        breadth_conn.close()
+
+
+def new_group_stats(
+    prices_conn: sqlite3.Connection,
+    breadth_conn: sqlite3.Connection,
+    tickers: List[str],
+    end_date: str,
+    lists_db: str = STOCKS_LISTS_DB,
+) -> GroupStats:
+    """
+    Empty GroupStats over every breadth group, the tickers (those in a
+    group) and price dates <= end_date.
+    """
+    ticker_to_sector, ticker_to_lists = build_ticker_memberships(lists_db)
+    wanted = set(tickers)
+    group_ids, symbols, membership = build_membership_matrix(
+        _group_id_map(breadth_conn),
+        {t: s for t, s in ticker_to_sector.items() if t in wanted},
+        {t: l for t, l in ticker_to_lists.items() if t in wanted},
+    )
+    dates = [d for d in price_dates(prices_conn) if d <= end_date]
+    return GroupStats(group_ids, dates, symbols, membership)
+
+
+# ---------------------------------------------------------------------
+# 4) Metrics
+# ---------------------------------------------------------------------
+def update_metrics_dates(
+    prices_conn: sqlite3.Connection, tickers: List[str], metrics_db: str = METRICS_DB
+) -> int:
+    """Recompute the metrics dates on which the tickers now have prices."""
+    if not os.path.exists(metrics_db):
+        return 0
+    metrics_conn = connect_wal(metrics_db)
+    try:
+        has_table = metrics_conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'metrics'"
+        ).fetchone()
+        if not has_table:
+            return 0
+        metric_dates = {row[0] for row in metrics_conn.execute("SELECT DISTINCT date FROM metrics")}
+        placeholders = ", ".join("?" for _ in tickers)
+        ticker_dates = {
+            row[0]
+            for row in prices_conn.execute(
+                f"SELECT DISTINCT date FROM prices WHERE symbol IN ({placeholders})", tickers
+            )
+        }
+        affected = sorted(metric_dates & ticker_dates)
+        if not affected:
+            return 0
+
+        wanted = set(affected)
+        with BulkWriter(metrics_conn) as writer:
+            for date, rows in iter_metrics_by_date(prices_conn, affected[0], affected[-1]):
+                if date in wanted:
+                    writer.insert(INSERT_METRICS_SQL, rows)
+                    writer.commit()  # a date per transaction
+        return len(affected)
+    finally:
+        metrics_conn.close()
+
+
+# ---------------------------------------------------------------------
+# 5) Main entry point
+# ---------------------------------------------------------------------
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Fetch the history of newly tracked tickers and update breadth/metrics for them."
+    )
+    parser.add_argument(
+        "--min-sessions",
+        type=int,
+        default=MIN_HISTORY_SESSIONS,
+        help=f"Onboard tickers with fewer price rows than this (default: {MIN_HISTORY_SESSIONS})",
+    )
+    parser.add_argument(
+        "--force", nargs="+", metavar="TICKER", help="Onboard these tickers again"
+    )
+    parser.add_argument("--dry-run", action="store_true", help="Only list the tickers found")
+    parser.add_argument(
+        "--requests-per-minute",
+        type=float,
+        default=float(os.environ.get("POLYGON_REQUESTS_PER_MINUTE", DEFAULT_REQUESTS_PER_MINUTE)),
+    )
+    parser.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY)
+    parser.add_argument(
+        "--base-url", default=os.environ.get("POLYGON_BASE_URL", DEFAULT_BASE_URL)
+    )
+    add_policy_arguments(parser)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    if not os.path.exists(STOCKS_DB):
+        raise SystemExit(f"Database file not found: {STOCKS_DB}")
+
+    conn = sqlite3.connect(STOCKS_DB)
+    try:
+        create_onboarding_table(conn)
+        found = find_new_tickers(conn, STOCKS_LISTS_DB, args.min_sessions, args.force)
+        if not found:
+            print("[INFO] No tickers to onboard.")
+            return
+        tickers = sorted(found)
+        print(f"[INFO] {len(tickers)} ticker(s) to onboard: {', '.join(tickers)}")
+        if args.dry_run:
+            return
+
+        load_dotenv()
+        api_key = os.environ.get("POLYGON_API_KEY")
+        if not api_key:
+            raise SystemExit("POLYGON_API_KEY not set. Please create a .env file with POLYGON_API_KEY=your_key_here")
+
+        start, end = date_bounds(conn)
+        if start is None:
+            raise SystemExit("prices table is empty; run the regular update first.")
+
+        # breadth.db / metrics.db are updated in place, in their live
+        # versions (see db_publish.py)
+        breadth_db = current_path(BREADTH_DB)
+        metrics_db = current_path(METRICS_DB)
+
+        # What the tickers' existing rows already contribute to breadth
+        # (only those breadth has seen, i.e. with a saved rolling state)
+        old_stats = None
+        counted: List[str] = []
+        if os.path.exists(breadth_db):
+            breadth_conn = connect_wal(breadth_db)
+            try:
+                create_state_table(breadth_conn.cursor())  # symbol_groups of an older breadth.db
+                breadth_conn.commit()
+                counted = [
+                    row[0]
+                    for row in breadth_conn.execute("SELECT symbol FROM symbol_state")
+                    if row[0] in found
+                ]
+                breadth_last = breadth_conn.execute("SELECT MAX(date) FROM breadth").fetchone()[0]
+                if counted and breadth_last is not None:
+                    old_stats = old_contribution(conn, breadth_conn, counted, breadth_last)
+            finally:
+                breadth_conn.close()
+
+        # Fetch + insert
+        fetcher = PolygonFetcher(
+            api_key,
+            base_url=args.base_url,
+            requests_per_minute=args.requests_per_minute,
+            concurrency=args.concurrency,
+        )
+        print(f"[INFO] Fetching daily history {start}..{end} ...")
+        fetched = fetch_history(conn, fetcher, tickers, start, end, policy_from_args(args, conn))
+        now = datetime.now().isoformat(timespec="seconds")
+        conn.executemany(
+            "INSERT OR REPLACE INTO onboarded_tickers VALUES (?, ?, ?, ?)",
+            ((t, now, found[t], fetched[t]) for t in tickers if t in fetched),
+        )
+        conn.commit()
+        for t in tickers:
+            if t in fetched:
+                print(f"  {t}: {fetched[t]} rows stored ({found[t]} before)")
+        done = [t for t in tickers if fetched.get(t)]
+        if not done:
+            print("[INFO] No history stored, nothing to recompute.")
+            return
+
+        # Recompute what the new rows affect
+        if os.path.exists(breadth_db):
+            # The old contribution was computed on the date index as it
+            # was; re-align it with the one after the insert
+            if old_stats is not None:
+                old_stats = realign(old_stats, conn)
+            # Counted tickers whose refetch failed or came back empty keep
+            # their rows: recount them too, or their old contribution would
+            # only be subtracted
+            recount = done + [t for t in counted if t not in done]
+            groups = update_breadth_groups(conn, recount, old_stats, breadth_db)
+            print(f"[INFO] Breadth updated for {len(groups)} group(s).")
+        n_dates = update_metrics_dates(conn, done, metrics_db)
+        print(f"[INFO] Metrics recomputed for {n_dates} date(s).")
+    finally:
+        conn.close()
+
+
+def realign(group_stats: GroupStats, conn: sqlite3.Connection) -> GroupStats:
+    """Copy of group_stats on the current price date index (same end)."""
+    end = group_stats.dates[-1]
+    dates = [d for d in price_dates(conn) if d <= end]
+    out = GroupStats(group_stats.group_ids, dates, [], group_stats.membership)
+    out.counts[:, out.date_positions(group_stats.dates)] = group_stats.counts
+    return out
+
+
+if __name__ == "__main__":
+    main()
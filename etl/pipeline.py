@@ -0,0 +1,360 @@
+#!/usr/bin/env python3
+# pipeline.py
+# The nightly ETL as one command: fetch -> metrics / breadth, run as a small
+# dependency graph that skips the stages whose inputs have not changed.
+#
+#   python pipeline.py                    # run whatever is out of date
+#   python pipeline.py --dry-run          # show what would run
+#   python pipeline.py --force breadth    # run a stage even if its inputs are unchanged
+#   python pipeline.py --skip fetch --price-cache
+#
+# Every stage is one of the existing scripts, run as a subprocess from this
+# directory, so their ../data paths resolve wherever pipeline.py is started
+# from. A stage runs when the watermarks of its inputs differ from the ones
+# recorded after its last successful run (../data/pipeline.db):
+#
+#   stage    inputs                                  script
+#   fetch    last expected session, max price date   update_stocks_db.py
+#   metrics  max price date                          build_metrics.py --incremental
+#   breadth  max price date, stocks_lists.db hash    update_breadth.py, build_breadth.py
+#                                                    when the lists changed
+#
+# fetch is not run at all once the last expected session is in stocks.db.
+# metrics and breadth only read stocks.db and each write their own database,
+# so they run concurrently once fetch is done. Watermarks are re-read after
+# a stage, so fetch is recorded at the max price date it left behind: a
+# failed session is retried on the next run that has something new to fetch,
+# or with --force fetch.
+#
+# Reading the watermarks is an index seek and a hash of a small file, so a
+# run with nothing to do returns well within a second. Every stage's status
+# and duration go to the stage_runs table of pipeline.db.
+
+import argparse
+import hashlib
+import json
+import os
+import sqlite3
+import subprocess
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from dataclasses import dataclass
+from datetime import date, datetime
+from typing import Callable, Dict, List, Optional, Tuple
+
+from db_publish import current_path
+from price_reader import date_bounds
+from trading_calendar import get_calendar
+
+# Stage scripts run from here; their data paths are relative to it
+ETL_DIR = os.path.dirname(os.path.abspath(__file__))
+DATA_DIR = os.path.join(ETL_DIR, "..", "data")
+
+STOCKS_DB = os.path.join(DATA_DIR, "stocks.db")
+STOCKS_LISTS_DB = os.path.join(DATA_DIR, "stocks_lists.db")
+METRICS_DB = os.path.join(DATA_DIR, "metrics.db")
+BREADTH_DB = os.path.join(DATA_DIR, "breadth.db")
+PIPELINE_DB = os.path.join(DATA_DIR, "pipeline.db")
+
+# Stages run at the same time
+DEFAULT_JOBS = 2
+
+# stage_runs.status
+STATUS_OK = "ok"
+STATUS_SKIPPED = "skipped"
+STATUS_FAILED = "failed"
+STATUS_BLOCKED = "blocked"  # an upstream stage failed
+STATUS_PLANNED = "planned"  # --dry-run
+
+
+# ---------------------------------------------------------------------
+# 1) Watermarks
+# ---------------------------------------------------------------------
+def file_hash(path: str) -> Optional[str]:
+    """sha256 of a file's content, None if it does not exist."""
+    if not os.path.exists(path):
+        return None
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def max_price_date(db_path: str = STOCKS_DB) -> Optional[str]:
+    if not os.path.exists(db_path):
+        return None
+    conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+    try:
+        return date_bounds(conn)[1]
+    finally:
+        conn.close()
+
+
+def read_watermarks() -> Dict[str, Optional[str]]:
+    """Current value of every stage input."""
+    return {
+        "session": get_calendar().previous_session(date.today()),
+        "prices": max_price_date(),
+        "lists": file_hash(STOCKS_LISTS_DB),
+    }
+
+
+# ---------------------------------------------------------------------
+# 2) Stages
+# ---------------------------------------------------------------------
+@dataclass(frozen=True)
+class Stage:
+    name: str
+    deps: Tuple[str, ...]
+    inputs: Tuple[str, ...]  # watermark keys
+    # (watermarks, inputs recorded by the last run or None, args) -> argv after the interpreter
+    command: Callable[[Dict[str, Optional[str]], Optional[Dict[str, Optional[str]]], argparse.Namespace], List[str]]
+    # Outputs already current, whatever was recorded
+    current: Optional[Callable[[Dict[str, Optional[str]]], bool]] = None
+
+
+def _price_cache_args(args: argparse.Namespace) -> List[str]:
+    return ["--price-cache"] if args.price_cache else []
+
+
+def fetch_command(marks, recorded, args) -> List[str]:
+    return ["update_stocks_db.py", *args.fetch_arg]
+
+
+def metrics_command(marks, recorded, args) -> List[str]:
+    # No metrics.db yet: every date, not only the latest one
+    mode = "--backfill" if not os.path.exists(current_path(METRICS_DB)) else "--incremental"
+    return ["build_metrics.py", mode, *_price_cache_args(args)]
+
+
+def breadth_command(marks, recorded, args) -> List[str]:
+    # update_breadth only adds dates; other memberships change the history
+    lists_changed = recorded is not None and recorded.get("lists") != marks["lists"]
+    if lists_changed or not os.path.exists(current_path(BREADTH_DB)):
+        return ["build_breadth.py", *_price_cache_args(args)]
+    return ["update_breadth.py", *_price_cache_args(args)]
+
+
+def fetch_current(marks) -> bool:
+    return marks["prices"] is not None and marks["prices"] >= marks["session"]
+
+
+# In dependency order
+STAGES = [
+    Stage("fetch", (), ("session", "prices"), fetch_command, fetch_current),
+    Stage("metrics", ("fetch",), ("prices",), metrics_command),
+    Stage("breadth", ("fetch",), ("prices", "lists"), breadth_command),
+]
+STAGE_NAMES = [stage.name for stage in STAGES]
+
+
+# ---------------------------------------------------------------------
+# 3) pipeline.db: recorded watermarks and run history
+# ---------------------------------------------------------------------
+def open_pipeline_db(db_path: str = PIPELINE_DB) -> sqlite3.Connection:
+    conn = sqlite3.connect(db_path, check_same_thread=False)
+    conn.executescript(
+        """
+        CREATE TABLE IF NOT EXISTS stage_state (
+            stage       TEXT PRIMARY KEY,
+            inputs      TEXT NOT NULL,   -- JSON watermarks after the last successful run
+            finished_at TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS stage_runs (
+            run_started TEXT NOT NULL,
+            stage       TEXT NOT NULL,
+            status      TEXT NOT NULL,   -- ok / skipped / failed / blocked
+            seconds     REAL NOT NULL,
+            command     TEXT,
+            PRIMARY KEY (run_started, stage)
+        );
+        """
+    )
+    return conn
+
+
+def load_recorded(conn: sqlite3.Connection) -> Dict[str, Dict[str, Optional[str]]]:
+    return {stage: json.loads(inputs) for stage, inputs in conn.execute("SELECT stage, inputs FROM stage_state")}
+
+
+def record_state(conn: sqlite3.Connection, stage: str, inputs: Dict[str, Optional[str]]) -> None:
+    conn.execute(
+        "INSERT OR REPLACE INTO stage_state (stage, inputs, finished_at) VALUES (?, ?, ?)",
+        (stage, json.dumps(inputs, sort_keys=True), datetime.now().isoformat(timespec="seconds")),
+    )
+    conn.commit()
+
+
+def record_run(
+    conn: sqlite3.Connection,
+    run_started: str,
+    stage: str,
+    status: str,
+    seconds: float,
+    command: Optional[List[str]] = None,
+) -> None:
+    conn.execute(
+        "INSERT OR REPLACE INTO stage_runs (run_started, stage, status, seconds, command) VALUES (?, ?, ?, ?, ?)",
+        (run_started, stage, status, seconds, " ".join(command) if command else None),
+    )
+    conn.commit()
+
+
+# ---------------------------------------------------------------------
+# 4) Running
+# ---------------------------------------------------------------------
+def run_stage(name: str, argv: List[str]) -> Tuple[int, float]:
+    """Run a stage script from ETL_DIR, its output prefixed with the stage name."""
+    t0 = time.time()
+    env = dict(os.environ, PYTHONUNBUFFERED="1")
+    proc = subprocess.Popen(
+        [sys.executable, *argv],
+        cwd=ETL_DIR,
+        env=env,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+        text=True,
+    )
+    for line in proc.stdout:
+        print(f"[{name}] {line.rstrip()}", flush=True)
+    return proc.wait(), time.time() - t0
+
+
+def plan(
+    stage: Stage,
+    marks: Dict[str, Optional[str]],
+    recorded: Optional[Dict[str, Optional[str]]],
+    force: bool,
+) -> Optional[str]:
+    """Why the stage has to run, None if it can be skipped."""
+    if force:
+        return "forced"
+    if stage.current is not None and stage.current(marks):
+        return None
+    if recorded is None:
+        return "no previous run"
+    changed = [key for key in stage.inputs if recorded.get(key) != marks[key]]
+    if changed:
+        return "changed: " + ", ".join(changed)
+    return None
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Run the ETL stages (fetch -> metrics, breadth) whose inputs changed."
+    )
+    parser.add_argument(
+        "--force",
+        action="append",
+        choices=STAGE_NAMES,
+        default=[],
+        help="Run this stage even if its inputs are unchanged (repeatable)",
+    )
+    parser.add_argument(
+        "--skip",
+        action="append",
+        choices=STAGE_NAMES,
+        default=[],
+        help="Leave this stage out; its dependents run as if it were up to date (repeatable)",
+    )
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=DEFAULT_JOBS,
+        help=f"Stages run at the same time (default: {DEFAULT_JOBS})",
+    )
+    parser.add_argument(
+        "--price-cache",
+        action="store_true",
+        help="Pass --price-cache to the metrics and breadth stages (see price_cache.py)",
+    )
+    parser.add_argument(
+        "--fetch-arg",
+        action="append",
+        default=[],
+        help="Extra argument for update_stocks_db.py, e.g. --fetch-arg=--cache-only (repeatable)",
+    )
+    parser.add_argument("--dry-run", action="store_true", help="Only show which stages would run and why")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    t0 = time.time()
+    run_started = datetime.now().isoformat(timespec="seconds")
+
+    conn = open_pipeline_db()
+    try:
+        recorded = load_recorded(conn)
+        status: Dict[str, str] = {}
+        seconds: Dict[str, float] = {}
+        commands: Dict[str, List[str]] = {}
+        pending = list(STAGES)
+        running: Dict[Future, Stage] = {}
+
+        def finish(stage: Stage, stage_status: str, elapsed: float = 0.0) -> None:
+            status[stage.name] = stage_status
+            seconds[stage.name] = elapsed
+            if not args.dry_run:
+                record_run(conn, run_started, stage.name, stage_status, elapsed, commands.get(stage.name))
+
+        with ThreadPoolExecutor(max_workers=max(1, args.jobs)) as pool:
+            while pending or running:
+                # Start (or skip) every stage whose dependencies are settled
+                for stage in list(pending):
+                    deps = [status.get(dep) for dep in stage.deps]
+                    if None in deps:
+                        continue
+                    pending.remove(stage)
+                    if STATUS_FAILED in deps or STATUS_BLOCKED in deps:
+                        print(f"[WARN] {stage.name}: not run, an upstream stage failed.")
+                        finish(stage, STATUS_BLOCKED)
+                        continue
+                    if stage.name in args.skip:
+                        finish(stage, STATUS_SKIPPED)
+                        continue
+
+                    marks = read_watermarks()
+                    reason = plan(stage, marks, recorded.get(stage.name), stage.name in args.force)
+                    if STATUS_PLANNED in deps:
+                        reason = reason or f"after {', '.join(stage.deps)}"
+                    if reason is None:
+                        print(f"[INFO] {stage.name}: up to date, skipped.")
+                        finish(stage, STATUS_SKIPPED)
+                        continue
+
+                    commands[stage.name] = stage.command(marks, recorded.get(stage.name), args)
+                    print(f"[INFO] {stage.name}: {reason} -> {' '.join(commands[stage.name])}")
+                    if args.dry_run:
+                        finish(stage, STATUS_PLANNED)
+                    else:
+                        running[pool.submit(run_stage, stage.name, commands[stage.name])] = stage
+
+                if not running:
+                    continue
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    stage = running.pop(future)
+                    returncode, elapsed = future.result()
+                    if returncode != 0:
+                        print(f"[WARN] {stage.name}: exited with status {returncode}.")
+                        finish(stage, STATUS_FAILED, elapsed)
+                        continue
+                    # Inputs as the stage left them (fetch moves the max price date)
+                    marks = read_watermarks()
+                    record_state(conn, stage.name, {key: marks[key] for key in stage.inputs})
+                    finish(stage, STATUS_OK, elapsed)
+    finally:
+        conn.close()
+
+    print(f"[INFO] Pipeline done in {time.time() - t0:.1f}s:")
+    for name in STAGE_NAMES:
+        print(f"  {name:<8} {status[name]:<8} {seconds[name]:8.1f}s")
+    if STATUS_FAILED in status.values():
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
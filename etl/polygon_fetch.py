@@ -0,0 +1,372 @@
+# polygon_fetch.py
+# Concurrent fetcher for Polygon grouped daily aggregates: token-bucket rate
+# limit, bounded concurrency, 429-aware exponential backoff, and a single
+# writer that hands results over strictly in date order.
+import asyncio
+import json
+import random
+import time
+from datetime import datetime, timezone
+import urllib.error
+import urllib.parse
+import urllib.request
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, List, Optional, Sequence, Tuple
+
+from response_cache import CACHE_ONLY, CACHE_REFRESH, CACHE_USE, ResponseCache
+
+DEFAULT_BASE_URL = "https://api.polygon.io"
+GROUPED_DAILY_PATH = "/v2/aggs/grouped/locale/us/market/stocks/{date}"
+TICKER_RANGE_PATH = "/v2/aggs/ticker/{symbol}/range/1/day/{start}/{end}"
+
+# Daily bars per ticker-range response (Polygon caps at 50000)
+TICKER_RANGE_LIMIT = 50000
+
+# Free tier: 5 requests per minute
+DEFAULT_REQUESTS_PER_MINUTE = 5.0
+DEFAULT_CONCURRENCY = 4
+DEFAULT_MAX_RETRIES = 5
+
+# HTTP statuses worth retrying (rate limited / transient server errors)
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class TokenBucket:
+    """
+    Async token bucket: `rate` tokens per second, at most `capacity`
+    stored. acquire() waits until a token is available.
+    """
+
+    def __init__(self, rate: float, capacity: float = 1.0):
+        if rate <= 0:
+            raise ValueError("rate must be positive")
+        self.rate = rate
+        self.capacity = max(1.0, capacity)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self) -> None:
+        async with self._lock:
+            self._refill()
+            while self._tokens < 1.0:
+                await asyncio.sleep((1.0 - self._tokens) / self.rate)
+                self._refill()
+            self._tokens -= 1.0
+
+
+@dataclass
+class FetchResult:
+    """
+    Outcome of one request: rows ready for prices, or the last error.
+    `date` is the session of a grouped-daily request and the first day of
+    a ticker-range request (whose `symbol` is set).
+    """
+
+    date: str
+    symbol: Optional[str] = None
+    rows: List[tuple] = field(default_factory=list)
+    error: Optional[str] = None
+    attempts: int = 0
+    skipped: int = 0  # results without a full OHLCV record
+    cached: bool = False  # served from the response cache
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+
+class HTTPStatusError(Exception):
+    def __init__(self, status: int, retry_after: Optional[float] = None):
+        super().__init__(f"HTTP {status}")
+        self.status = status
+        self.retry_after = retry_after
+
+
+def _retry_after(headers) -> Optional[float]:
+    value = headers.get("Retry-After") if headers is not None else None
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        return None
+
+
+def parse_grouped_daily(date_str: str, payload: dict) -> FetchResult:
+    """Turn a grouped-daily JSON payload into prices rows."""
+    result = FetchResult(date=date_str)
+    for agg in payload.get("results") or []:
+        try:
+            result.rows.append(
+                (
+                    agg["T"],             # symbol
+                    date_str,             # date
+                    float(agg["o"]),      # open
+                    float(agg["h"]),      # high
+                    float(agg["l"]),      # low
+                    float(agg["c"]),      # close
+                    int(agg["v"]),        # volume
+                )
+            )
+        except (KeyError, TypeError, ValueError):
+            result.skipped += 1
+    return result
+
+
+def parse_ticker_range(symbol: str, start: str, payload: dict) -> FetchResult:
+    """Turn a per-ticker range (1 day bars) payload into prices rows."""
+    result = FetchResult(date=start, symbol=symbol)
+    for agg in payload.get("results") or []:
+        try:
+            # Daily bars start at midnight New York time, which is the same
+            # calendar day in UTC
+            day = datetime.fromtimestamp(agg["t"] / 1000, timezone.utc).strftime("%Y-%m-%d")
+            result.rows.append(
+                (
+                    symbol,
+                    day,
+                    float(agg["o"]),
+                    float(agg["h"]),
+                    float(agg["l"]),
+                    float(agg["c"]),
+                    int(agg["v"]),
+                )
+            )
+        except (KeyError, TypeError, ValueError):
+            result.skipped += 1
+    return result
+
+
+class PolygonFetcher:
+    """
+    Fetch grouped daily aggregates for many dates (or daily bars of single
+    tickers over date ranges) concurrently.
+
+    Requests are paced by a TokenBucket (requests_per_minute, burst) and at
+    most `concurrency` are in flight. 429 and 5xx responses and network
+    errors are retried with exponential backoff (honouring Retry-After),
+    up to max_retries times. HTTP is plain urllib run in worker threads, so
+    base_url can point at a local stub (see polygon_stub.py).
+
+    With a ResponseCache, grouped-daily bodies are kept on disk: in
+    cache_mode "use" hits are served without a request (nor a token) and
+    misses fetched and stored, "refresh" always fetches and stores, "only"
+    never makes a request and fails the misses. Responses without results
+    are not cached, so empty sessions keep being retried.
+    """
+
+    def __init__(
+        self,
+        api_key: str,
+        base_url: str = DEFAULT_BASE_URL,
+        requests_per_minute: float = DEFAULT_REQUESTS_PER_MINUTE,
+        burst: float = 1.0,
+        concurrency: int = DEFAULT_CONCURRENCY,
+        max_retries: int = DEFAULT_MAX_RETRIES,
+        backoff_base: float = 2.0,
+        backoff_max: float = 120.0,
+        timeout: float = 30.0,
+        adjusted: bool = True,
+        cache: Optional[ResponseCache] = None,
+        cache_mode: str = CACHE_USE,
+    ):
+        self.api_key = api_key
+        self.base_url = base_url.rstrip("/")
+        self.requests_per_minute = requests_per_minute
+        self.burst = burst
+        self.concurrency = max(1, concurrency)
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.timeout = timeout
+        self.adjusted = adjusted
+        self.cache = cache
+        self.cache_mode = cache_mode
+
+    # -----------------------------------------------------------------
+    # One request
+    # -----------------------------------------------------------------
+    def _query(self, **extra) -> str:
+        params = {"adjusted": "true" if self.adjusted else "false"}
+        params.update(extra)
+        params["apiKey"] = self.api_key
+        return urllib.parse.urlencode(params)
+
+    def url_for(self, date_str: str) -> str:
+        return f"{self.base_url}{GROUPED_DAILY_PATH.format(date=date_str)}?{self._query()}"
+
+    def ticker_url_for(self, symbol: str, start: str, end: str) -> str:
+        path = TICKER_RANGE_PATH.format(
+            symbol=urllib.parse.quote(symbol, safe=""), start=start, end=end
+        )
+        return f"{self.base_url}{path}?{self._query(sort='asc', limit=TICKER_RANGE_LIMIT)}"
+
+    def _get(self, url: str) -> bytes:
+        """Blocking GET of the raw body; runs in a worker thread."""
+        try:
+            with urllib.request.urlopen(url, timeout=self.timeout) as resp:
+                return resp.read()
+        except urllib.error.HTTPError as e:
+            raise HTTPStatusError(e.code, _retry_after(e.headers)) from None
+
+    def _backoff(self, attempt: int, retry_after: Optional[float]) -> float:
+        if retry_after is not None:
+            return min(self.backoff_max, retry_after)
+        delay = min(self.backoff_max, self.backoff_base * (2 ** (attempt - 1)))
+        return delay * random.uniform(0.5, 1.0)
+
+    async def _fetch(
+        self,
+        url: str,
+        parse: Callable[[dict], FetchResult],
+        failed: Callable[[], FetchResult],
+        bucket: TokenBucket,
+        store: Optional[Callable[[bytes], None]] = None,
+    ) -> FetchResult:
+        attempt = 0
+        while True:
+            attempt += 1
+            await bucket.acquire()
+            try:
+                raw = await asyncio.to_thread(self._get, url)
+                result = parse(json.loads(raw.decode("utf-8")))
+                result.attempts = attempt
+                if store is not None and result.rows:
+                    await asyncio.to_thread(store, raw)
+                return result
+            except HTTPStatusError as e:
+                error, retry_after = str(e), e.retry_after
+                retryable = e.status in RETRY_STATUSES
+            except (urllib.error.URLError, OSError, ValueError) as e:
+                error, retry_after, retryable = f"{type(e).__name__}: {e}", None, True
+
+            result = failed()
+            if not retryable or attempt > self.max_retries:
+                result.error, result.attempts = error, attempt
+                return result
+            delay = self._backoff(attempt, retry_after)
+            label = f"{result.symbol} {result.date}" if result.symbol else result.date
+            print(f"[WARN] {label}: {error}, retrying in {delay:.1f}s (attempt {attempt})")
+            await asyncio.sleep(delay)
+
+    async def fetch_day(self, date_str: str, bucket: TokenBucket) -> FetchResult:
+        store = None
+        if self.cache is not None:
+            if self.cache_mode in (CACHE_USE, CACHE_ONLY):
+                raw = await asyncio.to_thread(self.cache.get, date_str, self.adjusted)
+                if raw is not None:
+                    try:
+                        result = parse_grouped_daily(date_str, json.loads(raw.decode("utf-8")))
+                        result.cached = True
+                        return result
+                    except (ValueError, AttributeError) as e:
+                        # A corrupt entry counts as a miss (and is replaced when refetched)
+                        print(f"[WARN] {date_str}: unreadable cached response ({type(e).__name__}: {e})")
+                if self.cache_mode == CACHE_ONLY:
+                    return FetchResult(date=date_str, error="not in the response cache")
+            if self.cache_mode in (CACHE_USE, CACHE_REFRESH):
+                store = lambda raw: self.cache.put(date_str, self.adjusted, raw)
+        return await self._fetch(
+            self.url_for(date_str),
+            lambda payload: parse_grouped_daily(date_str, payload),
+            lambda: FetchResult(date=date_str),
+            bucket,
+            store,
+        )
+
+    async def fetch_ticker_range(
+        self, symbol: str, start: str, end: str, bucket: TokenBucket
+    ) -> FetchResult:
+        return await self._fetch(
+            self.ticker_url_for(symbol, start, end),
+            lambda payload: parse_ticker_range(symbol, start, payload),
+            lambda: FetchResult(date=start, symbol=symbol),
+            bucket,
+        )
+
+    # -----------------------------------------------------------------
+    # Many dates
+    # -----------------------------------------------------------------
+    async def _run(
+        self,
+        count: int,
+        fetch_one: Callable[[int, TokenBucket], Awaitable[FetchResult]],
+        failed: Callable[[int], FetchResult],
+        on_result: Callable[[FetchResult], None],
+    ) -> None:
+        bucket = TokenBucket(self.requests_per_minute / 60.0, self.burst)
+        semaphore = asyncio.Semaphore(self.concurrency)
+        done: asyncio.Queue = asyncio.Queue()
+
+        async def fetch(index: int) -> None:
+            # Every index queues a result, or the writer would wait for it forever
+            try:
+                async with semaphore:
+                    result = await fetch_one(index, bucket)
+            except Exception as e:
+                result = failed(index)
+                result.error = f"{type(e).__name__}: {e}"
+            await done.put((index, result))
+
+        async def writer() -> None:
+            ready = {}
+            next_index = 0
+            while next_index < count:
+                index, result = await done.get()
+                ready[index] = result
+                while next_index in ready:
+                    on_result(ready.pop(next_index))
+                    next_index += 1
+
+        fetchers = [asyncio.create_task(fetch(i)) for i in range(count)]
+        try:
+            await writer()
+        finally:
+            for task in fetchers:
+                task.cancel()
+            await asyncio.gather(*fetchers, return_exceptions=True)
+
+    async def run(
+        self, dates: Sequence[str], on_result: Callable[[FetchResult], None]
+    ) -> None:
+        """
+        Fetch every date and call on_result(result) once per date, in the
+        order of `dates`, from a single writer task.
+        """
+        await self._run(
+            len(dates),
+            lambda i, bucket: self.fetch_day(dates[i], bucket),
+            lambda i: FetchResult(date=dates[i]),
+            on_result,
+        )
+
+    async def run_ticker_ranges(
+        self,
+        ranges: Sequence[Tuple[str, str, str]],
+        on_result: Callable[[FetchResult], None],
+    ) -> None:
+        """Like run(), for (symbol, start, end) per-ticker requests."""
+        await self._run(
+            len(ranges),
+            lambda i, bucket: self.fetch_ticker_range(*ranges[i], bucket),
+            lambda i: FetchResult(date=ranges[i][1], symbol=ranges[i][0]),
+            on_result,
+        )
+
+    def fetch_all(
+        self, dates: Sequence[str], on_result: Callable[[FetchResult], None]
+    ) -> None:
+        """Synchronous entry point for run()."""
+        asyncio.run(self.run(dates, on_result))
+
+    def fetch_ticker_ranges(
+        self,
+        ranges: Sequence[Tuple[str, str, str]],
+        on_result: Callable[[FetchResult], None],
+    ) -> None:
+        """Synchronous entry point for run_ticker_ranges()."""
+        asyncio.run(self.run_ticker_ranges(ranges, on_result))
@@ -0,0 +1,209 @@
+# polygon_stub.py
+# Local stand-in for the Polygon grouped daily and ticker range aggregates
+# endpoints, for exercising polygon_fetch / update_stocks_db without network
+# access:
+#
+#   python polygon_stub.py --db ../data/stocks.db --port 8765 --rate-limit-every 3
+#   POLYGON_BASE_URL=http://127.0.0.1:8765 POLYGON_API_KEY=test python update_stocks_db.py
+#
+# Responses are served from a prices table (--db) or, without one, made up
+# deterministically per symbol and date. Every Nth request can be answered with a 429
+# and chosen dates with a 500.
+import argparse
+import hashlib
+import json
+import re
+import sqlite3
+import threading
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import unquote
+from typing import Dict, List, Optional, Set
+
+PATH_RE = re.compile(r"^/v2/aggs/grouped/locale/us/market/stocks/(\d{4}-\d{2}-\d{2})$")
+TICKER_PATH_RE = re.compile(
+    r"^/v2/aggs/ticker/([^/]+)/range/1/day/(\d{4}-\d{2}-\d{2})/(\d{4}-\d{2}-\d{2})$"
+)
+
+
+def _epoch_ms(date_str: str) -> int:
+    """Start of the daily bar: midnight New York time (04:00 UTC in summer)."""
+    day = datetime.strptime(date_str, "%Y-%m-%d").replace(tzinfo=timezone.utc)
+    return int(day.timestamp() * 1000) + 4 * 3600 * 1000
+
+
+class StubData:
+    """Grouped-daily results per date, from a prices DB or synthesized."""
+
+    def __init__(self, db_path: Optional[str] = None, symbols: int = 50):
+        self.db_path = db_path
+        self.symbols = [f"STUB{i:03d}" for i in range(symbols)]
+
+    def _synthetic(self, symbol: str, date_str: str):
+        seed = int(hashlib.md5(f"{symbol}{date_str}".encode()).hexdigest()[:8], 16)
+        close = 10 + seed % 9000 / 100
+        return (symbol, date_str, close * 0.99, close * 1.02, close * 0.98, close, seed % 100000)
+
+    def _query(self, sql: str, params: tuple) -> List[tuple]:
+        conn = sqlite3.connect(self.db_path)
+        try:
+            return conn.execute(sql, params).fetchall()
+        finally:
+            conn.close()
+
+    def results(self, date_str: str) -> List[Dict]:
+        """Grouped daily: every symbol on one date."""
+        if self.db_path:
+            rows = self._query(
+                "SELECT symbol, date, open, high, low, close, volume FROM prices WHERE date = ?",
+                (date_str,),
+            )
+        elif datetime.strptime(date_str, "%Y-%m-%d").weekday() < 5:
+            rows = [self._synthetic(symbol, date_str) for symbol in self.symbols]
+        else:
+            rows = []
+        return self._format(rows)
+
+    def ticker_results(self, symbol: str, start: str, end: str) -> List[Dict]:
+        """Ticker range: one symbol's daily bars in [start, end]."""
+        if self.db_path:
+            rows = self._query(
+                "SELECT symbol, date, open, high, low, close, volume FROM prices "
+                "WHERE symbol = ? AND date BETWEEN ? AND ? ORDER BY date",
+                (symbol, start, end),
+            )
+        else:
+            rows = []
+            day = datetime.strptime(start, "%Y-%m-%d")
+            while day <= datetime.strptime(end, "%Y-%m-%d"):
+                if symbol in self.symbols and day.weekday() < 5:
+                    rows.append(self._synthetic(symbol, day.strftime("%Y-%m-%d")))
+                day += timedelta(days=1)
+        return self._format(rows)
+
+    @staticmethod
+    def _format(rows: List[tuple]) -> List[Dict]:
+        return [
+            {"T": s, "o": o, "h": h, "l": l, "c": c, "v": v, "t": _epoch_ms(d)}
+            for s, d, o, h, l, c, v in rows
+        ]
+
+
+def make_handler(
+    data: StubData, rate_limit_every: int, retry_after: float, fail_dates: Set[str] = frozenset()
+):
+    counter = {"n": 0}
+    lock = threading.Lock()
+
+    class Handler(BaseHTTPRequestHandler):
+        def _send(self, status: int, body: Dict, headers: Optional[Dict] = None) -> None:
+            payload = json.dumps(body).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def do_GET(self):
+            path, _, _query = self.path.partition("?")
+            match = PATH_RE.match(path)
+            ticker_match = TICKER_PATH_RE.match(path)
+            if not match and not ticker_match:
+                self._send(404, {"status": "NOT_FOUND"})
+                return
+
+            with lock:
+                counter["n"] += 1
+                n = counter["n"]
+            if rate_limit_every and n % rate_limit_every == 0:
+                self._send(
+                    429,
+                    {"status": "ERROR", "error": "You've exceeded the maximum requests per minute"},
+                    {"Retry-After": str(retry_after)},
+                )
+                return
+
+            if ticker_match:
+                symbol, start, end = ticker_match.groups()
+                results = data.ticker_results(unquote(symbol), start, end)
+                self._send(
+                    200,
+                    {
+                        "ticker": unquote(symbol),
+                        "adjusted": True,
+                        "queryCount": len(results),
+                        "resultsCount": len(results),
+                        "status": "OK",
+                        "results": results,
+                    },
+                )
+                return
+
+            if match.group(1) in fail_dates:
+                self._send(500, {"status": "ERROR", "error": "Internal server error"})
+                return
+
+            results = data.results(match.group(1))
+            self._send(
+                200,
+                {
+                    "adjusted": True,
+                    "queryCount": len(results),
+                    "resultsCount": len(results),
+                    "status": "OK",
+                    "results": results,
+                },
+            )
+
+        def log_message(self, fmt, *args):
+            print(f"[STUB] {self.address_string()} {fmt % args}")
+
+    return Handler
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Local Polygon grouped-daily stub server.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--db", help="Serve rows from this stocks.db prices table")
+    parser.add_argument("--symbols", type=int, default=50, help="Synthetic symbols without --db")
+    parser.add_argument(
+        "--rate-limit-every",
+        type=int,
+        default=0,
+        help="Answer every Nth request with HTTP 429 (0 = never)",
+    )
+    parser.add_argument("--retry-after", type=float, default=1.0, help="Retry-After seconds on 429")
+    parser.add_argument(
+        "--fail-dates",
+        default="",
+        help="Comma-separated dates always answered with HTTP 500",
+    )
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    data = StubData(args.db, args.symbols)
+    server = ThreadingHTTPServer(
+        (args.host, args.port),
+        make_handler(
+            data,
+            args.rate_limit_every,
+            args.retry_after,
+            {d for d in args.fail_dates.split(",") if d},
+        ),
+    )
+    print(f"[INFO] Polygon stub listening on http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
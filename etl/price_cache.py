@@ -0,0 +1,394 @@
+# price_cache.py
+# Columnar copy of stocks.db prices that the ETL stages memory-map instead
+# of converting SQLite rows every run:
+#
+#   ../data/price_cache/manifest.json
+#   ../data/price_cache/seg_000001/symbols.npy   tickers of the segment, sorted
+#                                  offsets.npy   row range of each ticker (n + 1)
+#                                  dates.npy     distinct dates of the segment
+#                                  date.npy      int32 YYYYMMDD
+#                                  open.npy, high.npy, low.npy, close.npy, volume.npy
+#                                                float64, as price_reader returns them
+#
+# A segment stores its rows ticker by ticker, dates ascending, so a ticker's
+# history is one slice of every column file. Files are opened with
+# np.load(mmap_mode="r"): slicing copies nothing, and concurrent jobs share
+# the pages through the OS page cache.
+#
+# refresh_price_cache() builds the cache with one scan of prices, then
+# appends a segment with the sessions after the cache's last date on later
+# runs. Once there are more than MAX_SEGMENTS segments, they are merged into
+# one. If the row count up to the cache's last date has changed (backfills,
+# onboarded tickers, compaction), the cache is rebuilt. Rows rewritten in place
+# are not detected; pass rebuild=True after such changes. Segments are written
+# under a temp name and renamed, and the manifest is replaced atomically, so
+# readers never see a partial cache.
+import argparse
+import json
+import os
+import shutil
+import sqlite3
+import tempfile
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from price_reader import (
+    PRICE_COLUMNS,
+    date_bounds,
+    date_to_int,
+    int_to_date,
+    iter_symbol_prices,
+    next_date,
+    row_count,
+)
+
+try:
+    import fcntl
+    FCNTL_AVAILABLE = True
+except ImportError:  # Windows: refreshes are not serialized
+    FCNTL_AVAILABLE = False
+
+PRICE_CACHE_DIR = "../data/price_cache"
+MANIFEST_NAME = "manifest.json"
+CACHE_VERSION = 1
+
+# Segments kept before they are merged into one
+MAX_SEGMENTS = 8
+
+VALUE_COLUMNS = tuple(col for col in PRICE_COLUMNS if col != "date")
+
+
+class _Segment:
+    """One segment directory, memory-mapped."""
+
+    def __init__(self, path: str):
+        self.symbols: List[str] = np.load(os.path.join(path, "symbols.npy")).tolist()
+        self.index = {symbol: i for i, symbol in enumerate(self.symbols)}
+        self.offsets = np.load(os.path.join(path, "offsets.npy"))
+        self.dates = np.load(os.path.join(path, "dates.npy"))
+        self.columns = {
+            col: np.load(os.path.join(path, f"{col}.npy"), mmap_mode="r") for col in PRICE_COLUMNS
+        }
+
+    def bounds(self, symbol: str) -> Tuple[int, int]:
+        """Row range of a ticker ((0, 0) if the segment has none of its rows)."""
+        i = self.index.get(symbol)
+        if i is None:
+            return 0, 0
+        return int(self.offsets[i]), int(self.offsets[i + 1])
+
+
+class PriceCache:
+    """
+    Read side of the cache, with the same scans as price_reader:
+    iter_symbol_prices() and closes_before() return what the SQLite
+    versions return for the rows the cache holds.
+    """
+
+    def __init__(self, root: str = PRICE_CACHE_DIR):
+        manifest = load_manifest(root)
+        if manifest is None:
+            raise FileNotFoundError(f"No price cache in {root} (see refresh_price_cache)")
+        self.root = root
+        self.last_date: Optional[str] = manifest["last_date"]
+        self.rows: int = manifest["rows"]
+        self.segments = [_Segment(os.path.join(root, seg["name"])) for seg in manifest["segments"]]
+        self.symbols = sorted({s for seg in self.segments for s in seg.symbols})
+
+        # Date codes -> 'YYYY-MM-DD', one vectorized lookup per slice
+        codes = np.unique(np.concatenate([seg.dates for seg in self.segments] or [np.empty(0, np.int32)]))
+        self._date_codes = codes
+        self._date_text = np.asarray([int_to_date(int(d)) for d in codes], dtype=str)
+
+    def _date_strings(self, codes: np.ndarray) -> np.ndarray:
+        return self._date_text[np.searchsorted(self._date_codes, codes)]
+
+    def _slices(
+        self, symbol: str, lo_date: Optional[int], hi_date: Optional[int]
+    ) -> List[Tuple["_Segment", int, int]]:
+        """(segment, start, stop) of the ticker's rows with lo_date <= date <= hi_date."""
+        out = []
+        for seg in self.segments:
+            start, stop = seg.bounds(symbol)
+            if start == stop:
+                continue
+            dates = seg.columns["date"][start:stop]
+            if lo_date is not None:
+                start += int(np.searchsorted(dates, lo_date, side="left"))
+            if hi_date is not None:
+                stop = int(seg.offsets[seg.index[symbol]]) + int(np.searchsorted(dates, hi_date, side="right"))
+            if stop > start:
+                out.append((seg, start, stop))
+        return out
+
+    def _iter_rows(
+        self,
+        columns: Sequence[str],
+        start_date: Optional[str] = None,
+        end_date: Optional[str] = None,
+        symbols: Optional[Iterable[str]] = None,
+        after: Optional[Dict[str, str]] = None,
+    ) -> Iterator[Tuple[str, Dict[str, np.ndarray]]]:
+        """iter_symbol_prices with "date" as int32 YYYYMMDD codes."""
+        for col in columns:
+            if col not in PRICE_COLUMNS:
+                raise ValueError(f"Unknown prices column: {col}")
+        lo = date_to_int(start_date) if start_date is not None else None
+        hi = date_to_int(end_date) if end_date is not None else None
+
+        names = self.symbols
+        if symbols is not None:
+            wanted = set(symbols)
+            names = [s for s in names if s in wanted]
+        if after is not None:
+            names = [s for s in names if s in after]
+
+        for symbol in names:
+            first = lo
+            if after is not None:
+                # strictly after the last processed date
+                resume = date_to_int(after[symbol]) + 1
+                first = resume if first is None else max(first, resume)
+            parts = self._slices(symbol, first, hi)
+            if not parts:
+                continue
+            out: Dict[str, np.ndarray] = {}
+            for col in columns:
+                pieces = [np.asarray(seg.columns[col][start:stop]) for seg, start, stop in parts]
+                out[col] = pieces[0] if len(pieces) == 1 else np.concatenate(pieces)
+            yield symbol, out
+
+    def iter_symbol_prices(
+        self,
+        columns: Sequence[str] = PRICE_COLUMNS,
+        start_date: Optional[str] = None,
+        end_date: Optional[str] = None,
+        symbols: Optional[Iterable[str]] = None,
+        after: Optional[Dict[str, str]] = None,
+    ) -> Iterator[Tuple[str, Dict[str, np.ndarray]]]:
+        """
+        Same as price_reader.iter_symbol_prices. Arrays are read-only views of
+        the mapped files ("date" is decoded to a str array).
+        """
+        for symbol, out in self._iter_rows(columns, start_date, end_date, symbols, after):
+            if "date" in out:
+                out["date"] = self._date_strings(out["date"])
+            yield symbol, out
+
+    def closes_before(self, symbol: str, before_date: str, limit: int) -> np.ndarray:
+        """Last `limit` closes of a symbol strictly before before_date, oldest first."""
+        parts = self._slices(symbol, None, date_to_int(before_date) - 1)
+        closes = [np.asarray(seg.columns["close"][start:stop]) for seg, start, stop in parts]
+        if not closes:
+            return np.empty(0)
+        return np.concatenate(closes)[-limit:] if limit > 0 else np.empty(0)
+
+
+# ---------------------------------------------------------------------
+# Manifest
+# ---------------------------------------------------------------------
+def load_manifest(root: str = PRICE_CACHE_DIR) -> Optional[Dict]:
+    """{version, last_date, rows, next_segment, segments: [{name, first_date, last_date, rows}]}"""
+    try:
+        with open(os.path.join(root, MANIFEST_NAME), "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return manifest if manifest.get("version") == CACHE_VERSION else None
+
+
+def save_manifest(manifest: Dict, root: str = PRICE_CACHE_DIR) -> None:
+    fd, tmp = tempfile.mkstemp(dir=root, suffix=".tmp")
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp, os.path.join(root, MANIFEST_NAME))
+
+
+# ---------------------------------------------------------------------
+# Build / refresh
+# ---------------------------------------------------------------------
+def _write_segment(
+    root: str,
+    name: str,
+    stream: Iterator[Tuple[str, Dict[str, np.ndarray]]],
+    total_rows: int,
+    int_dates: bool = False,
+) -> Dict:
+    """
+    Write a segment of exactly total_rows rows from a (symbol, columns)
+    stream in symbol order, under a temp name renamed to `name` at the end.
+    """
+    work = tempfile.mkdtemp(dir=root, prefix=f"{name}.")
+    try:
+        arrays = {
+            col: np.lib.format.open_memmap(
+                os.path.join(work, f"{col}.npy"),
+                mode="w+",
+                dtype=np.int32 if col == "date" else np.float64,
+                shape=(total_rows,),
+            )
+            for col in PRICE_COLUMNS
+        }
+        symbols: List[str] = []
+        offsets = [0]
+        codes: Dict[str, int] = {}
+        pos = 0
+        for symbol, cols in stream:
+            n = len(cols["date"])
+            if pos + n > total_rows:
+                raise RuntimeError("prices changed while the price cache was written")
+            if int_dates:
+                arrays["date"][pos : pos + n] = cols["date"]
+            else:
+                arrays["date"][pos : pos + n] = [
+                    codes.get(d) or codes.setdefault(d, date_to_int(d)) for d in cols["date"].tolist()
+                ]
+            for col in VALUE_COLUMNS:
+                arrays[col][pos : pos + n] = cols[col]
+            pos += n
+            symbols.append(symbol)
+            offsets.append(pos)
+        if pos != total_rows:
+            raise RuntimeError("prices changed while the price cache was written")
+
+        dates = np.unique(arrays["date"]) if total_rows else np.empty(0, dtype=np.int32)
+        for arr in arrays.values():
+            arr.flush()
+        del arrays
+        np.save(os.path.join(work, "symbols.npy"), np.asarray(symbols, dtype=str))
+        np.save(os.path.join(work, "offsets.npy"), np.asarray(offsets, dtype=np.int64))
+        np.save(os.path.join(work, "dates.npy"), dates.astype(np.int32))
+        os.rename(work, os.path.join(root, name))
+    except BaseException:
+        shutil.rmtree(work, ignore_errors=True)
+        raise
+    return {
+        "name": name,
+        "first_date": int_to_date(int(dates[0])),
+        "last_date": int_to_date(int(dates[-1])),
+        "rows": total_rows,
+    }
+
+
+def _segment_name(manifest: Dict) -> str:
+    n = manifest["next_segment"]
+    manifest["next_segment"] = n + 1
+    return f"seg_{n:06d}"
+
+
+def _build(conn: sqlite3.Connection, root: str, next_segment: int) -> Dict:
+    """Manifest of a new cache holding every price row in one segment."""
+    manifest = {"version": CACHE_VERSION, "last_date": None, "rows": 0, "next_segment": next_segment, "segments": []}
+    total = row_count(conn)
+    if total:
+        segment = _write_segment(
+            root, _segment_name(manifest), iter_symbol_prices(conn, PRICE_COLUMNS), total
+        )
+        manifest["segments"].append(segment)
+        manifest["last_date"] = segment["last_date"]
+        manifest["rows"] = total
+    return manifest
+
+
+def _merge(cache: PriceCache, manifest: Dict) -> Dict:
+    """Manifest with all segments merged into one (read from the cache itself)."""
+    segment = _write_segment(
+        cache.root,
+        _segment_name(manifest),
+        cache._iter_rows(PRICE_COLUMNS),
+        manifest["rows"],
+        int_dates=True,
+    )
+    return dict(manifest, segments=[segment])
+
+
+def refresh_price_cache(
+    conn: sqlite3.Connection, root: str = PRICE_CACHE_DIR, rebuild: bool = False
+) -> PriceCache:
+    """
+    Bring the cache in `root` up to date with prices and open it: append the
+    sessions after its last date, or rebuild it (first run, `rebuild`, or
+    rows changed up to its last date).
+    """
+    os.makedirs(root, exist_ok=True)
+    with open(os.path.join(root, "lock"), "w") as lock:
+        # One refresh at a time; readers do not lock
+        if FCNTL_AVAILABLE:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+
+        old = load_manifest(root)
+        manifest = old
+        # One read transaction: counts and scans see the same rows
+        conn.execute("BEGIN")
+        try:
+            if manifest is not None and not rebuild and manifest["last_date"] is not None:
+                if row_count(conn, manifest["last_date"]) != manifest["rows"]:
+                    print(
+                        f"[INFO] prices changed up to {manifest['last_date']} since the price "
+                        "cache was built, rebuilding it."
+                    )
+                    manifest = None
+            if manifest is None or rebuild or manifest["last_date"] is None:
+                print("[INFO] Building the price cache...")
+                manifest = _build(conn, root, old["next_segment"] if old else 1)
+            else:
+                first_new = next_date(conn, manifest["last_date"])
+                if first_new is not None:
+                    _, last = date_bounds(conn)
+                    added = row_count(conn) - manifest["rows"]
+                    segment = _write_segment(
+                        root,
+                        _segment_name(manifest),
+                        iter_symbol_prices(conn, PRICE_COLUMNS, start_date=first_new),
+                        added,
+                    )
+                    manifest = dict(
+                        manifest,
+                        last_date=last,
+                        rows=manifest["rows"] + added,
+                        segments=manifest["segments"] + [segment],
+                    )
+                    print(f"[INFO] Price cache: added {added} row(s) ({first_new} .. {last}).")
+        finally:
+            conn.commit()
+
+        if len(manifest["segments"]) > MAX_SEGMENTS:
+            save_manifest(manifest, root)
+            manifest = _merge(PriceCache(root), manifest)
+            print(f"[INFO] Price cache: merged the segments ({manifest['rows']} rows).")
+        save_manifest(manifest, root)
+
+        # Segments no longer in the manifest; readers that mapped them keep
+        # their pages until they close
+        live = {seg["name"] for seg in manifest["segments"]}
+        for name in os.listdir(root):
+            if name.startswith("seg_") and name not in live:
+                shutil.rmtree(os.path.join(root, name), ignore_errors=True)
+    return PriceCache(root)
+
+
+# ---------------------------------------------------------------------
+# Command line
+# ---------------------------------------------------------------------
+def add_price_cache_arguments(parser: argparse.ArgumentParser, default_dir: str = PRICE_CACHE_DIR) -> None:
+    """--price-cache / --price-cache-dir / --rebuild-price-cache"""
+    parser.add_argument(
+        "--price-cache",
+        action="store_true",
+        help="Read prices from the memory-mapped price cache, refreshed first (see price_cache.py)",
+    )
+    parser.add_argument("--price-cache-dir", default=default_dir, help=f"(default: {default_dir})")
+    parser.add_argument(
+        "--rebuild-price-cache",
+        action="store_true",
+        help="Rebuild the price cache from scratch (e.g. after prices were corrected in place)",
+    )
+
+
+def price_cache_from_args(args: argparse.Namespace, conn: sqlite3.Connection) -> Optional[PriceCache]:
+    if not (args.price_cache or args.rebuild_price_cache):
+        return None
+    cache = refresh_price_cache(conn, args.price_cache_dir, rebuild=args.rebuild_price_cache)
+    print(f"[INFO] Price cache: {cache.rows} rows up to {cache.last_date} ({len(cache.segments)} segment(s)).")
+    return cache
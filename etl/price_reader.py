@@ -0,0 +1,310 @@
+# price_reader.py
+# Streaming reader over stocks.prices: one ordered scan, one symbol at a time.
+#
+# Works on both storage layouts of stocks.db: the legacy prices table
+# (TEXT symbol and date) and the compact one of migrate_prices.py, where
+# prices is a view over prices_compact (symbol ids, YYYYMMDD integer dates,
+# optionally fixed-point prices). Scans and date lookups go to
+# prices_compact directly; the view is only there for other readers.
+import sqlite3
+from dataclasses import dataclass
+from itertools import groupby
+from operator import itemgetter
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+PRICE_COLUMNS = ("date", "open", "high", "low", "close", "volume")
+
+# Rows pulled from the cursor per fetchmany() call
+FETCH_BATCH = 50_000
+
+# Compact layout (see migrate_prices.py)
+COMPACT_TABLE = "prices_compact"
+SYMBOLS_TABLE = "symbols"
+META_TABLE = "prices_meta"
+SCALED_COLUMNS = ("open", "high", "low", "close")
+
+
+@dataclass(frozen=True)
+class PricesLayout:
+    compact: bool = False
+    scale: int = 1  # prices_compact stores round(price * scale); 1 = REAL
+
+
+def prices_layout(conn: sqlite3.Connection) -> PricesLayout:
+    """Storage layout of the database's prices."""
+    row = conn.execute("SELECT type FROM sqlite_master WHERE name = 'prices'").fetchone()
+    if row is None or row[0] != "view":
+        return PricesLayout()
+    scale = conn.execute(
+        f"SELECT value FROM {META_TABLE} WHERE key = 'price_scale'"
+    ).fetchone()
+    return PricesLayout(True, int(scale[0]) if scale else 1)
+
+
+def date_to_int(date_str: str) -> int:
+    """'2025-09-05' -> 20250905"""
+    return int(date_str.replace("-", ""))
+
+
+def int_to_date(value: int, cache: Optional[Dict[int, str]] = None) -> str:
+    """20250905 -> '2025-09-05'"""
+    if cache is not None:
+        text = cache.get(value)
+        if text is None:
+            text = cache[value] = int_to_date(value)
+        return text
+    return f"{value // 10000:04d}-{value // 100 % 100:02d}-{value % 100:02d}"
+
+
+def _date_table(layout: PricesLayout) -> Tuple[str, str]:
+    """(table, symbol column) holding the price dates of a layout."""
+    if layout.compact:
+        return COMPACT_TABLE, "symbol_id"
+    return "prices", "symbol"
+
+
+def _date_param(layout: PricesLayout, date_str: str):
+    return date_to_int(date_str) if layout.compact else date_str
+
+
+def _date_value(layout: PricesLayout, value) -> Optional[str]:
+    if value is None or not layout.compact:
+        return value
+    return int_to_date(value)
+
+
+def _fetch_rows(cur: sqlite3.Cursor, batch_size: int) -> Iterator[tuple]:
+    while True:
+        batch = cur.fetchmany(batch_size)
+        if not batch:
+            return
+        yield from batch
+
+
+def ensure_date_index(conn: sqlite3.Connection) -> None:
+    """
+    Make sure prices can be searched by date. The (date, symbol) index
+    covers the session / universe lookups of a date range, so an update of
+    a few new dates does not scan the whole history.
+    """
+    if prices_layout(conn).compact:
+        conn.execute(
+            f"CREATE INDEX IF NOT EXISTS idx_prices_compact_date ON {COMPACT_TABLE}(date, symbol_id);"
+        )
+    else:
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_prices_date_symbol ON prices(date, symbol);"
+        )
+    conn.commit()
+
+
+# ---------------------------------------------------------------------
+# Date / symbol lookups (index searches on either layout)
+# ---------------------------------------------------------------------
+def session_dates(
+    conn: sqlite3.Connection,
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None,
+    after: Optional[str] = None,
+) -> List[str]:
+    """Distinct price dates in order, within [start_date, end_date] and after `after`."""
+    layout = prices_layout(conn)
+    table, _ = _date_table(layout)
+    where = []
+    params: list = []
+    for op, value in ((">=", start_date), ("<=", end_date), (">", after)):
+        if value is not None:
+            where.append(f"date {op} ?")
+            params.append(_date_param(layout, value))
+    sql = f"SELECT DISTINCT date FROM {table}"
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    sql += " ORDER BY date"
+    return [_date_value(layout, row[0]) for row in conn.execute(sql, params)]
+
+
+def date_bounds(conn: sqlite3.Connection) -> Tuple[Optional[str], Optional[str]]:
+    """(first, last) price date, (None, None) if prices is empty."""
+    layout = prices_layout(conn)
+    table, _ = _date_table(layout)
+    # Separate queries: MIN and MAX together would scan the whole index
+    first = conn.execute(f"SELECT MIN(date) FROM {table}").fetchone()[0]
+    last = conn.execute(f"SELECT MAX(date) FROM {table}").fetchone()[0]
+    return _date_value(layout, first), _date_value(layout, last)
+
+
+def row_count(conn: sqlite3.Connection, end_date: Optional[str] = None) -> int:
+    """Number of price rows, only those up to end_date if given."""
+    layout = prices_layout(conn)
+    table, _ = _date_table(layout)
+    if end_date is None:
+        return conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+    return conn.execute(
+        f"SELECT COUNT(*) FROM {table} WHERE date <= ?", (_date_param(layout, end_date),)
+    ).fetchone()[0]
+
+
+def next_date(conn: sqlite3.Connection, after: str) -> Optional[str]:
+    """First price date strictly after `after`."""
+    layout = prices_layout(conn)
+    table, _ = _date_table(layout)
+    value = conn.execute(
+        f"SELECT MIN(date) FROM {table} WHERE date > ?", (_date_param(layout, after),)
+    ).fetchone()[0]
+    return _date_value(layout, value)
+
+
+def date_before(conn: sqlite3.Connection, before: str, sessions: int = 1) -> Optional[str]:
+    """The `sessions`-th distinct price date before `before` (1 = the previous one)."""
+    layout = prices_layout(conn)
+    table, _ = _date_table(layout)
+    row = conn.execute(
+        f"SELECT DISTINCT date FROM {table} WHERE date < ? ORDER BY date DESC LIMIT 1 OFFSET ?",
+        (_date_param(layout, before), sessions - 1),
+    ).fetchone()
+    return _date_value(layout, row[0]) if row else None
+
+
+def symbols_between(conn: sqlite3.Connection, start_date: str, end_date: str) -> List[str]:
+    """Distinct symbols with a price in [start_date, end_date], in order."""
+    layout = prices_layout(conn)
+    table, key = _date_table(layout)
+    params = (_date_param(layout, start_date), _date_param(layout, end_date))
+    if not layout.compact:
+        sql = f"SELECT DISTINCT {key} FROM {table} WHERE date >= ? AND date <= ? ORDER BY {key}"
+        return [row[0] for row in conn.execute(sql, params)]
+    sql = (
+        f"SELECT s.symbol FROM {SYMBOLS_TABLE} s WHERE s.id IN "
+        f"(SELECT symbol_id FROM {table} WHERE date >= ? AND date <= ?) ORDER BY s.symbol"
+    )
+    return [row[0] for row in conn.execute(sql, params)]
+
+
+def closes_before(
+    conn: sqlite3.Connection, symbol: str, before_date: str, limit: int
+) -> np.ndarray:
+    """Last `limit` closes of a symbol strictly before before_date, oldest first."""
+    layout = prices_layout(conn)
+    if layout.compact:
+        sql = f"""
+            SELECT p.close
+            FROM {COMPACT_TABLE} p
+            WHERE p.symbol_id = (SELECT id FROM {SYMBOLS_TABLE} WHERE symbol = ?) AND p.date < ?
+            ORDER BY p.date DESC
+            LIMIT ?;
+        """
+    else:
+        sql = """
+            SELECT close
+            FROM prices
+            WHERE symbol = ? AND date < ?
+            ORDER BY date DESC
+            LIMIT ?;
+        """
+    rows = conn.execute(sql, (symbol, _date_param(layout, before_date), limit)).fetchall()
+    closes = np.asarray([r[0] for r in rows][::-1], dtype=float)
+    return closes / layout.scale if layout.scale != 1 else closes
+
+
+def iter_symbol_prices(
+    conn: sqlite3.Connection,
+    columns: Sequence[str] = PRICE_COLUMNS,
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None,
+    symbols: Optional[Iterable[str]] = None,
+    after: Optional[Dict[str, str]] = None,
+    batch_size: int = FETCH_BATCH,
+) -> Iterator[Tuple[str, Dict[str, np.ndarray]]]:
+    """
+    Scan prices once, ordered by (symbol, date), and yield
+    (symbol, {column: array}) for every symbol in turn.
+
+    "date" comes back as a str array, every other column as float64.
+    start_date / end_date bound the dates (inclusive) and `symbols`
+    restricts the scan to a set of tickers. `after` maps symbol -> last
+    date already processed: only those symbols are scanned, and only their
+    rows strictly after that date. Only the current symbol's rows are held
+    in memory.
+    """
+    for col in columns:
+        if col not in PRICE_COLUMNS:
+            raise ValueError(f"Unknown prices column: {col}")
+
+    layout = prices_layout(conn)
+    if layout.compact:
+        # Walk the symbols by name and seek each one's rows by primary key,
+        # so rows still come in (symbol, date) order
+        key = "s.symbol"
+        source = f"{SYMBOLS_TABLE} s CROSS JOIN {COMPACT_TABLE} p ON p.symbol_id = s.id"
+    else:
+        key = "p.symbol"
+        source = "prices p"
+
+    where = []
+    params: list = []
+    if start_date is not None:
+        where.append("p.date >= ?")
+        params.append(_date_param(layout, start_date))
+    if end_date is not None:
+        where.append("p.date <= ?")
+        params.append(_date_param(layout, end_date))
+    if symbols is not None:
+        conn.execute("CREATE TEMP TABLE IF NOT EXISTS reader_symbols (symbol TEXT PRIMARY KEY)")
+        conn.execute("DELETE FROM temp.reader_symbols")
+        conn.executemany(
+            "INSERT OR IGNORE INTO temp.reader_symbols (symbol) VALUES (?)",
+            ((s,) for s in symbols),
+        )
+        where.append(f"{key} IN (SELECT symbol FROM temp.reader_symbols)")
+
+    if after is not None:
+        # Integer dates for the compact layout, hence a table per layout
+        table = "reader_after_int" if layout.compact else "reader_after"
+        date_type = "INTEGER" if layout.compact else "TEXT"
+        conn.execute(
+            f"CREATE TEMP TABLE IF NOT EXISTS {table} "
+            f"(symbol TEXT PRIMARY KEY, after {date_type} NOT NULL) WITHOUT ROWID"
+        )
+        conn.execute(f"DELETE FROM temp.{table}")
+        conn.executemany(
+            f"INSERT OR REPLACE INTO temp.{table} (symbol, after) VALUES (?, ?)",
+            ((s, _date_param(layout, d)) for s, d in after.items()),
+        )
+        # CROSS JOIN keeps reader_after as the outer loop: walk the symbols in
+        # order and seek each one's new rows by primary key
+        if layout.compact:
+            source = (
+                f"temp.{table} a CROSS JOIN {SYMBOLS_TABLE} s ON s.symbol = a.symbol "
+                f"CROSS JOIN {COMPACT_TABLE} p ON p.symbol_id = s.id AND p.date > a.after"
+            )
+        else:
+            source = "temp.reader_after a CROSS JOIN prices p ON p.symbol = a.symbol AND p.date > a.after"
+
+    selected = ", ".join(f"p.{col}" for col in columns)
+    sql = f"SELECT {key}, {selected} FROM {source}"
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    sql += f" ORDER BY {key}, p.date"
+
+    dates: Dict[int, str] = {}
+    cur = conn.cursor()
+    cur.execute(sql, params)
+    try:
+        for symbol, rows in groupby(_fetch_rows(cur, batch_size), key=itemgetter(0)):
+            values = list(zip(*rows))
+            out: Dict[str, np.ndarray] = {}
+            for i, col in enumerate(columns, start=1):
+                if col == "date":
+                    if layout.compact:
+                        out[col] = np.asarray([int_to_date(d, dates) for d in values[i]], dtype=str)
+                    else:
+                        out[col] = np.asarray(values[i], dtype=str)
+                else:
+                    out[col] = np.asarray(values[i], dtype=float)
+                    if layout.scale != 1 and col in SCALED_COLUMNS:
+                        out[col] /= layout.scale
+            yield symbol, out
+    finally:
+        cur.close()
@@ -0,0 +1,80 @@
+# response_cache.py
+# On-disk cache of raw Polygon grouped-daily responses, so stocks.db can be
+# rebuilt or re-derived without spending API quota again:
+#
+#   ../data/polygon_cache/objects/ab/<sha256>.json.gz   response body, gzipped
+#   ../data/polygon_cache/refs/adjusted/2025-09-05     sha256 of that day's body
+#   ../data/polygon_cache/refs/unadjusted/...
+#
+# Objects are content-addressed (named after the sha256 of the raw body) and
+# checked against it on read; refs map (date, adjusted) to an object. Both are
+# written to a temp file and renamed, so readers never see partial files.
+import gzip
+import hashlib
+import os
+import tempfile
+from typing import List, Optional
+
+CACHE_DIR = "../data/polygon_cache"
+
+# How PolygonFetcher uses the cache
+CACHE_USE = "use"          # serve hits, fetch and store misses
+CACHE_REFRESH = "refresh"  # always fetch, store the new responses
+CACHE_ONLY = "only"        # serve hits, misses fail without a request
+CACHE_OFF = "off"
+CACHE_MODES = (CACHE_USE, CACHE_REFRESH, CACHE_ONLY, CACHE_OFF)
+
+
+class ResponseCache:
+    """Content-addressed store of grouped-daily response bodies."""
+
+    def __init__(self, root: str = CACHE_DIR):
+        self.root = root
+
+    def _object_path(self, digest: str) -> str:
+        return os.path.join(self.root, "objects", digest[:2], f"{digest}.json.gz")
+
+    def _ref_path(self, date_str: str, adjusted: bool) -> str:
+        return os.path.join(self.root, "refs", "adjusted" if adjusted else "unadjusted", date_str)
+
+    @staticmethod
+    def _write_atomic(path: str, data: bytes) -> None:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp, path)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+
+    def get(self, date_str: str, adjusted: bool = True) -> Optional[bytes]:
+        """Raw body cached for the date, or None (also if the object is damaged)."""
+        try:
+            with open(self._ref_path(date_str, adjusted), "r", encoding="ascii") as f:
+                digest = f.read().strip()
+            with gzip.open(self._object_path(digest), "rb") as f:
+                raw = f.read()
+        except (OSError, EOFError):
+            return None
+        if hashlib.sha256(raw).hexdigest() != digest:
+            print(f"[WARN] Cached response for {date_str} is damaged, ignoring it.")
+            return None
+        return raw
+
+    def put(self, date_str: str, adjusted: bool, raw: bytes) -> str:
+        """Store a body and point the date's ref at it; returns its sha256."""
+        digest = hashlib.sha256(raw).hexdigest()
+        path = self._object_path(digest)
+        if not os.path.exists(path):
+            self._write_atomic(path, gzip.compress(raw, compresslevel=6))
+        self._write_atomic(self._ref_path(date_str, adjusted), digest.encode("ascii"))
+        return digest
+
+    def dates(self, adjusted: bool = True) -> List[str]:
+        """Dates with a cached response, in order."""
+        refs = os.path.dirname(self._ref_path("", adjusted))
+        if not os.path.isdir(refs):
+            return []
+        return sorted(name for name in os.listdir(refs) if not name.endswith(".tmp"))
@@ -0,0 +1,137 @@
+# rolling.py
+# Constant-time (amortized) rolling windows for the per-row breadth loops.
+from collections import deque
+from typing import Deque, Sequence, Tuple
+
+
+class RollingMax:
+    """
+    Maximum of the last `window` values pushed.
+
+    Monotonic deque: values that can never be the maximum again (an older
+    value <= a newer one) are dropped on push, so the front is always the
+    maximum and every value is pushed and popped at most once.
+    """
+
+    __slots__ = ("window", "count", "_dq")
+
+    def __init__(self, window: int):
+        self.window = window
+        self.count = 0
+        self._dq: Deque[Tuple[int, float]] = deque()
+
+    def push(self, value: float) -> None:
+        dq = self._dq
+        while dq and dq[-1][1] <= value:
+            dq.pop()
+        dq.append((self.count, value))
+        self.count += 1
+        if dq[0][0] <= self.count - 1 - self.window:
+            dq.popleft()
+
+    @classmethod
+    def from_values(cls, window: int, values: Sequence[float]) -> "RollingMax":
+        """
+        Same state as pushing `values` (at most `window` of them) into an
+        empty window, built in one backward pass: a value survives if it
+        beats every value pushed after it.
+        """
+        rolling = cls(window)
+        rolling.count = len(values)
+        kept = []
+        best = float("-inf")
+        for i in range(len(values) - 1, -1, -1):
+            value = values[i]
+            if value > best:
+                kept.append((i, value))
+                best = value
+        kept.reverse()
+        rolling._dq.extend(kept)
+        return rolling
+
+    @property
+    def full(self) -> bool:
+        return self.count >= self.window
+
+    @property
+    def value(self) -> float:
+        return self._dq[0][1]
+
+
+class RollingMin(RollingMax):
+    """Minimum of the last `window` values pushed (see RollingMax)."""
+
+    __slots__ = ()
+
+    @classmethod
+    def from_values(cls, window: int, values: Sequence[float]) -> "RollingMin":
+        rolling = cls(window)
+        rolling.count = len(values)
+        kept = []
+        best = float("inf")
+        for i in range(len(values) - 1, -1, -1):
+            value = values[i]
+            if value < best:
+                kept.append((i, value))
+                best = value
+        kept.reverse()
+        rolling._dq.extend(kept)
+        return rolling
+
+    def push(self, value: float) -> None:
+        dq = self._dq
+        while dq and dq[-1][1] >= value:
+            dq.pop()
+        dq.append((self.count, value))
+        self.count += 1
+        if dq[0][0] <= self.count - 1 - self.window:
+            dq.popleft()
+
+
+class RollingMean:
+    """
+    Mean of the last `window` values pushed, kept as a running sum.
+
+    While every value in the window is a whole number (share volumes) the
+    running sum is exact and equals sum(window). If a fractional value is
+    in the window the mean falls back to sum(), so the result is always
+    identical to sum(window) / len(window).
+    """
+
+    __slots__ = ("window", "_values", "_total", "_fractional")
+
+    def __init__(self, window: int):
+        self.window = window
+        self._values: Deque[float] = deque()
+        self._total = 0.0
+        self._fractional = 0
+
+    def push(self, value: float) -> None:
+        values = self._values
+        if len(values) == self.window:
+            self._drop(values.popleft())
+        values.append(value)
+        if value.is_integer():
+            self._total += value
+        else:
+            self._fractional += 1
+
+    def _drop(self, value: float) -> None:
+        if value.is_integer():
+            self._total -= value
+        else:
+            self._fractional -= 1
+
+    @property
+    def full(self) -> bool:
+        return len(self._values) == self.window
+
+    @property
+    def values(self) -> Tuple[float, ...]:
+        return tuple(self._values)
+
+    @property
+    def value(self) -> float:
+        if self._fractional:
+            return sum(self._values) / len(self._values)
+        return self._total / len(self._values)
@@ -0,0 +1,35 @@
+# conftest.py
+# The scripts read ../data/*.db relative to the working directory, so each
+# test gets a fresh tmp/data with the synthetic databases and runs from
+# tmp/etl.
+import pytest
+
+from support import PolygonStub, make_lists, make_prices
+
+
+@pytest.fixture
+def data_dir(tmp_path, monkeypatch):
+    data = tmp_path / "data"
+    data.mkdir()
+    make_prices(str(data / "stocks.db"))
+    make_lists(str(data / "stocks_lists.db"))
+    work = tmp_path / "etl"
+    work.mkdir()
+    monkeypatch.chdir(work)
+    return data
+
+
+@pytest.fixture
+def polygon_stub(monkeypatch):
+    """Start a stub over a prices DB (see PolygonStub); stopped after the test."""
+    monkeypatch.setenv("POLYGON_API_KEY", "test")
+    stubs = []
+
+    def start(db_path=None, fail_dates=None, rate_limit_every=0):
+        stub = PolygonStub(str(db_path) if db_path else None, fail_dates, rate_limit_every)
+        stubs.append(stub)
+        return stub
+
+    yield start
+    for stub in stubs:
+        stub.close()
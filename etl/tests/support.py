@@ -0,0 +1,208 @@
+# support.py
+# Shared pieces of the ETL tests: a small synthetic data directory laid out
+# like ../data (stocks.db, stocks_lists.db), readers that turn the output
+# databases into comparable row lists, and a local Polygon stub server.
+import os
+import random
+import sqlite3
+import sys
+import threading
+from datetime import date, timedelta
+from http.server import ThreadingHTTPServer
+from typing import List, Optional
+
+ETL_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ETL_DIR not in sys.path:
+    sys.path.insert(0, ETL_DIR)
+
+from db_publish import current_path  # noqa: E402
+from polygon_stub import StubData, make_handler  # noqa: E402
+
+SESSIONS = 320  # more than the 52-week window and the metrics lookback
+SYMBOLS = [f"S{i:03d}" for i in range(24)]
+SECTORS = ["Tech", "Financials", "Energy"]
+LISTS = ["Sp 500 Stocks", "Growth", "Watch"]
+
+PRICES_SCHEMA = """
+    CREATE TABLE prices (
+        symbol        TEXT NOT NULL,
+        date          TEXT NOT NULL,
+        open          REAL,
+        high          REAL,
+        low           REAL,
+        close         REAL,
+        volume        INTEGER,
+        open_interest INTEGER DEFAULT 0,
+        PRIMARY KEY (symbol, date)
+    )
+"""
+
+
+def sessions(n: int = SESSIONS) -> List[str]:
+    """The first n weekdays from 2023-01-02."""
+    days: List[str] = []
+    day = date(2023, 1, 2)
+    while len(days) < n:
+        if day.weekday() < 5:
+            days.append(day.isoformat())
+        day += timedelta(days=1)
+    return days
+
+
+def make_prices(db_path: str, seed: int = 7) -> None:
+    """
+    Random-walk daily bars for SYMBOLS: some listed late, one delisted
+    early, a few with holes, one flat (unchanged closes).
+    """
+    rng = random.Random(seed)
+    days = sessions()
+    rows = []
+    for i, symbol in enumerate(SYMBOLS):
+        start, end = 0, len(days)
+        if i % 8 == 1:
+            start = len(days) - 40
+        elif i % 8 == 2:
+            start = len(days) - 150
+        elif i % 8 == 3:
+            end = len(days) - 30
+        price = rng.uniform(5, 200)
+        for k in range(start, end):
+            if i % 7 == 5 and rng.random() < 0.03:
+                continue
+            if i != 6:
+                price = max(0.5, price * (1 + rng.gauss(0, 0.02)))
+            close = round(price, 2)
+            open_ = round(close * (1 + rng.gauss(0, 0.005)), 2)
+            high = round(max(open_, close) * (1 + abs(rng.gauss(0, 0.01))), 2)
+            low = round(min(open_, close) * (1 - abs(rng.gauss(0, 0.01))), 2)
+            rows.append((symbol, days[k], open_, high, low, close, int(rng.lognormvariate(12, 0.6))))
+    conn = sqlite3.connect(db_path)
+    try:
+        conn.execute(PRICES_SCHEMA)
+        conn.executemany(
+            "INSERT INTO prices (symbol, date, open, high, low, close, volume) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            rows,
+        )
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def make_lists(db_path: str) -> None:
+    """Sectors round-robin, lists by stock id (every 2nd, 3rd and 5th)."""
+    conn = sqlite3.connect(db_path)
+    try:
+        conn.executescript(
+            """
+            CREATE TABLE stocks (id INTEGER PRIMARY KEY, ticker TEXT UNIQUE, name TEXT, sector TEXT);
+            CREATE TABLE lists (id INTEGER PRIMARY KEY, name TEXT UNIQUE);
+            CREATE TABLE list_stocks (list_id INTEGER, stock_id INTEGER, PRIMARY KEY (list_id, stock_id));
+            """
+        )
+        for i, symbol in enumerate(SYMBOLS):
+            conn.execute(
+                "INSERT INTO stocks (ticker, name, sector) VALUES (?, ?, ?)",
+                (symbol, symbol, SECTORS[i % len(SECTORS)]),
+            )
+        conn.executemany("INSERT INTO lists (name) VALUES (?)", ((name,) for name in LISTS))
+        for stock_id, in conn.execute("SELECT id FROM stocks").fetchall():
+            for list_id, step in ((1, 2), (2, 3), (3, 5)):
+                if stock_id % step == 0:
+                    conn.execute("INSERT INTO list_stocks VALUES (?, ?)", (list_id, stock_id))
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def add_to_list(lists_db: str, symbol: str, list_name: str) -> None:
+    conn = sqlite3.connect(lists_db)
+    try:
+        conn.execute(
+            """
+            INSERT INTO list_stocks
+            SELECT l.id, s.id FROM lists l, stocks s WHERE l.name = ? AND s.ticker = ?
+            """,
+            (list_name, symbol),
+        )
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def execute(db_path: str, sql: str, params: tuple = ()) -> None:
+    conn = sqlite3.connect(db_path)
+    try:
+        conn.execute(sql, params)
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def copy_prices(src: str, dst: str, where: str = "1", params: tuple = (), move: bool = False) -> None:
+    """
+    Copy the prices rows of src matching `where` into dst (a new stocks.db
+    unless it has a prices table); `move` deletes them from src.
+    """
+    conn = sqlite3.connect(dst)
+    try:
+        conn.execute(PRICES_SCHEMA.replace("CREATE TABLE", "CREATE TABLE IF NOT EXISTS"))
+        conn.execute("ATTACH DATABASE ? AS src", (src,))
+        conn.execute(f"INSERT INTO prices SELECT * FROM src.prices WHERE {where}", params)
+        if move:
+            conn.execute(f"DELETE FROM src.prices WHERE {where}", params)
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def breadth_rows(breadth_db: str) -> List[tuple]:
+    """Every breadth row of the live version, keyed by group (type, name) and date."""
+    conn = sqlite3.connect(current_path(breadth_db))
+    try:
+        return conn.execute(
+            """
+            SELECT g.type, g.name, b.date, b.total, b.adv, b.dec, b.new_high_52w, b.new_low_52w,
+                   b.above_ma5, b.above_ma10, b.above_ma20, b.above_ma50, b.above_ma200,
+                   b.spike_up, b.spike_down, b.ad_value, b.ema19, b.ema39, b.mcclellan
+            FROM breadth b JOIN groups g ON g.id = b.group_id
+            ORDER BY g.type, g.name, b.date
+            """
+        ).fetchall()
+    finally:
+        conn.close()
+
+
+def metrics_rows(metrics_db: str) -> List[tuple]:
+    """Every metrics row of the live version, in key order."""
+    conn = sqlite3.connect(current_path(metrics_db))
+    try:
+        return conn.execute("SELECT * FROM metrics ORDER BY date, symbol").fetchall()
+    finally:
+        conn.close()
+
+
+class PolygonStub:
+    """polygon_stub.py on an ephemeral port, serving a prices table."""
+
+    def __init__(
+        self,
+        db_path: Optional[str] = None,
+        fail_dates: Optional[List[str]] = None,
+        rate_limit_every: int = 0,
+    ):
+        self.server = ThreadingHTTPServer(
+            ("127.0.0.1", 0),
+            make_handler(StubData(db_path), rate_limit_every, 0.0, set(fail_dates or [])),
+        )
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    def close(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def fetch_args(stub: PolygonStub) -> List[str]:
+    """Command-line options pointing a fetching script at the stub."""
+    return ["--base-url", stub.url, "--requests-per-minute", "60000"]
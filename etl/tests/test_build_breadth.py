@@ -0,0 +1,66 @@
+# test_build_breadth.py
+# The parallel pass must reproduce the serial build exactly.
+from concurrent.futures import Future
+
+import pytest
+
+import build_breadth
+from support import SYMBOLS, breadth_rows, sessions
+
+BREADTH_DB = "../data/breadth.db"
+
+
+class InlineExecutor:
+    """ProcessPoolExecutor stand-in running the shards in this process."""
+
+    def __init__(self, max_workers=None):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def submit(self, fn, *args):
+        future = Future()
+        future.set_result(fn(*args))
+        return future
+
+
+@pytest.fixture
+def serial_breadth(data_dir):
+    build_breadth.main(["--workers", "1"])
+    return breadth_rows(BREADTH_DB)
+
+
+@pytest.mark.parametrize("workers", [2, 3])
+def test_parallel_matches_serial(data_dir, serial_breadth, workers):
+    build_breadth.main(["--workers", str(workers)])
+
+    assert breadth_rows(BREADTH_DB) == serial_breadth
+
+
+def test_shards_return_only_their_groups_and_dates(data_dir, serial_breadth, monkeypatch):
+    # One symbol per shard: a shard counts only that symbol's groups and,
+    # for a late listing, only the sessions since
+    monkeypatch.setattr(build_breadth, "SHARDS_PER_WORKER", len(SYMBOLS) // 2)
+    monkeypatch.setattr(build_breadth, "ProcessPoolExecutor", InlineExecutor)
+    sent = []
+    process_shard = build_breadth._process_shard
+
+    def recording(db_path, group_ids, *args):
+        first, counts, states = process_shard(db_path, group_ids, *args)
+        sent.append((len(group_ids), first, counts.shape))
+        return first, counts, states
+
+    monkeypatch.setattr(build_breadth, "_process_shard", recording)
+    build_breadth.main(["--workers", "2"])
+
+    n_groups, n_dates = len({row[:2] for row in serial_breadth}), len(sessions())
+    assert len(sent) == len(SYMBOLS)
+    assert all(n < n_groups for n, _, _ in sent)
+    assert any(shape[1] < n_dates for _, _, shape in sent)
+    for n, first, shape in sent:
+        assert shape[0] == n and first + shape[1] <= n_dates
+    assert breadth_rows(BREADTH_DB) == serial_breadth
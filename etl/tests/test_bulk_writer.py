@@ -0,0 +1,61 @@
+# test_bulk_writer.py
+import sqlite3
+
+import pytest
+
+from bulk_writer import BulkWriter, connect_wal
+
+INSERT_SQL = "INSERT INTO t VALUES (?, ?)"
+
+
+def make_table(db_path) -> sqlite3.Connection:
+    conn = sqlite3.connect(db_path)
+    conn.execute("CREATE TABLE t (k INTEGER PRIMARY KEY, v TEXT)")
+    conn.executemany(INSERT_SQL, ((i, "old") for i in range(5)))
+    conn.commit()
+    return conn
+
+
+def count(conn: sqlite3.Connection) -> int:
+    return conn.execute("SELECT COUNT(*) FROM t").fetchone()[0]
+
+
+@pytest.mark.parametrize("bulk", [False, True])
+def test_exception_rolls_back_written_batches(tmp_path, bulk):
+    conn = make_table(tmp_path / "t.db")
+    with pytest.raises(RuntimeError):
+        with BulkWriter(conn, bulk=bulk, batch_size=10) as writer:
+            writer.insert(INSERT_SQL, ((i, "new") for i in range(100, 125)))
+            assert writer.rows_written == 25  # already executed, not committed
+            # journal_mode=OFF would only roll back what is still in the page cache
+            assert conn.execute("PRAGMA journal_mode").fetchone()[0] != "off"
+            raise RuntimeError("load failed")
+
+    assert count(conn) == 5
+    assert conn.execute("PRAGMA integrity_check").fetchone()[0] == "ok"
+    conn.close()
+    assert count(sqlite3.connect(tmp_path / "t.db")) == 5
+
+
+def test_bulk_load_restores_pragmas(tmp_path):
+    conn = make_table(tmp_path / "t.db")
+    before = [conn.execute(f"PRAGMA {name}").fetchone()[0] for name in ("journal_mode", "synchronous")]
+    with BulkWriter(conn, bulk=True, batch_size=10, indexes=["CREATE INDEX t_v ON t (v)"]) as writer:
+        writer.insert(INSERT_SQL, ((i, "new") for i in range(100, 125)))
+
+    assert count(conn) == 30
+    assert [conn.execute(f"PRAGMA {name}").fetchone()[0] for name in ("journal_mode", "synchronous")] == before
+    assert conn.execute("SELECT name FROM sqlite_master WHERE type = 'index'").fetchall() == [("t_v",)]
+
+
+def test_wal_writer_commits_per_call_and_truncates(tmp_path):
+    make_table(tmp_path / "t.db").close()
+    conn = connect_wal(str(tmp_path / "t.db"))
+    reader = sqlite3.connect(tmp_path / "t.db")
+    with BulkWriter(conn) as writer:
+        writer.insert(INSERT_SQL, [(100, "new")])
+        writer.commit()
+        assert count(reader) == 6  # visible to other connections once committed
+        writer.insert(INSERT_SQL, [(101, "new")])
+    assert count(reader) == 7
+    assert (tmp_path / "t.db-wal").stat().st_size == 0
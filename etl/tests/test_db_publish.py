@@ -0,0 +1,80 @@
+# test_db_publish.py
+# After a rebuild the configured path must still open the live database, and
+# collecting old versions must never take that path away.
+import os
+import sqlite3
+
+from db_publish import current_path, list_versions, shadow_build
+
+DB = "../data/breadth.db"
+
+
+def build(value: int) -> str:
+    with shadow_build(DB) as version:
+        conn = sqlite3.connect(version)
+        conn.execute("CREATE TABLE t (v INTEGER)")
+        conn.execute("INSERT INTO t VALUES (?)", (value,))
+        conn.commit()
+        conn.close()
+    return current_path(DB)
+
+
+def read_plain() -> int:
+    conn = sqlite3.connect(DB)
+    try:
+        return conn.execute("SELECT v FROM t").fetchone()[0]
+    finally:
+        conn.close()
+
+
+def test_plain_path_follows_rebuilds(data_dir):
+    for value in range(1, 5):
+        live = build(value)
+        assert os.path.islink(DB)
+        assert os.readlink(DB) == os.path.basename(live)
+        assert read_plain() == value
+    # the link is not a version: the newest two stay
+    assert len(list_versions(DB)) == 2
+    assert os.path.realpath(DB) == os.path.realpath(current_path(DB))
+
+
+def test_legacy_file_replaced_by_link(data_dir):
+    conn = sqlite3.connect(DB)
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.execute("CREATE TABLE t (v INTEGER)")
+    conn.execute("INSERT INTO t VALUES (0)")
+    conn.commit()
+    conn.close()
+
+    build(1)
+
+    assert os.path.islink(DB)
+    assert read_plain() == 1
+    assert not any(os.path.exists(DB + s) for s in ("-wal", "-shm", "-journal"))
+
+
+def test_wal_of_link_lives_with_version(data_dir):
+    live = build(1)
+    conn = sqlite3.connect(DB)
+    conn.execute("INSERT INTO t VALUES (2)")
+    conn.commit()
+    assert os.path.exists(live + "-wal")
+    conn.close()
+
+    # an incremental writer on the live version sees the same data
+    conn = sqlite3.connect(current_path(DB))
+    try:
+        assert conn.execute("SELECT COUNT(*) FROM t").fetchone()[0] == 2
+    finally:
+        conn.close()
+
+
+def test_failed_link_keeps_pointer(data_dir, monkeypatch):
+    def no_symlinks(*args, **kwargs):
+        raise OSError("symlinks not permitted")
+
+    monkeypatch.setattr(os, "symlink", no_symlinks)
+    live = build(1)
+    assert not os.path.lexists(DB)
+    assert current_path(DB) == live
+    assert os.path.exists(live)
@@ -0,0 +1,80 @@
+# test_incremental.py
+# The incremental updates must leave metrics.db and breadth.db exactly where
+# a full rebuild over the same prices would: the last sessions are held back
+# for the initial build, then put back and added incrementally.
+import pytest
+
+import build_breadth
+import build_metrics
+import update_breadth
+import update_metrics_breadth
+from support import breadth_rows, copy_prices, metrics_rows, sessions
+
+BREADTH_DB = "../data/breadth.db"
+METRICS_DB = "../data/metrics.db"
+
+
+@pytest.fixture
+def held_back(data_dir):
+    """hold(n) moves the last n sessions out of stocks.db, restore() puts them back."""
+    stocks_db, tail_db = str(data_dir / "stocks.db"), str(data_dir / "tail.db")
+
+    class Tail:
+        @staticmethod
+        def hold(n: int) -> None:
+            copy_prices(stocks_db, tail_db, "date >= ?", (sessions()[-n],), move=True)
+
+        @staticmethod
+        def restore() -> None:
+            copy_prices(tail_db, stocks_db, move=True)
+
+    return Tail
+
+
+def fill_metrics(data_dir, *argv: str) -> None:
+    # build_metrics.main() finds data/ next to etl/, not from the working directory
+    args = build_metrics.parse_args(list(argv))
+    metrics_db = str(data_dir / "metrics.db")
+    build_metrics.fill_metrics(args, data_dir / "stocks.db", metrics_db, rebuild="--backfill" in argv)
+
+
+@pytest.mark.parametrize("new_sessions", [1, 7])
+def test_update_breadth_matches_build(data_dir, held_back, new_sessions):
+    held_back.hold(new_sessions)
+    build_breadth.main(["--workers", "1"])
+    held_back.restore()
+
+    update_breadth.main([])
+    updated = breadth_rows(BREADTH_DB)
+
+    build_breadth.main(["--workers", "1"])
+    assert updated == breadth_rows(BREADTH_DB)
+
+
+@pytest.mark.parametrize("new_sessions", [1, 7])
+def test_incremental_metrics_match_backfill(data_dir, held_back, new_sessions):
+    held_back.hold(new_sessions)
+    fill_metrics(data_dir, "--backfill")
+    held_back.restore()
+
+    fill_metrics(data_dir, "--incremental")
+    updated = metrics_rows(METRICS_DB)
+
+    fill_metrics(data_dir, "--backfill")
+    assert updated == metrics_rows(METRICS_DB)
+
+
+@pytest.mark.parametrize("new_sessions", [1, 7])
+def test_update_metrics_breadth_matches_rebuild(data_dir, held_back, new_sessions):
+    held_back.hold(new_sessions)
+    update_metrics_breadth.main(["--rebuild"])
+    held_back.restore()
+
+    update_metrics_breadth.main([])
+    updated = metrics_rows(METRICS_DB), breadth_rows(BREADTH_DB)
+
+    update_metrics_breadth.main(["--rebuild"])
+    assert updated == (metrics_rows(METRICS_DB), breadth_rows(BREADTH_DB))
+    # ...and the separate scripts agree with the combined pass
+    build_breadth.main(["--workers", "1"])
+    assert updated[1] == breadth_rows(BREADTH_DB)
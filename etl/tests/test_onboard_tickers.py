@@ -0,0 +1,108 @@
+# test_onboard_tickers.py
+# Onboarding patches breadth.db group by group; it must end up where a full
+# build_breadth.py run over the same prices and lists would.
+import sqlite3
+
+import build_breadth
+import onboard_tickers
+import update_breadth
+from support import add_to_list, breadth_rows, copy_prices, execute, fetch_args, sessions
+
+BREADTH_DB = "../data/breadth.db"
+
+
+def trim_history(data_dir, symbol: str, keep: int) -> None:
+    """Leave only the last `keep` sessions of symbol's rows in stocks.db."""
+    execute(
+        str(data_dir / "stocks.db"),
+        "DELETE FROM prices WHERE symbol = ? AND date < ?",
+        (symbol, sessions()[-keep]),
+    )
+
+
+def onboard(stub, *tickers: str, options: tuple = ()) -> None:
+    onboard_tickers.main(["--force", *tickers, *fetch_args(stub), *options])
+
+
+def rebuilt_breadth() -> list:
+    build_breadth.main(["--workers", "1"])
+    return breadth_rows(BREADTH_DB)
+
+
+def test_onboarding_matches_rebuild(data_dir, polygon_stub):
+    copy_prices(str(data_dir / "stocks.db"), str(data_dir / "full.db"))
+    trim_history(data_dir, "S005", 100)
+    build_breadth.main(["--workers", "1"])
+
+    onboard(polygon_stub(data_dir / "full.db"), "S005")
+
+    assert breadth_rows(BREADTH_DB) == rebuilt_breadth()
+
+
+def test_onboarding_after_list_change(data_dir, polygon_stub):
+    # S005 joins a list after breadth counted its short history: its old
+    # rows are only taken out of the groups they were counted in
+    copy_prices(str(data_dir / "stocks.db"), str(data_dir / "full.db"))
+    trim_history(data_dir, "S005", 100)
+    build_breadth.main(["--workers", "1"])
+    add_to_list(str(data_dir / "stocks_lists.db"), "S005", "Watch")
+
+    onboard(polygon_stub(data_dir / "full.db"), "S005")
+
+    assert breadth_rows(BREADTH_DB) == rebuilt_breadth()
+
+
+def test_onboarding_after_list_change_and_update(data_dir, polygon_stub):
+    # ...and an incremental update in between counted its newest rows in
+    # the new list only
+    stocks_db, tail_db = str(data_dir / "stocks.db"), str(data_dir / "tail.db")
+    copy_prices(stocks_db, str(data_dir / "full.db"))
+    trim_history(data_dir, "S005", 100)
+    copy_prices(stocks_db, tail_db, "date >= ?", (sessions()[-5],), move=True)
+    build_breadth.main(["--workers", "1"])
+    add_to_list(str(data_dir / "stocks_lists.db"), "S005", "Watch")
+    copy_prices(tail_db, stocks_db, move=True)
+    update_breadth.main([])
+
+    onboard(polygon_stub(data_dir / "full.db"), "S005")
+
+    assert breadth_rows(BREADTH_DB) == rebuilt_breadth()
+
+
+def test_onboarding_with_empty_refetch(data_dir, polygon_stub):
+    # S004 is counted already and comes back empty: its rows stay, and so
+    # does its contribution
+    copy_prices(str(data_dir / "stocks.db"), str(data_dir / "stub.db"), "symbol != 'S004'")
+    trim_history(data_dir, "S005", 100)
+    build_breadth.main(["--workers", "1"])
+
+    onboard(polygon_stub(data_dir / "stub.db"), "S004", "S005")
+
+    assert breadth_rows(BREADTH_DB) == rebuilt_breadth()
+
+
+def test_onboarding_applies_ingest_policy(data_dir, polygon_stub):
+    # UNTR is served but not in stocks_lists.db: the universe policy keeps
+    # S005's history and drops UNTR's, like the daily updates would
+    stub_db = str(data_dir / "full.db")
+    copy_prices(str(data_dir / "stocks.db"), stub_db)
+    execute(
+        stub_db,
+        "INSERT INTO prices SELECT 'UNTR', date, open, high, low, close, volume, 0 "
+        "FROM prices WHERE symbol = 'S000'",
+    )
+    trim_history(data_dir, "S005", 100)
+    build_breadth.main(["--workers", "1"])
+
+    onboard(polygon_stub(stub_db), "S005", "UNTR", options=("--policy", "universe"))
+
+    conn = sqlite3.connect(str(data_dir / "stocks.db"))
+    try:
+        stored = dict(conn.execute("SELECT symbol, rows_fetched FROM onboarded_tickers"))
+        untr = conn.execute("SELECT COUNT(*) FROM prices WHERE symbol = 'UNTR'").fetchone()[0]
+    finally:
+        conn.close()
+    assert untr == 0
+    assert stored["UNTR"] == 0
+    assert stored["S005"] > 100
+    assert breadth_rows(BREADTH_DB) == rebuilt_breadth()
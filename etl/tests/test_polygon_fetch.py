@@ -0,0 +1,101 @@
+# test_polygon_fetch.py
+# PolygonFetcher against polygon_stub.py: results come back once per date,
+# in order, whatever fails along the way.
+import asyncio
+import sqlite3
+
+from polygon_fetch import FetchResult, PolygonFetcher
+from response_cache import ResponseCache
+from support import sessions
+
+DATES = sessions()[-12:]
+
+
+def fetcher_for(stub, **kwargs) -> PolygonFetcher:
+    kwargs.setdefault("backoff_base", 0.01)
+    return PolygonFetcher(
+        "test", base_url=stub.url, requests_per_minute=60000, concurrency=4, **kwargs
+    )
+
+
+def fetch(fetcher: PolygonFetcher, dates=DATES) -> list:
+    results = []
+    # A result that never arrives would hang the writer: fail instead
+    asyncio.run(asyncio.wait_for(fetcher.run(dates, results.append), timeout=30))
+    return results
+
+
+def stored_rows(data_dir, date_str: str) -> list:
+    conn = sqlite3.connect(data_dir / "stocks.db")
+    try:
+        return conn.execute(
+            "SELECT symbol, date, open, high, low, close, volume FROM prices WHERE date = ? ORDER BY symbol",
+            (date_str,),
+        ).fetchall()
+    finally:
+        conn.close()
+
+
+def test_results_in_date_order_through_rate_limits(data_dir, polygon_stub):
+    stub = polygon_stub(data_dir / "stocks.db", rate_limit_every=3)
+
+    results = fetch(fetcher_for(stub, max_retries=10))
+
+    assert [r.date for r in results] == DATES
+    assert any(r.attempts > 1 for r in results)
+    for result in results:
+        assert result.ok
+        assert sorted(result.rows) == stored_rows(data_dir, result.date)
+
+
+def test_failing_date_gives_up_after_retries(data_dir, polygon_stub):
+    stub = polygon_stub(data_dir / "stocks.db", fail_dates=[DATES[3]])
+
+    results = fetch(fetcher_for(stub, max_retries=2))
+
+    assert [r.date for r in results] == DATES
+    assert [(r.date, r.error, r.attempts) for r in results if not r.ok] == [(DATES[3], "HTTP 500", 3)]
+
+
+def test_unexpected_payload_fails_the_date(data_dir, polygon_stub):
+    class ListPayload(PolygonFetcher):
+        def _get(self, url: str) -> bytes:
+            if DATES[5] in url:
+                return b"[]"  # parses as JSON, but is no grouped-daily payload
+            return super()._get(url)
+
+    stub = polygon_stub(data_dir / "stocks.db")
+    results = fetch(ListPayload("test", base_url=stub.url, requests_per_minute=60000))
+
+    assert [r.date for r in results] == DATES
+    assert [r.date for r in results if not r.ok] == [DATES[5]]
+    assert "AttributeError" in results[5].error
+
+
+def test_corrupt_cache_entry_is_refetched(data_dir, polygon_stub):
+    cache = ResponseCache(str(data_dir / "polygon_cache"))
+    cache.put(DATES[0], True, b"{not json")
+    stub = polygon_stub(data_dir / "stocks.db")
+
+    results = fetch(fetcher_for(stub, cache=cache), DATES[:2])
+
+    assert all(r.ok and not r.cached for r in results)
+    assert sorted(results[0].rows) == stored_rows(data_dir, DATES[0])
+    assert fetch(fetcher_for(stub, cache=cache), DATES[:1])[0].cached
+
+
+def test_failed_result_carries_symbol_for_ticker_ranges(data_dir, polygon_stub):
+    class Broken(PolygonFetcher):
+        async def fetch_ticker_range(self, symbol, start, end, bucket) -> FetchResult:
+            if symbol == "S001":
+                raise RuntimeError("boom")
+            return await super().fetch_ticker_range(symbol, start, end, bucket)
+
+    stub = polygon_stub(data_dir / "stocks.db")
+    fetcher = Broken("test", base_url=stub.url, requests_per_minute=60000)
+    results = []
+    ranges = [(s, DATES[0], DATES[-1]) for s in ("S000", "S001", "S002")]
+    asyncio.run(asyncio.wait_for(fetcher.run_ticker_ranges(ranges, results.append), timeout=30))
+
+    assert [(r.symbol, r.ok) for r in results] == [("S000", True), ("S001", False), ("S002", True)]
+    assert results[1].date == DATES[0] and results[1].error == "RuntimeError: boom"
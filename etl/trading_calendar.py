@@ -0,0 +1,243 @@
+# trading_calendar.py
+# Offline NYSE trading calendar: rule-based US market holidays and early
+# closes, with session arithmetic on numpy business-day calendars.
+from datetime import date, datetime, timedelta
+from functools import lru_cache
+from typing import Dict, Iterable, List, Optional, Union
+
+import numpy as np
+
+DateLike = Union[str, date, np.datetime64]
+
+FIRST_YEAR = 1990
+
+REGULAR_CLOSE = "16:00"
+EARLY_CLOSE = "13:00"
+
+# One-off closures (national days of mourning, weather, 9/11)
+SPECIAL_CLOSURES = {
+    date(1994, 4, 27): "Nixon day of mourning",
+    date(2001, 9, 11): "September 11",
+    date(2001, 9, 12): "September 11",
+    date(2001, 9, 13): "September 11",
+    date(2001, 9, 14): "September 11",
+    date(2004, 6, 11): "Reagan day of mourning",
+    date(2007, 1, 2): "Ford day of mourning",
+    date(2012, 10, 29): "Hurricane Sandy",
+    date(2012, 10, 30): "Hurricane Sandy",
+    date(2018, 12, 5): "G.H.W. Bush day of mourning",
+    date(2025, 1, 9): "Carter day of mourning",
+}
+
+
+# ---------------------------------------------------------------------
+# Holiday rules
+# ---------------------------------------------------------------------
+def _nth_weekday(year: int, month: int, weekday: int, n: int) -> date:
+    """n-th (1-based) `weekday` (Monday=0) of the month; n=-1 for the last."""
+    if n > 0:
+        first = date(year, month, 1)
+        return first + timedelta(days=(weekday - first.weekday()) % 7 + 7 * (n - 1))
+    last = date(year, month + 1, 1) - timedelta(days=1) if month < 12 else date(year, 12, 31)
+    return last - timedelta(days=(last.weekday() - weekday) % 7)
+
+
+def _easter(year: int) -> date:
+    """Gregorian Easter Sunday (anonymous Gregorian algorithm)."""
+    a = year % 19
+    b, c = divmod(year, 100)
+    d, e = divmod(b, 4)
+    f = (b + 8) // 25
+    g = (b - f + 1) // 3
+    h = (19 * a + b - d - g + 15) % 30
+    i, k = divmod(c, 4)
+    l = (32 + 2 * e + 2 * i - h - k) % 7
+    m = (a + 11 * h + 22 * l) // 451
+    month, day = divmod(h + l - 7 * m + 114, 31)
+    return date(year, month, day + 1)
+
+
+def _observed(day: date) -> date:
+    """Saturday holidays move to Friday, Sunday holidays to Monday."""
+    if day.weekday() == 5:
+        return day - timedelta(days=1)
+    if day.weekday() == 6:
+        return day + timedelta(days=1)
+    return day
+
+
+def holidays(year: int) -> Dict[date, str]:
+    """Full-day market closures in `year`, {date: name}."""
+    days = {}
+
+    # New Year's Day on a Saturday is not observed on the Friday before
+    new_year = date(year, 1, 1)
+    if new_year.weekday() != 5:
+        days[_observed(new_year)] = "New Year's Day"
+    if year >= 1998:
+        days[_nth_weekday(year, 1, 0, 3)] = "Martin Luther King Jr. Day"
+    days[_nth_weekday(year, 2, 0, 3)] = "Washington's Birthday"
+    days[_easter(year) - timedelta(days=2)] = "Good Friday"
+    days[_nth_weekday(year, 5, 0, -1)] = "Memorial Day"
+    if year >= 2022:
+        days[_observed(date(year, 6, 19))] = "Juneteenth"
+    days[_observed(date(year, 7, 4))] = "Independence Day"
+    days[_nth_weekday(year, 9, 0, 1)] = "Labor Day"
+    days[_nth_weekday(year, 11, 3, 4)] = "Thanksgiving Day"
+    days[_observed(date(year, 12, 25))] = "Christmas Day"
+
+    for day, name in SPECIAL_CLOSURES.items():
+        if day.year == year:
+            days[day] = name
+    return days
+
+
+def early_closes(year: int) -> Dict[date, str]:
+    """13:00 closes in `year`, {date: reason}."""
+    days = {}
+    # July 3rd when Independence Day falls on Tuesday to Friday
+    july3 = date(year, 7, 3)
+    if july3.weekday() <= 3:
+        days[july3] = "Independence Day eve"
+    days[_nth_weekday(year, 11, 3, 4) + timedelta(days=1)] = "Day after Thanksgiving"
+    # Christmas Eve when it is a Monday to Thursday session
+    christmas_eve = date(year, 12, 24)
+    if christmas_eve.weekday() <= 3:
+        days[christmas_eve] = "Christmas Eve"
+    return days
+
+
+# ---------------------------------------------------------------------
+# Calendar
+# ---------------------------------------------------------------------
+def _to_day(value: DateLike) -> np.datetime64:
+    if isinstance(value, datetime):
+        value = value.date()
+    return np.datetime64(value, "D")
+
+
+def _to_days(values: Iterable[DateLike]) -> np.ndarray:
+    return np.asarray(
+        [v.date() if isinstance(v, datetime) else v for v in values], dtype="datetime64[D]"
+    )
+
+
+def _to_str(days: np.ndarray) -> List[str]:
+    return np.datetime_as_string(days, unit="D").tolist()
+
+
+class TradingCalendar:
+    """
+    NYSE sessions for the years start_year..end_year.
+
+    All arithmetic runs on one np.busdaycalendar (Monday to Friday minus the
+    holidays), so counting or listing sessions over decades is a single
+    vectorized call. Dates are accepted as 'YYYY-MM-DD' strings, date
+    objects or datetime64[D]; sessions are returned as strings, matching
+    the prices.date column.
+    """
+
+    def __init__(self, start_year: int = FIRST_YEAR, end_year: Optional[int] = None):
+        self.start_year = start_year
+        self.end_year = end_year or date.today().year + 2
+        self.holidays: Dict[date, str] = {}
+        self.early_closes: Dict[date, str] = {}
+        for year in range(self.start_year, self.end_year + 1):
+            self.holidays.update(holidays(year))
+            self.early_closes.update(early_closes(year))
+        self.early_closes = {d: r for d, r in self.early_closes.items() if d not in self.holidays}
+        self.busdaycal = np.busdaycalendar(
+            weekmask="1111100", holidays=sorted(self.holidays)
+        )
+
+    def _check(self, *days: np.datetime64) -> None:
+        for day in days:
+            year = day.astype(object).year
+            if not self.start_year <= year <= self.end_year:
+                raise ValueError(
+                    f"{day} is outside the calendar range {self.start_year}-{self.end_year}"
+                )
+
+    # -----------------------------------------------------------------
+    # Single dates
+    # -----------------------------------------------------------------
+    def is_session(self, day: DateLike) -> bool:
+        day = _to_day(day)
+        self._check(day)
+        return bool(np.is_busday(day, busdaycal=self.busdaycal))
+
+    def close_time(self, day: DateLike) -> Optional[str]:
+        """Closing time (exchange local) of a session, None for non-sessions."""
+        if not self.is_session(day):
+            return None
+        return EARLY_CLOSE if _to_day(day).astype(object) in self.early_closes else REGULAR_CLOSE
+
+    def offset(self, day: DateLike, n: int) -> str:
+        """
+        The session n sessions after `day` (n < 0: before), counting from
+        the last session <= day. offset(d, 0) is that session itself and
+        offset(d, -21) the session 21 trading days earlier.
+        """
+        day = _to_day(day)
+        self._check(day)
+        return str(np.busday_offset(day, n, roll="backward", busdaycal=self.busdaycal))
+
+    def previous_session(self, day: DateLike) -> str:
+        """Last session strictly before `day`."""
+        return str(np.busday_offset(_to_day(day) - 1, 0, roll="backward", busdaycal=self.busdaycal))
+
+    def next_session(self, day: DateLike) -> str:
+        """First session strictly after `day`."""
+        return str(np.busday_offset(_to_day(day) + 1, 0, roll="forward", busdaycal=self.busdaycal))
+
+    # -----------------------------------------------------------------
+    # Ranges
+    # -----------------------------------------------------------------
+    def session_count(self, start: DateLike, end: DateLike) -> int:
+        """Number of sessions in [start, end]."""
+        start, end = _to_day(start), _to_day(end)
+        self._check(start, end)
+        return int(np.busday_count(start, end + 1, busdaycal=self.busdaycal))
+
+    def sessions(self, start: DateLike, end: DateLike) -> List[str]:
+        """All sessions in [start, end], in order."""
+        start, end = _to_day(start), _to_day(end)
+        if end < start:
+            return []
+        self._check(start, end)
+        days = np.arange(start, end + 1, dtype="datetime64[D]")
+        return _to_str(days[np.is_busday(days, busdaycal=self.busdaycal)])
+
+    def is_session_array(self, days: Iterable[DateLike]) -> np.ndarray:
+        """Vectorized is_session."""
+        return np.is_busday(_to_days(days), busdaycal=self.busdaycal)
+
+    def missing_sessions(
+        self,
+        dates: Iterable[DateLike],
+        start: Optional[DateLike] = None,
+        end: Optional[DateLike] = None,
+    ) -> List[str]:
+        """
+        Sessions in [start, end] that are not in `dates` (by default the
+        span of `dates` itself), i.e. real gaps rather than holidays.
+        """
+        days = _to_days(dates)
+        if start is None or end is None:
+            if not len(days):
+                return []
+            start = days.min() if start is None else start
+            end = days.max() if end is None else end
+        expected = np.asarray(self.sessions(start, end), dtype="datetime64[D]")
+        return _to_str(np.setdiff1d(expected, days, assume_unique=False))
+
+    def non_sessions(self, dates: Iterable[DateLike]) -> List[str]:
+        """Entries of `dates` that fall on a weekend or market holiday."""
+        days = _to_days(dates)
+        return _to_str(days[~np.is_busday(days, busdaycal=self.busdaycal)])
+
+
+@lru_cache(maxsize=1)
+def get_calendar() -> TradingCalendar:
+    """Shared default calendar (FIRST_YEAR through two years from now)."""
+    return TradingCalendar()
@@ -1,7 +1,9 @@
 # update_breadth_db.py
+import argparse
 import sqlite3
-from collections import deque, defaultdict
-from typing import Dict, List, Tuple
+from functools import partial
+from itertools import chain
+from typing import Dict, List, Optional, Tuple
 import os
 
 try:
@@ -11,19 +13,43 @@ except:
     TQDM_AVAILABLE = False
     
 
+from price_cache import PriceCache, add_price_cache_arguments, price_cache_from_args
+from price_reader import ensure_date_index, iter_symbol_prices
+from breadth_loop import BreadthPass
+from breadth_state import (
+    BREADTH_COLUMNS,
+    SymbolState,
+    create_state_table,
+    load_states,
+    save_group_spans,
+    save_states,
+)
+from bulk_writer import BulkWriter, connect_wal
+from db_publish import current_path
+from breadth_stats import GroupStats, price_dates
 from utils import (
     STOCKS_LISTS_DB,
     get_all_sectors,
     get_all_lists,
     build_ticker_memberships,
+    build_membership_matrix,
+    ticker_group_ids,
 )
 
 STOCKS_PRICES_DB = "../data/stocks.db"
 BREADTH_DB = "../data/breadth.db"
 
-# 52 weeks ~ 252 trading days
-WINDOW_52W = 252
-MA_WINDOWS = [5, 10, 20, 50, 200]
+INSERT_BREADTH_SQL = """
+    INSERT OR REPLACE INTO breadth (
+        group_id, date,
+        total,
+        adv, dec,
+        new_high_52w, new_low_52w,
+        above_ma5, above_ma10, above_ma20, above_ma50, above_ma200,
+        spike_up, spike_down,
+        ad_value, ema19, ema39, mcclellan
+    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
 
 
 # ---------------------------------------------------------------------
@@ -34,7 +60,7 @@ def ensure_breadth_db(db_path: str = BREADTH_DB) -> None:
     Ensure breadth.db exists and has the correct schema. 
     Does NOT delete or recreate the DB.
     """
-    conn = sqlite3.connect(db_path)
+    conn = connect_wal(db_path)
     try:
         cur = conn.cursor()
 
@@ -78,11 +104,59 @@ def ensure_breadth_db(db_path: str = BREADTH_DB) -> None:
             """
         )
 
+        # per-symbol rolling state (resume point of process_prices)
+        create_state_table(cur)
+
         conn.commit()
     finally:
         conn.close()
 
 
+def load_symbol_states(db_path: str = BREADTH_DB) -> Dict[str, SymbolState]:
+    conn = connect_wal(db_path)
+    try:
+        return load_states(conn)
+    finally:
+        conn.close()
+
+
+def save_symbol_states(states: Dict[str, SymbolState], db_path: str = BREADTH_DB) -> None:
+    conn = connect_wal(db_path)
+    try:
+        save_states(conn, (state.to_row(symbol) for symbol, state in states.items()))
+    finally:
+        conn.close()
+
+
+def save_symbol_groups(
+    states: Dict[str, SymbolState],
+    loaded: Dict[str, Optional[str]],
+    last_dates: Dict[int, str],
+    ticker_groups: Dict[str, List[int]],
+    db_path: str = BREADTH_DB,
+) -> None:
+    """
+    Record the rows just counted for the advanced symbols: a group got a
+    symbol's rows after its previous state (`loaded`) and after the
+    group's last breadth date before this run (`last_dates`).
+    """
+    rows = []
+    for symbol, state in states.items():
+        if state.last_date == loaded.get(symbol):
+            continue
+        for gid in ticker_groups.get(symbol, []):
+            after = max(
+                (d for d in (loaded.get(symbol), last_dates.get(gid)) if d is not None), default=None
+            )
+            if after is None or after < state.last_date:
+                rows.append((symbol, gid, after, state.last_date))
+    conn = connect_wal(db_path)
+    try:
+        save_group_spans(conn, rows)
+    finally:
+        conn.close()
+
+
 # ---------------------------------------------------------------------
 # 2) Same helpers as your original script
 # ---------------------------------------------------------------------
@@ -93,7 +167,7 @@ def insert_groups(
     Ensure all sectors and lists exist in groups table.
     Return mapping: (type, name) -> group_id.
     """
-    conn = sqlite3.connect(db_path)
+    conn = connect_wal(db_path)
     try:
         cur = conn.cursor()
         mapping: Dict[Tuple[str, str], int] = {}
@@ -125,198 +199,57 @@ def insert_groups(
         conn.close()
 
 
-def default_stats() -> Dict[str, int]:
-    return {
-        "total": 0,
-        "adv": 0,
-        "dec": 0,
-        "new_high_52w": 0,
-        "new_low_52w": 0,
-        "above_ma5": 0,
-        "above_ma10": 0,
-        "above_ma20": 0,
-        "above_ma50": 0,
-        "above_ma200": 0,
-        "spike_up": 0,
-        "spike_down": 0,
-    }
-
-
 def process_prices(
     group_id_map: Dict[Tuple[str, str], int],
     ticker_to_sector: Dict[str, str],
     ticker_to_lists: Dict[str, List[str]],
-) -> Dict[int, Dict[str, Dict[str, int]]]:
+    states: Dict[str, SymbolState],
+    since: Optional[str] = None,
+    cache: Optional[PriceCache] = None,
+) -> GroupStats:
     """
     Build aggregated stats per group_id per date from stocks.prices.
-    This computes full history, but we will only INSERT the dates that
-    are not already present in breadth.db in the incremental step.
+
+    Symbols with a saved rolling state resume from it and only their price
+    rows after state.last_date are processed; symbols without one are
+    processed over their full history. `states` is updated in place.
+    Counts are kept only for dates after `since` (all dates if None), the
+    oldest date any group may still be missing in breadth.db. Price rows
+    come from `cache` when given.
     """
     conn = sqlite3.connect(STOCKS_PRICES_DB)
     try:
-        cur = conn.cursor()
-
-        cur.execute("SELECT DISTINCT symbol FROM prices ORDER BY symbol")
-        symbols = [row[0] for row in cur.fetchall()]
+        ensure_date_index(conn)
 
-        group_stats: Dict[int, Dict[str, Dict[str, int]]] = defaultdict(
-            lambda: defaultdict(default_stats)
+        # group x symbol membership; symbols outside every group are not scanned
+        group_ids, symbols, membership = build_membership_matrix(
+            group_id_map, ticker_to_sector, ticker_to_lists
+        )
+        group_stats = GroupStats(
+            group_ids, price_dates(conn, after=since), symbols, membership
         )
 
-        iterator = tqdm(symbols, desc="Processing symbols") if TQDM_AVAILABLE else symbols
-
-        for symbol in iterator:
-            sector = ticker_to_sector.get(symbol)
-            lists_for_symbol = ticker_to_lists.get(symbol, [])
-
-            if sector is None and not lists_for_symbol:
-                continue
-
-            group_ids = []
-            if sector is not None and ("sector", sector) in group_id_map:
-                group_ids.append(group_id_map[("sector", sector)])
-            for list_name in lists_for_symbol:
-                key = ("list", list_name)
-                if key in group_id_map:
-                    group_ids.append(group_id_map[key])
-
-            if not group_ids:
-                continue
-
-            cur.execute(
-                """
-                SELECT date, open, high, low, close, volume
-                FROM prices
-                WHERE symbol = ?
-                ORDER BY date
-                """,
-                (symbol,),
-            )
-            rows = cur.fetchall()
-            if not rows:
-                continue
-
-            prev_close = None
-            window_52w = deque(maxlen=WINDOW_52W - 1)
-
-            ma_windows: Dict[int, Tuple[deque, float]] = {}
-            for w in MA_WINDOWS:
-                ma_windows[w] = (deque(maxlen=w), 0.0)
-
-            vol_window = deque(maxlen=20)  # previous 20 days
-
-            for date, o, h, l, c, v in rows:
-                close = float(c)
-                high = float(h)
-                low = float(l)
-                vol = float(v)
-
-                # --- advance / decline ---
-                is_adv = False
-                is_dec = False
-                pct_change = None
-                if prev_close is not None:
-                    pct_change = (close - prev_close) / prev_close
-                    is_adv = close > prev_close
-                    is_dec = close < prev_close
-
-                # --- 52-week highs/lows on previous 251 closes ---
-                is_new_high_52w = False
-                is_new_low_52w = False
-                if len(window_52w) >= WINDOW_52W - 1:
-                    max_prev = max(window_52w)
-                    min_prev = min(window_52w)
-                    is_new_high_52w = close > max_prev
-                    is_new_low_52w = close < min_prev
-
-                window_52w.append(close)
-
-                # --- moving averages ---
-                above_ma_flags = {w: False for w in MA_WINDOWS}
-                for w in MA_WINDOWS:
-                    dq, s = ma_windows[w]
-                    oldest = dq[0] if len(dq) == dq.maxlen else None
-
-                    dq.append(close)
-                    s += close
-                    if oldest is not None:
-                        s -= oldest
-                    ma_windows[w] = (dq, s)
-
-                    if len(dq) == w:
-                        ma = s / w
-                        if close > ma:
-                            above_ma_flags[w] = True
-
-                # --- volume breakout vs previous 20 days ---
-                avg_vol_20 = None
-                if len(vol_window) == vol_window.maxlen:
-                    avg_vol_20 = sum(vol_window) / len(vol_window)
-
-                vol_window.append(vol)
-
-                # --- close position in daily range ---
-                in_top_50 = False
-                in_bottom_50 = False
-                if high > low:
-                    mid = (high + low) / 2.0
-                    in_top_50 = close >= mid
-                    in_bottom_50 = close <= mid
-
-                # --- spike up / down ---
-                is_spike_up = False
-                is_spike_down = False
-                if (
-                    pct_change is not None
-                    and avg_vol_20 is not None
-                    and high > low
-                ):
-                    if (
-                        pct_change >= 0.015
-                        and vol >= 1.25 * avg_vol_20
-                        and in_top_50
-                    ):
-                        is_spike_up = True
-
-                    if (
-                        pct_change <= -0.015
-                        and vol >= 1.25 * avg_vol_20
-                        and in_bottom_50
-                    ):
-                        is_spike_down = True
-
-                # --- aggregate to all groups for this symbol ---
-                for gid in group_ids:
-                    st = group_stats[gid][date]
-
-                    st["total"] += 1
-                    if is_adv:
-                        st["adv"] += 1
-                    if is_dec:
-                        st["dec"] += 1
-                    if is_new_high_52w:
-                        st["new_high_52w"] += 1
-                    if is_new_low_52w:
-                        st["new_low_52w"] += 1
-
-                    if above_ma_flags[5]:
-                        st["above_ma5"] += 1
-                    if above_ma_flags[10]:
-                        st["above_ma10"] += 1
-                    if above_ma_flags[20]:
-                        st["above_ma20"] += 1
-                    if above_ma_flags[50]:
-                        st["above_ma50"] += 1
-                    if above_ma_flags[200]:
-                        st["above_ma200"] += 1
-
-                    if is_spike_up:
-                        st["spike_up"] += 1
-                    if is_spike_down:
-                        st["spike_down"] += 1
-
-                prev_close = close
+        # Ordered scans of prices, one symbol's history at a time: the new
+        # rows of symbols with a saved state, then full history for the rest
+        resumed = {s: states[s].last_date for s in symbols if s in states}
+        fresh = [s for s in symbols if s not in states]
+        scan = cache.iter_symbol_prices if cache is not None else partial(iter_symbol_prices, conn)
+        scans = []
+        if resumed:
+            scans.append(scan(BREADTH_COLUMNS, after=resumed))
+        if fresh:
+            scans.append(scan(BREADTH_COLUMNS, symbols=fresh))
+        stream = chain.from_iterable(scans)
+        iterator = (
+            tqdm(stream, total=len(symbols), desc="Processing symbols")
+            if TQDM_AVAILABLE
+            else stream
+        )
 
+        breadth = BreadthPass(group_stats, states, since)
+        for symbol, cols in iterator:
+            breadth.add(symbol, cols)
+        breadth.finish()
         return group_stats
     finally:
         conn.close()
@@ -326,7 +259,7 @@ def process_prices(
 # 3) Incremental McClellan + insert
 # ---------------------------------------------------------------------
 def compute_mcclellan_and_insert_incremental(
-    group_stats: Dict[int, Dict[str, Dict[str, int]]],
+    group_stats: GroupStats,
     db_path: str = BREADTH_DB,
 ) -> None:
     """
@@ -336,18 +269,22 @@ def compute_mcclellan_and_insert_incremental(
       - Only insert rows for dates > last_date.
       - Continue EMA19/EMA39 from the last saved values so that 
         McClellan is continuous.
+
+    The rows are written date by date, one transaction per date, so the
+    app never reads a date that only some groups have yet.
     """
-    conn = sqlite3.connect(db_path)
+    conn = connect_wal(db_path)
     try:
         cur = conn.cursor()
 
         alpha19 = 2.0 / (19.0 + 1.0)
         alpha39 = 2.0 / (39.0 + 1.0)
 
-        items = list(group_stats.items())
-        iterator = tqdm(items, desc="Updating McClellan") if TQDM_AVAILABLE else items
+        group_ids = group_stats.group_ids
+        iterator = tqdm(group_ids, desc="Updating McClellan") if TQDM_AVAILABLE else group_ids
 
-        for gid, date_dict in iterator:
+        rows_by_date: Dict[str, List[tuple]] = {}
+        for gid in iterator:
             # get last stored date + EMA for this group
             cur.execute(
                 """
@@ -366,19 +303,20 @@ def compute_mcclellan_and_insert_incremental(
                 last_date, ema19, ema39 = None, None, None
 
             # keep only dates > last_date (or all if no last_date)
-            if last_date is None:
-                dates = sorted(date_dict.keys())
-            else:
-                dates = sorted(d for d in date_dict.keys() if d > last_date)
+            active = group_stats.active(gid)
+            if last_date is not None:
+                active = active[group_stats.dates[active] > last_date]
 
-            if not dates:
+            if not len(active):
                 continue  # nothing new for this group
 
-            for d in dates:
-                st = date_dict[d]
-                total = st["total"]
-                adv = st["adv"]
-                dec = st["dec"]
+            dates = group_stats.dates[active].tolist()
+            counts = group_stats.counts[group_stats.group_index[gid], active].tolist()
+
+            for d, st in zip(dates, counts):
+                # st follows STAT_KEYS: total, adv, dec, ...
+                adv = st[1]
+                dec = st[2]
                 ad_value = adv - dec
 
                 # If no EMA yet (fresh group or old rows without EMAs),
@@ -395,69 +333,103 @@ def compute_mcclellan_and_insert_incremental(
 
                 mcclellan = ema19 - ema39
 
-                cur.execute(
-                    """
-                    INSERT OR REPLACE INTO breadth (
-                        group_id, date,
-                        total,
-                        adv, dec,
-                        new_high_52w, new_low_52w,
-                        above_ma5, above_ma10, above_ma20, above_ma50, above_ma200,
-                        spike_up, spike_down,
-                        ad_value, ema19, ema39, mcclellan
-                    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                    """,
-                    (
-                        gid,
-                        d,
-                        total,
-                        adv,
-                        dec,
-                        st["new_high_52w"],
-                        st["new_low_52w"],
-                        st["above_ma5"],
-                        st["above_ma10"],
-                        st["above_ma20"],
-                        st["above_ma50"],
-                        st["above_ma200"],
-                        st["spike_up"],
-                        st["spike_down"],
-                        ad_value,
-                        ema19,
-                        ema39,
-                        mcclellan,
-                    ),
+                rows_by_date.setdefault(d, []).append(
+                    (gid, d, *st, ad_value, ema19, ema39, mcclellan)
                 )
 
-        conn.commit()
+        with BulkWriter(conn) as writer:
+            for d in sorted(rows_by_date):
+                writer.insert(INSERT_BREADTH_SQL, rows_by_date[d])
+                writer.commit()
     finally:
         conn.close()
 
 
+def group_last_dates(db_path: str = BREADTH_DB) -> Dict[int, str]:
+    """{group_id: last breadth date} of the groups with rows."""
+    conn = connect_wal(db_path)
+    try:
+        return dict(conn.execute("SELECT group_id, MAX(date) FROM breadth GROUP BY group_id"))
+    finally:
+        conn.close()
+
+
+def oldest_missing_date(group_ids: List[int], db_path: str = BREADTH_DB) -> Optional[str]:
+    """
+    Last breadth date of the group that is furthest behind, i.e. only dates
+    after it can still be missing. None if some group has no rows at all.
+    """
+    last_dates = group_last_dates(db_path)
+    if any(gid not in last_dates for gid in group_ids):
+        return None
+    return min((last_dates[gid] for gid in group_ids), default=None)
+
+
 # ---------------------------------------------------------------------
 # 4) Main entry point
 # ---------------------------------------------------------------------
-def main():
-    # 1. Ensure breadth DB + tables exist (no deletion)
-    ensure_breadth_db()
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Incrementally update breadth.db.")
+    parser.add_argument(
+        "--rebuild-state",
+        action="store_true",
+        help="Ignore the saved per-symbol state and reprocess the full price history "
+        "(e.g. after older price rows were corrected or backfilled).",
+    )
+    add_price_cache_arguments(parser)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    # 1. Ensure breadth DB + tables exist (no deletion); updated in place
+    #    in its live version (see db_publish.py)
+    db_path = current_path(BREADTH_DB)
+    ensure_breadth_db(db_path)
 
     # 2. Get sectors & lists from stocks_lists.db
     sectors = get_all_sectors(STOCKS_LISTS_DB)
     lists_ = get_all_lists(STOCKS_LISTS_DB)
 
     # 3. Ensure groups exist, get mapping
-    group_id_map = insert_groups(sectors, lists_)
+    group_id_map = insert_groups(sectors, lists_, db_path)
 
     # 4. Build ticker -> sector / lists membership
     ticker_to_sector, ticker_to_lists = build_ticker_memberships(STOCKS_LISTS_DB)
 
-    # 5. Process prices & aggregate per group/date (full history)
-    group_stats = process_prices(group_id_map, ticker_to_sector, ticker_to_lists)
+    # 5. Process new price rows & aggregate per group/date
+    states = {} if args.rebuild_state else load_symbol_states(db_path)
+    loaded = {symbol: state.last_date for symbol, state in states.items()}
+    since = oldest_missing_date(list(group_id_map.values()), db_path)
+    conn = sqlite3.connect(STOCKS_PRICES_DB)
+    try:
+        cache = price_cache_from_args(args, conn)
+    finally:
+        conn.close()
+    group_stats = process_prices(
+        group_id_map, ticker_to_sector, ticker_to_lists, states, since=since, cache=cache
+    )
 
     # 6. Incrementally compute McClellan and insert only missing dates
-    compute_mcclellan_and_insert_incremental(group_stats)
-
-    print("Breadth database updated in", BREADTH_DB)
+    last_dates = group_last_dates(db_path)
+    compute_mcclellan_and_insert_incremental(group_stats, db_path)
+
+    # 7. Save the advanced rolling states only once the breadth rows are
+    #    committed, and the rows they added to each group
+    save_symbol_states(
+        {s: state for s, state in states.items() if state.last_date != loaded.get(s)},
+        db_path,
+    )
+    save_symbol_groups(
+        states,
+        loaded,
+        last_dates,
+        ticker_group_ids(group_id_map, ticker_to_sector, ticker_to_lists),
+        db_path,
+    )
+
+    print("Breadth database updated in", db_path)
 
 
 if __name__ == "__main__":
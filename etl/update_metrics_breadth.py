@@ -0,0 +1,235 @@
+#!/usr/bin/env python3
+# update_metrics_breadth.py
+# Metrics and breadth in one pass over prices: the nightly replacement for
+# build_metrics.py --incremental followed by update_breadth.py, and with
+# --rebuild for build_metrics.py --backfill followed by build_breadth.py.
+#
+#   python update_metrics_breadth.py                  # dates not in metrics.db / breadth.db yet
+#   python update_metrics_breadth.py --rebuild        # both databases from scratch
+#   python update_metrics_breadth.py --price-cache
+#
+# The metrics engine scans prices block by block (metrics_engine.py); the
+# breadth loop rides on that scan as a visitor, so every price row of the
+# new dates is read and decoded once for both outputs. Breadth rows before
+# the first new metrics date (symbols whose saved state is further behind,
+# or no new metrics dates at all) are read in a catch-up scan first.
+#
+# --rebuild builds both databases as new versions and publishes them once
+# complete (db_publish.py); otherwise the live versions are updated in place.
+
+import argparse
+import os
+import sqlite3
+import time
+from contextlib import ExitStack
+from functools import partial
+from itertools import chain
+from typing import Callable, Optional
+
+from breadth_loop import BreadthPass
+from breadth_state import BREADTH_COLUMNS
+from breadth_stats import GroupStats, price_dates
+from build_breadth import compute_mcclellan_and_insert, create_breadth_db
+from build_metrics import (
+    INSERT_METRICS_SQL,
+    METRICS_INDEXES,
+    create_metrics_table,
+    warn_session_gaps,
+)
+from bulk_writer import BulkWriter, connect_wal
+from db_publish import current_path, shadow_build
+from metrics_engine import iter_metrics_by_date
+from price_cache import add_price_cache_arguments, price_cache_from_args
+from price_reader import date_before, date_bounds, ensure_date_index, iter_symbol_prices, next_date
+from update_breadth import (
+    compute_mcclellan_and_insert_incremental,
+    ensure_breadth_db,
+    group_last_dates,
+    insert_groups,
+    load_symbol_states,
+    oldest_missing_date,
+    save_symbol_groups,
+    save_symbol_states,
+)
+from utils import (
+    STOCKS_LISTS_DB,
+    build_membership_matrix,
+    build_ticker_memberships,
+    get_all_lists,
+    get_all_sectors,
+    ticker_group_ids,
+)
+
+STOCKS_DB = "../data/stocks.db"
+METRICS_DB = "../data/metrics.db"
+BREADTH_DB = "../data/breadth.db"
+
+# Metrics dates per intermediate commit of a rebuild
+COMMIT_DATES = 21
+
+
+def catch_up(breadth: BreadthPass, scan: Callable, until: str) -> None:
+    """
+    Advance, up to `until`, the breadth symbols whose state stops before
+    it: the new rows of symbols with a state, the full history of the rest.
+    """
+    states = breadth.states
+    symbols = list(breadth.group_stats.symbol_index)
+    behind = {s: states[s].last_date for s in symbols if s in states and states[s].last_date < until}
+    fresh = [s for s in symbols if s not in states]
+    scans = []
+    if behind:
+        scans.append(scan(BREADTH_COLUMNS, end_date=until, after=behind))
+    if fresh:
+        scans.append(scan(BREADTH_COLUMNS, end_date=until, symbols=fresh))
+    for symbol, cols in chain.from_iterable(scans):
+        breadth.add(symbol, cols)
+
+
+def metrics_start(
+    prices_conn: sqlite3.Connection,
+    metrics_conn: sqlite3.Connection,
+    first_date: str,
+    latest_date: str,
+    rebuild: bool,
+) -> Optional[str]:
+    """First date to compute metrics for, None if metrics.db is up to date."""
+    if rebuild:
+        return first_date
+    last_metrics_date = metrics_conn.execute("SELECT MAX(date) FROM metrics;").fetchone()[0]
+    if last_metrics_date is None:
+        return latest_date
+    return next_date(prices_conn, last_metrics_date)
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Update metrics.db and breadth.db from one pass over stocks.db."
+    )
+    parser.add_argument(
+        "--rebuild",
+        action="store_true",
+        help="Recreate both databases over the full price history "
+        "(metrics for every date, fresh breadth.db and rolling states).",
+    )
+    add_price_cache_arguments(parser)
+    return parser.parse_args(argv)
+
+
+def update(args: argparse.Namespace, metrics_db: str, breadth_db: str) -> None:
+    t0 = time.time()
+
+    # 1. breadth.db, groups and the saved rolling states
+    if args.rebuild:
+        create_breadth_db(breadth_db)
+    else:
+        ensure_breadth_db(breadth_db)
+    group_id_map = insert_groups(
+        get_all_sectors(STOCKS_LISTS_DB), get_all_lists(STOCKS_LISTS_DB), breadth_db
+    )
+    ticker_to_sector, ticker_to_lists = build_ticker_memberships(STOCKS_LISTS_DB)
+    states = {} if args.rebuild else load_symbol_states(breadth_db)
+    loaded = {symbol: state.last_date for symbol, state in states.items()}
+    since = None if args.rebuild else oldest_missing_date(list(group_id_map.values()), breadth_db)
+
+    prices_conn = sqlite3.connect(STOCKS_DB)
+    metrics_conn = sqlite3.connect(metrics_db) if args.rebuild else connect_wal(metrics_db)
+    try:
+        ensure_date_index(prices_conn)
+        first_date, latest_date = date_bounds(prices_conn)
+        if latest_date is None:
+            print("No data in prices, nothing to do.")
+            return
+
+        create_metrics_table(metrics_conn.cursor(), drop=args.rebuild)
+        metrics_conn.commit()
+        start_date = metrics_start(prices_conn, metrics_conn, first_date, latest_date, args.rebuild)
+
+        cache = price_cache_from_args(args, prices_conn)
+        scan = cache.iter_symbol_prices if cache is not None else partial(iter_symbol_prices, prices_conn)
+
+        group_ids, symbols, membership = build_membership_matrix(
+            group_id_map, ticker_to_sector, ticker_to_lists
+        )
+        group_stats = GroupStats(group_ids, price_dates(prices_conn, after=since), symbols, membership)
+        breadth = BreadthPass(group_stats, states, since)
+
+        # 2. Breadth rows before the dates the metrics scan reads
+        until = latest_date if start_date is None else date_before(prices_conn, start_date)
+        if until is not None:
+            catch_up(breadth, scan, until)
+
+        # 3. Metrics, with the breadth loop visiting the same scan
+        total_rows = 0
+        dates_done = 0
+        if start_date is None:
+            print("[INFO] Metrics already up to date.")
+        else:
+            print(f"[INFO] Computing metrics and breadth from {start_date} to {latest_date}...")
+            warn_session_gaps(prices_conn, start_date, latest_date)
+            with BulkWriter(metrics_conn, bulk=args.rebuild, indexes=METRICS_INDEXES) as writer:
+                for date, rows in iter_metrics_by_date(
+                    prices_conn,
+                    start_date,
+                    latest_date,
+                    cache=cache,
+                    columns=BREADTH_COLUMNS,
+                    visit=breadth.add,
+                ):
+                    writer.insert(INSERT_METRICS_SQL, rows)
+                    total_rows += len(rows)
+                    dates_done += 1
+                    if not args.rebuild:
+                        writer.commit()  # live table: a transaction per date, never half of one
+                    elif dates_done % COMMIT_DATES == 0:
+                        writer.commit()
+                        print(f"[INFO] Progress: {date} ({total_rows} rows)", end="\r", flush=True)
+            if args.rebuild:
+                print()  # newline after progress
+        breadth.finish()
+    finally:
+        prices_conn.close()
+        metrics_conn.close()
+
+    # 4. McClellan series and breadth rows, then the advanced rolling states
+    #    and the rows they added to each group
+    last_dates = group_last_dates(breadth_db)
+    if args.rebuild:
+        compute_mcclellan_and_insert(group_stats, breadth_db)
+    else:
+        compute_mcclellan_and_insert_incremental(group_stats, breadth_db)
+    save_symbol_states(
+        {s: state for s, state in states.items() if state.last_date != loaded.get(s)},
+        breadth_db,
+    )
+    save_symbol_groups(
+        states,
+        loaded,
+        last_dates,
+        ticker_group_ids(group_id_map, ticker_to_sector, ticker_to_lists),
+        breadth_db,
+    )
+
+    print(
+        f"[INFO] Done in {time.time() - t0:.1f}s. Metrics rows for {dates_done} date(s): "
+        f"{total_rows}; breadth updated in {breadth_db}"
+    )
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if not os.path.exists(STOCKS_DB):
+        raise SystemExit(f"Database file not found: {STOCKS_DB}")
+
+    with ExitStack() as stack:
+        if args.rebuild:
+            # New versions of both databases, published once complete (db_publish.py)
+            metrics_db = stack.enter_context(shadow_build(METRICS_DB))
+            breadth_db = stack.enter_context(shadow_build(BREADTH_DB))
+        else:
+            metrics_db, breadth_db = current_path(METRICS_DB), current_path(BREADTH_DB)
+        update(args, metrics_db, breadth_db)
+
+
+if __name__ == "__main__":
+    main()
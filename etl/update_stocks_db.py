@@ -1,130 +1,245 @@
+import argparse
 import os
 import sqlite3
-import shutil
-import time
 from datetime import datetime, date, timedelta
+from typing import Optional
 from dotenv import load_dotenv
 
-from polygon import RESTClient
+from polygon_fetch import (
+    DEFAULT_BASE_URL,
+    DEFAULT_CONCURRENCY,
+    DEFAULT_MAX_RETRIES,
+    DEFAULT_REQUESTS_PER_MINUTE,
+    FetchResult,
+    PolygonFetcher,
+)
+from fetch_journal import (
+    MAX_SESSION_ATTEMPTS,
+    STATUS_EMPTY,
+    STATUS_FAILED,
+    STATUS_OK,
+    RETRY_STATUSES,
+    create_journal_table,
+    load_journal,
+    record_session,
+    sessions_to_fetch,
+)
+from trading_calendar import get_calendar
+from db_backup import backup_database
+from ingest_policy import add_policy_arguments, policy_from_args
+from price_reader import date_bounds, session_dates
+from response_cache import CACHE_DIR, CACHE_MODES, CACHE_OFF, CACHE_ONLY, CACHE_USE, ResponseCache
 
 
 # ==== CONFIG ====
 DB_PATH = "../data/stocks.db"  # path to your SQLite database
 load_dotenv()
 API_KEY = os.environ.get("POLYGON_API_KEY")
-if not API_KEY:
-    raise SystemExit("POLYGON_API_KEY not set. Please create a .env file with POLYGON_API_KEY=your_key_here")
 
-SLEEP_SECONDS = 12      # to respect Polygon rate limits
-
-
-def backup_db(db_path: str) -> str:
-    """Create a timestamped backup of the DB and return the backup path."""
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    backup_path = f"{os.path.splitext(db_path)[0]}_backup_{timestamp}.db"
-    shutil.copy2(db_path, backup_path)
-    print(f"Backup created: {backup_path}")
-    return backup_path
-
-
-def get_last_date(conn: sqlite3.Connection) -> date:
-    """Return the last available date in prices as a date object."""
-    cur = conn.cursor()
-    cur.execute("SELECT MAX(date) FROM prices")
-    row = cur.fetchone()
-    if not row or row[0] is None:
-        raise RuntimeError("prices table is empty or missing; cannot determine last date.")
-    return datetime.strptime(row[0], "%Y-%m-%d").date()
-
-
-def generate_weekdays(start: date, end: date):
-    """Yield all weekdays between start and end inclusive."""
-    current = start
-    while current <= end:
-        if current.weekday() < 5:  # Monday=0 ... Friday=4
-            yield current
-        current += timedelta(days=1)
-
-
-def main():
-    if API_KEY in ("YOUR_POLYGON_API_KEY", "", None):
-        raise SystemExit("Please set your Polygon API key (API_KEY variable or POLYGON_API_KEY env var).")
+# Rate limit of the Polygon plan (free tier: 5 requests / minute); paid
+# tiers can raise it via POLYGON_REQUESTS_PER_MINUTE or the CLI
+REQUESTS_PER_MINUTE = float(
+    os.environ.get("POLYGON_REQUESTS_PER_MINUTE", DEFAULT_REQUESTS_PER_MINUTE)
+)
+BASE_URL = os.environ.get("POLYGON_BASE_URL", DEFAULT_BASE_URL)
+
+INSERT_PRICES_SQL = """
+    INSERT OR IGNORE INTO prices
+        (symbol, date, open, high, low, close, volume)
+    VALUES (?, ?, ?, ?, ?, ?, ?)
+"""
+
+
+def get_last_date(conn: sqlite3.Connection) -> Optional[date]:
+    """Return the last available date in prices as a date object (None if empty)."""
+    _, last = date_bounds(conn)
+    if last is None:
+        return None
+    return datetime.strptime(last, "%Y-%m-%d").date()
+
+
+def preview(dates, limit: int = 10) -> str:
+    """Comma-separated dates, cut off after `limit`."""
+    more = f" ... (+{len(dates) - limit} more)" if len(dates) > limit else ""
+    return ", ".join(dates[:limit]) + more
+
+
+def first_retry_session(conn: sqlite3.Connection) -> Optional[str]:
+    """Earliest journaled session whose fetch has to be retried."""
+    placeholders = ", ".join("?" for _ in RETRY_STATUSES)
+    return conn.execute(
+        f"SELECT MIN(session) FROM fetch_journal WHERE status IN ({placeholders})",
+        RETRY_STATUSES,
+    ).fetchone()[0]
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Fetch missing daily bars from Polygon into stocks.db.")
+    parser.add_argument(
+        "--requests-per-minute",
+        type=float,
+        default=REQUESTS_PER_MINUTE,
+        help=f"Token bucket refill rate (default: {REQUESTS_PER_MINUTE:g})",
+    )
+    parser.add_argument(
+        "--burst",
+        type=float,
+        default=1.0,
+        help="Token bucket capacity, i.e. requests allowed back to back (default: 1)",
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=DEFAULT_CONCURRENCY,
+        help=f"Maximum requests in flight (default: {DEFAULT_CONCURRENCY})",
+    )
+    parser.add_argument(
+        "--max-retries",
+        type=int,
+        default=DEFAULT_MAX_RETRIES,
+        help=f"Retries per day on 429 / 5xx / network errors (default: {DEFAULT_MAX_RETRIES})",
+    )
+    parser.add_argument(
+        "--max-attempts",
+        type=int,
+        default=MAX_SESSION_ATTEMPTS,
+        help="Stop retrying a failed or empty session after this many requests over all runs "
+        f"(default: {MAX_SESSION_ATTEMPTS})",
+    )
+    parser.add_argument(
+        "--base-url",
+        default=BASE_URL,
+        help="API base URL, e.g. a local polygon_stub.py (default: $POLYGON_BASE_URL or Polygon)",
+    )
+    parser.add_argument(
+        "--start",
+        type=date.fromisoformat,
+        help="Also fetch the sessions from this date (YYYY-MM-DD) that have no prices yet, "
+        "e.g. to rebuild an empty stocks.db from the response cache",
+    )
+    parser.add_argument(
+        "--cache",
+        choices=CACHE_MODES,
+        default=CACHE_USE,
+        help="Raw response cache: use = serve hits and store new responses, refresh = always "
+        "fetch and store, only = no requests at all, off (default: use)",
+    )
+    parser.add_argument(
+        "--cache-only",
+        dest="cache",
+        action="store_const",
+        const=CACHE_ONLY,
+        help="Replay the response cache without touching the API (same as --cache only)",
+    )
+    parser.add_argument("--cache-dir", default=CACHE_DIR, help=f"Response cache (default: {CACHE_DIR})")
+    add_policy_arguments(parser)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    # A cache-only replay makes no requests and needs no key
+    if args.cache != CACHE_ONLY and API_KEY in ("YOUR_POLYGON_API_KEY", "", None):
+        raise SystemExit("POLYGON_API_KEY not set. Please create a .env file with POLYGON_API_KEY=your_key_here")
 
     if not os.path.exists(DB_PATH):
         raise SystemExit(f"Database file not found: {DB_PATH}")
 
-    # 1) Backup DB
-    backup_db(DB_PATH)
+    # 1) Backup DB (incremental snapshot, see db_backup.py)
+    backup_database(DB_PATH)
 
     # 2) Connect to DB and get last date
     conn = sqlite3.connect(DB_PATH)
     try:
         last_date = get_last_date(conn)
         print(f"Last date in DB: {last_date}")
-
-        # 3) Compute start and end dates
-        start_date = last_date + timedelta(days=1)
-        today = date.today()
-        end_date = today - timedelta(days=1)  # yesterday
-
-        if start_date > end_date:
-            print("Database is already up to date. No new days to fetch.")
+        if last_date is None and args.start is None:
+            raise SystemExit("prices table is empty; pass --start to fill it from a date on.")
+
+        # 3) Compute the sessions to fetch, up to the last session before
+        #    today (weekends and holidays are skipped): the ones after the
+        #    last date, plus earlier ones whose fetch failed on a previous run
+        create_journal_table(conn)
+        calendar = get_calendar()
+        journal = load_journal(conn)
+        starts = [args.start] if args.start is not None else []
+        if last_date is not None:
+            starts.append(last_date + timedelta(days=1))
+        retry_from = first_retry_session(conn)
+        if retry_from is not None:
+            starts.append(date.fromisoformat(retry_from))
+        start_date = min(starts)
+        end_date = calendar.previous_session(date.today())
+
+        candidates = calendar.sessions(start_date, end_date)
+        have_prices = session_dates(conn, start_date.isoformat())
+        dates, given_up = sessions_to_fetch(journal, candidates, have_prices, args.max_attempts)
+        if given_up:
+            print(
+                f"[WARN] Not retrying {len(given_up)} session(s) after {args.max_attempts} "
+                f"attempts: {preview(given_up)}"
+            )
+        if not dates:
+            print("Database is already up to date. No new sessions to fetch.")
             return
 
-        print(f"Fetching data from {start_date} to {end_date} (weekdays only).")
-
-        client = RESTClient(API_KEY)
-
-        # 4) Loop over each weekday and fetch grouped daily aggs
-        inserted_total = 0
-        for d in generate_weekdays(start_date, end_date):
-            date_str = d.strftime("%Y-%m-%d")
-            print(f"\nFetching grouped daily data for {date_str}...")
-
-            try:
-                grouped = client.get_grouped_daily_aggs(date_str, adjusted=True)
-
-                rows = []
-                for agg in grouped:
-                    rows.append(
-                        (
-                            agg.ticker,           # symbol
-                            date_str,             # date
-                            float(agg.open),      # open
-                            float(agg.high),      # high
-                            float(agg.low),       # low
-                            float(agg.close),     # close
-                            int(agg.volume),      # volume
-                        )
-                    )
-
-                if not rows:
-                    print(f"No data returned for {date_str}.")
-                else:
-                    # Insert rows; open_interest defaults to 0 from schema
-                    conn.executemany(
-                        """
-                        INSERT OR IGNORE INTO prices
-                            (symbol, date, open, high, low, close, volume)
-                        VALUES (?, ?, ?, ?, ?, ?, ?)
-                        """,
-                        rows,
-                    )
-                    conn.commit()
-                    print(f"Inserted {len(rows)} rows for {date_str}.")
-                    inserted_total += len(rows)
-
-                print(f"Sleeping {SLEEP_SECONDS}s to respect rate limits...")
-                time.sleep(SLEEP_SECONDS)
-
-            except Exception as e:
-                # Log error and continue with next day
-                print(f"Error on {date_str}: {e}")
-                # Optional: you might want a shorter sleep after errors
-                time.sleep(2)
-                continue
-
-        print(f"\nDone. Total new rows inserted: {inserted_total}")
+        print(
+            f"Fetching data from {dates[0]} to {dates[-1]} ({len(dates)} sessions, "
+            f"{args.requests_per_minute:g} req/min, concurrency {args.concurrency}, "
+            f"cache: {args.cache})."
+        )
+
+        policy = policy_from_args(args, conn)
+        fetcher = PolygonFetcher(
+            API_KEY or "",
+            base_url=args.base_url,
+            requests_per_minute=args.requests_per_minute,
+            burst=args.burst,
+            concurrency=args.concurrency,
+            max_retries=args.max_retries,
+            cache=ResponseCache(args.cache_dir) if args.cache != CACHE_OFF else None,
+            cache_mode=args.cache,
+        )
+
+        # 4) Fetch concurrently; this callback is the single writer and
+        #    receives the days in date order
+        totals = {"inserted": 0, "dropped": 0, "failed": []}
+
+        def write_day(result: FetchResult) -> None:
+            # Rows and journal entry go into one transaction, so an
+            # interrupted run resumes exactly after the last committed day
+            if not result.ok:
+                print(f"Error on {result.date} after {result.attempts} attempt(s): {result.error}")
+                record_session(conn, result.date, STATUS_FAILED, 0, result.attempts, result.error)
+                totals["failed"].append(result.date)
+            elif not result.rows:
+                print(f"No data returned for {result.date}.")
+                record_session(conn, result.date, STATUS_EMPTY, 0, result.attempts)
+                totals["failed"].append(result.date)
+            else:
+                # Insert the rows the ingest policy keeps; open_interest
+                # defaults to 0 from schema
+                rows, dropped = policy.filter_rows(result.rows)
+                conn.executemany(INSERT_PRICES_SQL, rows)
+                record_session(conn, result.date, STATUS_OK, len(rows), result.attempts)
+                source = " (cache)" if result.cached else ""
+                skipped = f", {dropped} outside the ingest policy" if dropped else ""
+                print(f"Inserted {len(rows)} rows for {result.date}{source}{skipped}.")
+                totals["inserted"] += len(rows)
+                totals["dropped"] += dropped
+            conn.commit()
+
+        fetcher.fetch_all(dates, write_day)
+
+        print(f"\nDone. Total new rows inserted: {totals['inserted']}")
+        if totals["dropped"]:
+            print(f"Rows left out by the ingest policy: {totals['dropped']}")
+        if totals["failed"]:
+            print(
+                f"[WARN] Failed or empty sessions ({len(totals['failed'])}), "
+                f"retried on the next run: {preview(totals['failed'])}"
+            )
 
     finally:
         conn.close()
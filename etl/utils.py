@@ -1,8 +1,16 @@
 # stock_helpers.py
 import sqlite3
-from typing import List, Dict, Tuple, DefaultDict
+from typing import List, Dict, Tuple, DefaultDict, Any
 from collections import defaultdict
 
+import numpy as np
+
+try:
+    from scipy import sparse
+    SCIPY_AVAILABLE = True
+except ImportError:
+    SCIPY_AVAILABLE = False
+
 STOCKS_LISTS_DB = "../data/stocks_lists.db"
 
 
@@ -121,3 +129,67 @@ def build_ticker_memberships(
         return ticker_to_sector, dict(ticker_to_lists)
     finally:
         conn.close()
+
+
+def ticker_group_ids(
+    group_id_map: Dict[Tuple[str, str], int],
+    ticker_to_sector: Dict[str, str],
+    ticker_to_lists: Dict[str, List[str]],
+) -> Dict[str, List[int]]:
+    """
+    ticker -> [group_id, ...] from the output of build_ticker_memberships,
+    for the groups in group_id_map (tickers outside every group are left
+    out). A ticker listed twice in a list appears twice.
+    """
+    groups: DefaultDict[str, List[int]] = defaultdict(list)
+    for ticker in set(ticker_to_sector) | set(ticker_to_lists):
+        sector = ticker_to_sector.get(ticker)
+        if sector is not None and ("sector", sector) in group_id_map:
+            groups[ticker].append(group_id_map[("sector", sector)])
+        for list_name in ticker_to_lists.get(ticker, []):
+            key = ("list", list_name)
+            if key in group_id_map:
+                groups[ticker].append(group_id_map[key])
+    return dict(groups)
+
+
+def build_membership_matrix(
+    group_id_map: Dict[Tuple[str, str], int],
+    ticker_to_sector: Dict[str, str],
+    ticker_to_lists: Dict[str, List[str]],
+) -> Tuple[List[int], List[str], Any]:
+    """
+    Build the group x ticker membership matrix from the output of
+    build_ticker_memberships, for the groups in group_id_map
+    (("sector" | "list", name) -> group_id).
+
+    Returns (group_ids, tickers, matrix): rows follow group_ids, columns
+    follow tickers (sorted, only tickers in at least one group). The
+    matrix is a scipy.sparse CSC matrix when scipy is installed and a
+    dense numpy array otherwise; entries count how often the ticker is a
+    member of the group (normally 0 or 1).
+    """
+    group_ids = sorted(set(group_id_map.values()))
+    group_row = {gid: i for i, gid in enumerate(group_ids)}
+
+    pairs: List[Tuple[str, int]] = [
+        (ticker, group_row[gid])
+        for ticker, gids in ticker_group_ids(group_id_map, ticker_to_sector, ticker_to_lists).items()
+        for gid in gids
+    ]
+
+    tickers = sorted({ticker for ticker, _ in pairs})
+    ticker_col = {ticker: i for i, ticker in enumerate(tickers)}
+    rows = np.array([row for _, row in pairs], dtype=np.int64)
+    cols = np.array([ticker_col[ticker] for ticker, _ in pairs], dtype=np.int64)
+    shape = (len(group_ids), len(tickers))
+
+    if SCIPY_AVAILABLE:
+        # duplicate (group, ticker) pairs are summed
+        matrix = sparse.csc_matrix(
+            (np.ones(len(pairs), dtype=np.float32), (rows, cols)), shape=shape
+        )
+    else:
+        matrix = np.zeros(shape, dtype=np.float32)
+        np.add.at(matrix, (rows, cols), 1.0)
+    return group_ids, tickers, matrix